@@ -1,3 +1,25 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
 
-# Create your tests here.
+from auth_core.models import RoutingRule
+
+
+class RouteNetworkTests(TestCase):
+
+    def setUp(self):
+        RoutingRule.objects.create(
+            name='internal', source_path='/internal', target_url='https://internal.example.org/',
+            allowed_networks='10.0.0.0/8',
+        )
+        self.client.force_login(User.objects.create_user('alice', 'alice@example.com', 'unused-password'))
+
+    def test_route_refused_outside_allowed_networks(self):
+        response = self.client.get('/api/route/forward/', {'target': '/internal'}, REMOTE_ADDR='198.51.100.1')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['error'], 'This route is not allowed from this address')
+
+    def test_spoofed_forwarded_for_is_ignored(self):
+        response = self.client.get(
+            '/api/route/forward/', {'target': '/internal'}, REMOTE_ADDR='198.51.100.1', HTTP_X_FORWARDED_FOR='10.0.0.1',
+        )
+        self.assertEqual(response.status_code, 403)
@@ -1,14 +1,22 @@
 from rest_framework import status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from django.http import HttpResponse
+from django.core.exceptions import ValidationError
 from django.views.decorators.csrf import csrf_exempt
+from auth_core import metrics, networks
+from auth_core.context import get_context
 from auth_core.models import RoutingRule
+from auth_core.querybudget import query_budget
+from auth_oauth.authentication import ClientCredentialsAuthentication
 import requests
 import re
+import time
 
 
+@query_budget(3)
 @api_view(['POST', 'GET', 'PUT', 'DELETE', 'PATCH'])
 @permission_classes([AllowAny])
 def route_request(request):
@@ -37,6 +45,12 @@ def route_request(request):
             status=status.HTTP_404_NOT_FOUND
         )
     
+    if not networks.policy_for(routing_rule).permits(get_context(request).client_ip):
+        return Response(
+            {'error': 'This route is not allowed from this address'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
     # Check authentication
     if not request.user.is_authenticated:
         return Response(
@@ -56,6 +70,7 @@ def route_request(request):
         }
         
         # Forward the request
+        started = time.perf_counter()
         if request.method == 'GET':
             response = requests.get(target_url, headers=headers, params=request.GET)
         elif request.method == 'POST':
@@ -67,6 +82,9 @@ def route_request(request):
         elif request.method == 'PATCH':
             response = requests.patch(target_url, headers=headers, json=request.data)
         
+        metrics.UPSTREAM_DURATION.observe(time.perf_counter() - started, routing_rule.name)
+        metrics.UPSTREAM_REQUESTS.inc(routing_rule.name, str(response.status_code))
+        
         # Return the response from target service
         return Response(
             response.json() if response.headers.get('content-type', '').startswith('application/json') else response.text,
@@ -74,6 +92,8 @@ def route_request(request):
         )
         
     except requests.RequestException as e:
+        metrics.UPSTREAM_DURATION.observe(time.perf_counter() - started, routing_rule.name)
+        metrics.UPSTREAM_REQUESTS.inc(routing_rule.name, 'error')
         return Response(
             {'error': f'Failed to forward request: {str(e)}'},
             status=status.HTTP_502_BAD_GATEWAY
@@ -126,6 +146,13 @@ def soap_endpoint(request):
                 status=404
             )
         
+        if not networks.policy_for(routing_rule).permits(get_context(request).client_ip):
+            return HttpResponse(
+                '<?xml version="1.0"?><error>This route is not allowed from this address</error>',
+                content_type='text/xml',
+                status=403
+            )
+        
         # Authenticate if credentials provided
         authenticated = False
         if username_match and password_match:
@@ -144,12 +171,15 @@ def soap_endpoint(request):
             )
         
         # Forward SOAP request to target service
+        started = time.perf_counter()
         try:
             response = requests.post(
                 routing_rule.target_url,
                 data=soap_body,
                 headers={'Content-Type': 'text/xml'}
             )
+            metrics.UPSTREAM_DURATION.observe(time.perf_counter() - started, routing_rule.name)
+            metrics.UPSTREAM_REQUESTS.inc(routing_rule.name, str(response.status_code))
             
             return HttpResponse(
                 response.content,
@@ -158,6 +188,8 @@ def soap_endpoint(request):
             )
         
         except requests.RequestException as e:
+            metrics.UPSTREAM_DURATION.observe(time.perf_counter() - started, routing_rule.name)
+            metrics.UPSTREAM_REQUESTS.inc(routing_rule.name, 'error')
             return HttpResponse(
                 f'<?xml version="1.0"?><error>Failed to forward SOAP request: {str(e)}</error>',
                 content_type='text/xml',
@@ -172,13 +204,19 @@ def soap_endpoint(request):
         )
 
 
+@query_budget(3)
 @api_view(['GET'])
+# Gateways may read the routing table with a client_credentials token; the
+# authenticator must precede JWTAuthentication, which rejects those tokens
+@authentication_classes([ClientCredentialsAuthentication, *api_settings.DEFAULT_AUTHENTICATION_CLASSES])
 @permission_classes([IsAuthenticated])
 def list_routes(request):
     """
-    List all available routing rules.
+    List all available routing rules, for users and service clients.
     """
-    routes = RoutingRule.objects.filter(is_active=True)
+    routes = RoutingRule.objects.filter(is_active=True).only(
+        'id', 'name', 'source_path', 'target_url', 'auth_method', 'priority', 'created_at'
+    )
     
     return Response({
         'routes': [
@@ -219,12 +257,20 @@ def create_route(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
+    try:
+        allowed_networks = networks.clean_networks(request.data.get('allowed_networks'))
+        denied_networks = networks.clean_networks(request.data.get('denied_networks'))
+    except ValidationError as e:
+        return Response({'error': e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
+    
     route = RoutingRule.objects.create(
         name=name,
         source_path=source_path,
         target_url=target_url,
         auth_method=auth_method,
-        priority=priority
+        priority=priority,
+        allowed_networks=allowed_networks,
+        denied_networks=denied_networks
     )
     
     return Response({
@@ -235,6 +281,8 @@ def create_route(request):
             'source_path': route.source_path,
             'target_url': route.target_url,
             'auth_method': route.auth_method,
+            'allowed_networks': networks.split_networks(route.allowed_networks),
+            'denied_networks': networks.split_networks(route.denied_networks),
         }
     }, status=status.HTTP_201_CREATED)
 
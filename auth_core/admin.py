@@ -1,5 +1,13 @@
+from django.conf import settings
 from django.contrib import admin
-from .models import APIKey, OAuthClient, SAMLServiceProvider, RoutingRule, AuthenticationLog
+from django.http import FileResponse, Http404, HttpResponse
+from django.template.response import TemplateResponse
+from django.urls import path
+
+from . import profiling
+from .models import (
+    APIKey, OAuthClient, SAMLServiceProvider, RoutingRule, AuthenticationLog, UserAgent, ProfilingTarget
+)
 
 
 @admin.register(APIKey)
@@ -34,7 +42,61 @@ class RoutingRuleAdmin(admin.ModelAdmin):
 @admin.register(AuthenticationLog)
 class AuthenticationLogAdmin(admin.ModelAdmin):
     list_display = ['user', 'auth_method', 'success', 'ip_address', 'timestamp']
+    # __str__ shows the username, e.g. on the delete confirmation page
+    list_select_related = ['user']
     list_filter = ['auth_method', 'success', 'timestamp']
-    search_fields = ['user__username', 'ip_address']
+    search_fields = ['user__username', 'ip_address', 'user_agent__value']
     readonly_fields = ['user', 'auth_method', 'success', 'ip_address', 'user_agent', 'timestamp', 'details']
 
+
+@admin.register(UserAgent)
+class UserAgentAdmin(admin.ModelAdmin):
+    list_display = ['value', 'created_at']
+    search_fields = ['value']
+    readonly_fields = ['fingerprint', 'value', 'created_at']
+
+
+@admin.register(ProfilingTarget)
+class ProfilingTargetAdmin(admin.ModelAdmin):
+    list_display = ['url_name', 'is_active', 'sample_rate', 'remaining', 'created_at']
+    list_filter = ['is_active']
+    search_fields = ['url_name']
+    change_list_template = 'admin/auth_core/profilingtarget/change_list.html'
+
+    def get_urls(self):
+        return [
+            path('profiles/', self.admin_site.admin_view(self.profiles_view), name='auth_core_profiles'),
+            path(
+                'profiles/<str:profile_id>/<str:kind>/',
+                self.admin_site.admin_view(self.profile_download_view),
+                name='auth_core_profile_download',
+            ),
+        ] + super().get_urls()
+
+    def profiles_view(self, request):
+        if not self.has_view_permission(request):
+            raise Http404
+        context = dict(
+            self.admin_site.each_context(request),
+            title='Stored profiles',
+            opts=self.model._meta,
+            profiles=profiling.list_profiles(),
+            enabled=getattr(settings, 'PROFILING_ENABLED', False),
+        )
+        return TemplateResponse(request, 'admin/auth_core/profilingtarget/profiles.html', context)
+
+    def profile_download_view(self, request, profile_id, kind):
+        if not self.has_view_permission(request):
+            raise Http404
+        if kind == 'summary':
+            text = profiling.summary(profile_id)
+            if text is None:
+                raise Http404
+            return HttpResponse(text, content_type='text/plain; charset=utf-8')
+        path = profiling.profile_path(profile_id, kind)
+        if path is None:
+            raise Http404
+        return FileResponse(
+            open(path, 'rb'), as_attachment=True, filename=f'{profile_id}.{kind}',
+            content_type=profiling.KINDS[kind],
+        )
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class AuthCoreConfig(AppConfig):
     name = 'auth_core'
+
+    def ready(self):
+        from auth_core import signals  # noqa: F401
@@ -0,0 +1,61 @@
+"""
+Authentication audit log.
+
+Every authentication attempt is recorded through log_authentication(), which
+takes the client address and user agent from the request's RequestContext
+and counts the attempt in the auth_attempts_total metric.
+User agent strings are stored once in the user_agents table and referenced
+by id; the id of each fingerprint is cached per process.
+"""
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from auth_core import metrics
+from auth_core.cache import LRUCache
+from auth_core.context import get_context
+from auth_core.models import AuthenticationLog, UserAgent
+
+
+_user_agent_ids = LRUCache(max_size=getattr(settings, 'USER_AGENT_CACHE_SIZE', 10000))
+
+
+def user_agent_id(context):
+    """Row id of the context's user agent in user_agents, or None if it sent none."""
+    fingerprint = context.user_agent_fingerprint
+    if fingerprint is None:
+        return None
+    pk = _user_agent_ids.get(fingerprint)
+    if pk is not None:
+        return pk
+    pk = UserAgent.objects.filter(fingerprint=fingerprint).values_list('pk', flat=True).first()
+    if pk is not None:
+        _user_agent_ids.set(fingerprint, pk)
+        return pk
+    try:
+        with transaction.atomic():
+            pk = UserAgent.objects.create(fingerprint=fingerprint, value=context.user_agent).pk
+    except IntegrityError:
+        # Another request stored it first
+        return UserAgent.objects.values_list('pk', flat=True).get(fingerprint=fingerprint)
+    # Not cached before commit: a rolled-back row must not be referenced later
+    transaction.on_commit(lambda: _user_agent_ids.set(fingerprint, pk))
+    return pk
+
+
+def log_authentication(request, auth_method, success, user=None, user_id=None, details=None):
+    """Record an authentication attempt made by request, for user or user_id."""
+    context = get_context(request)
+    log = AuthenticationLog(
+        auth_method=auth_method,
+        success=success,
+        ip_address=context.client_ip,
+        user_agent_id=user_agent_id(context),
+        details=details or {},
+    )
+    if user is not None:
+        log.user = user
+    else:
+        log.user_id = user_id
+    log.save()
+    metrics.AUTH_ATTEMPTS.inc(auth_method, 'success' if success else 'failure')
+    return log
@@ -0,0 +1,38 @@
+from rest_framework.authentication import BasicAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+
+from auth_core import throttling
+
+
+class ThrottledBasicAuthentication(BasicAuthentication):
+    """
+    BasicAuthentication that refuses locked-out usernames and clients before
+    hashing the password and counts failed attempts, so the Authorization
+    header of any endpoint is not an unthrottled password oracle.
+    """
+
+    def authenticate_credentials(self, userid, password, request=None):
+        if request is not None:
+            throttling.check(request, username=userid)
+        try:
+            return super().authenticate_credentials(userid, password, request)
+        except AuthenticationFailed:
+            if request is not None:
+                throttling.failure(request, username=userid)
+            raise
+
+
+class FirstPartyJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication for the service's own access tokens. A token carrying
+    client_id or scope was delegated to an OAuth client and is only valid
+    where its scope is checked (e.g. userinfo), so it is refused here.
+    """
+
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        if 'client_id' in token or 'scope' in token:
+            raise InvalidToken('Token was issued to an OAuth client')
+        return token
@@ -0,0 +1,35 @@
+import copy
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+
+from auth_core.cache import LRUCache, get_version, versioned_ttl
+
+
+user_cache = LRUCache(
+    max_size=getattr(settings, 'USER_CACHE_MAX_SIZE', 10000),
+    ttl=versioned_ttl(getattr(settings, 'USER_CACHE_TTL', 300)),
+)
+
+
+def get_user_version(user_id):
+    return get_version('user', user_id)
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend that resolves session user ids through an in-process cache.
+
+    Entries are keyed by (user id, user version). The version is bumped on
+    every User save or delete (see auth_core.signals), so password changes
+    and deactivations take effect immediately in every process sharing the
+    Django cache. With a process-local cache other workers only notice
+    after LOCAL_CACHE_MAX_TTL (see versioned_ttl()). Changes made with
+    QuerySet.update() bypass signals and must call bump_version() themselves.
+    """
+
+    def get_user(self, user_id):
+        key = (user_id, get_user_version(user_id))
+        user = user_cache.get_or_load(key, lambda: super(CachedModelBackend, self).get_user(user_id))
+        # Hand out a copy so per-request mutations never leak between requests
+        return copy.copy(user) if user is not None else None
@@ -0,0 +1,437 @@
+"""
+Concurrent load benchmark of the authentication endpoints.
+
+The benchmark runs against a throwaway test database, created and destroyed
+like the one of `manage.py test`. The database is seeded with realistic
+volumes of users, API keys, TOTP devices, OAuth clients, routing rules and
+audit log entries. Each scenario then drives one endpoint through the full
+middleware stack with the Django test client, from a number of threads.
+Each thread has its own client and database connection. Route forwarding
+targets a stand-in upstream served from this process.
+
+Request arguments (codes, tokens, signatures) are prepared before the
+clock starts, so only the request itself is timed. Each result records
+throughput, latency percentiles and database queries per request. Results
+can be saved as a baseline and later runs compared against it.
+"""
+import base64
+import hashlib
+import hmac
+import itertools
+import json
+import os
+import random
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pyotp
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from auth_core.context import fingerprint
+from auth_core.models import APIKey, AuthenticationLog, OAuthClient, RoutingRule, UserAgent
+from auth_core.querybudget import QueryRecorder
+from auth_mfa.models import TOTPDevice
+from auth_passwordless import magic_links
+from auth_passwordless.models import OneTimeCode
+
+
+PASSWORD = 'bench-Password-1'
+USER_AGENTS = [
+    f'Mozilla/5.0 (benchmark; {platform}) Bench/{version}'
+    for platform in ('X11; Linux x86_64', 'Windows NT 10.0', 'Macintosh', 'iPhone', 'Android 14')
+    for version in range(10)
+]
+
+
+@contextmanager
+def test_database(verbosity=0):
+    """Create a fresh test database for the default connection, and destroy it afterwards."""
+    test_settings = connection.settings_dict.setdefault('TEST', {})
+    directory = None
+    if connection.vendor == 'sqlite' and not test_settings.get('NAME'):
+        # A file, not the shared in-memory database, so concurrent writers
+        # wait for the lock instead of failing at once
+        directory = tempfile.mkdtemp(prefix='auth-benchmark-')
+        test_settings['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+    setup_test_environment(debug=False)
+    old_name = connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connections.close_all()
+        connection.creation.destroy_test_db(old_name, verbosity)
+        teardown_test_environment()
+        if directory is not None:
+            test_settings['NAME'] = None
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+class _UpstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    body = b'{"status": "ok"}'
+
+    def do_GET(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    do_POST = do_PUT = do_PATCH = do_DELETE = do_GET
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def stand_in_upstream():
+    """Serve a minimal JSON API on a local port for the route scenarios; yields its URL."""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _UpstreamHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='benchmark-upstream', daemon=True)
+    thread.start()
+    try:
+        yield f'http://127.0.0.1:{server.server_port}/api'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+class Dataset:
+    """The seeded rows the scenarios draw their requests from."""
+
+    def __init__(self, users, api_keys, totp_secrets, routes):
+        self.users = users
+        self.api_keys = api_keys
+        self.totp_secrets = totp_secrets
+        self.routes = routes
+
+
+def seed(users=1000, api_keys=2000, clients=100, routes=200, logs=50000, upstream_url='http://127.0.0.1/', batch_size=2000):
+    """Bulk-insert the benchmark rows and return the Dataset."""
+    # One hash for everyone: hashing each password would take minutes
+    password = make_password(PASSWORD)
+    User.objects.bulk_create(
+        [User(username=f'bench{i}', email=f'bench{i}@example.com', password=password) for i in range(users)],
+        batch_size=batch_size,
+    )
+    user_rows = list(User.objects.filter(username__startswith='bench').order_by('pk'))
+
+    keys = [APIKey.generate_key() for _ in range(api_keys)]
+    APIKey.objects.bulk_create(
+        [APIKey(user=user_rows[i % users], name=f'bench key {i}', key=key) for i, key in enumerate(keys)],
+        batch_size=batch_size,
+    )
+
+    secrets_by_user = [pyotp.random_base32() for _ in user_rows]
+    TOTPDevice.objects.bulk_create(
+        [TOTPDevice(user=user, secret=secret, is_confirmed=True) for user, secret in zip(user_rows, secrets_by_user)],
+        batch_size=batch_size,
+    )
+
+    OAuthClient.objects.bulk_create(
+        [
+            OAuthClient(
+                client_id=f'bench-client-{i}',
+                client_secret=secrets.token_urlsafe(32),
+                client_name=f'Benchmark client {i}',
+                redirect_uris=f'https://client{i}.example.com/callback',
+            )
+            for i in range(clients)
+        ],
+        batch_size=batch_size,
+    )
+
+    paths = [f'/bench/service-{i}' for i in range(routes)]
+    RoutingRule.objects.bulk_create(
+        [
+            RoutingRule(name=f'bench-route-{i}', source_path=path, target_url=upstream_url, auth_method='jwt')
+            for i, path in enumerate(paths)
+        ],
+        batch_size=batch_size,
+    )
+
+    UserAgent.objects.bulk_create([UserAgent(fingerprint=fingerprint(value), value=value) for value in USER_AGENTS])
+    agents = list(UserAgent.objects.order_by('pk'))
+    methods = ('session', 'api_key', 'jwt', 'basic', 'totp', 'otp', 'magic_link')
+    rng = random.Random(0)
+    for start in range(0, logs, batch_size):
+        AuthenticationLog.objects.bulk_create([
+            AuthenticationLog(
+                user=rng.choice(user_rows),
+                auth_method=rng.choice(methods),
+                success=rng.random() < 0.9,
+                ip_address=f'10.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(1, 255)}',
+                user_agent=rng.choice(agents),
+            )
+            for _ in range(min(batch_size, logs - start))
+        ])
+    return Dataset(user_rows, keys, secrets_by_user, paths)
+
+
+class Scenario:
+    """
+    One endpoint to drive. prepare(dataset, n) returns the arguments of n
+    requests, built before timing starts; build(arg) turns one into the
+    (method, path, client keyword arguments) of the request, just before it
+    is sent. Some scenarios use up one seeded user per request, so limit
+    caps their request count.
+    """
+
+    def __init__(self, name, prepare, build, limit=None):
+        self.name = name
+        self.prepare = prepare
+        self.build = build
+        self.limit = limit
+
+
+def _json(path, data):
+    return 'post', path, {'data': data, 'content_type': 'application/json'}
+
+
+def _cycle(items, n):
+    return list(itertools.islice(itertools.cycle(items), n))
+
+
+def _prepare_hmac(dataset, n):
+    requests = []
+    for key in _cycle(dataset.api_keys, n):
+        timestamp = str(int(time.time()))
+        body = json.dumps({'nonce': secrets.token_hex(8)})
+        signature = hmac.new(key.encode(), f'{timestamp}{body}'.encode(), hashlib.sha256).hexdigest()
+        requests.append((key, timestamp, body, signature))
+    return requests
+
+
+def _build_hmac(arg):
+    key, timestamp, body, signature = arg
+    return 'post', '/api/auth/token/hmac/verify/', {
+        'data': body, 'content_type': 'application/json',
+        'HTTP_X_API_KEY': key, 'HTTP_X_SIGNATURE': signature, 'HTTP_X_TIMESTAMP': timestamp,
+    }
+
+
+def _basic_header(user):
+    return 'Basic ' + base64.b64encode(f'{user.username}:{PASSWORD}'.encode()).decode()
+
+
+def _prepare_otp(dataset, n):
+    users = dataset.users[:n]
+    expires_at = timezone.now() + timedelta(hours=1)
+    codes = OneTimeCode.objects.bulk_create([
+        OneTimeCode(user=user, code=OneTimeCode.generate_code(), expires_at=expires_at) for user in users
+    ])
+    return [(user.email, otp.code) for user, otp in zip(users, codes)]
+
+
+def _prepare_route(dataset, n):
+    tokens = {}
+    requests = []
+    for i, path in enumerate(_cycle(dataset.routes, n)):
+        user = dataset.users[i % len(dataset.users)]
+        if user.pk not in tokens:
+            tokens[user.pk] = str(RefreshToken.for_user(user).access_token)
+        requests.append((path, tokens[user.pk]))
+    return requests
+
+
+SCENARIOS = [
+    Scenario(
+        'session_login',
+        lambda dataset, n: _cycle(dataset.users, n),
+        lambda user: _json('/api/auth/session/login/', {'username': user.username, 'password': PASSWORD}),
+    ),
+    Scenario(
+        'api_key',
+        lambda dataset, n: _cycle(dataset.api_keys, n),
+        lambda key: ('get', '/api/auth/token/api-key/verify/', {'HTTP_X_API_KEY': key}),
+    ),
+    Scenario('hmac', _prepare_hmac, _build_hmac),
+    Scenario(
+        'basic',
+        lambda dataset, n: [_basic_header(user) for user in _cycle(dataset.users, n)],
+        lambda header: ('post', '/api/auth/token/basic/', {'HTTP_AUTHORIZATION': header}),
+    ),
+    Scenario(
+        'totp',
+        lambda dataset, n: _cycle(list(zip(dataset.users, dataset.totp_secrets)), n),
+        # The code is computed just before sending, so a long run never sends a stale one
+        lambda arg: _json('/api/auth/mfa/totp/validate/', {'username': arg[0].username, 'code': pyotp.TOTP(arg[1]).now()}),
+    ),
+    Scenario(
+        'otp',
+        _prepare_otp,
+        lambda arg: _json('/api/auth/passwordless/otp/verify/', {'email': arg[0], 'code': arg[1]}),
+        limit=lambda dataset: len(dataset.users),
+    ),
+    Scenario(
+        'magic_link',
+        lambda dataset, n: [magic_links.issue(user, user.email) for user in dataset.users[:n]],
+        lambda token: ('get', '/api/auth/passwordless/magic-link/verify/', {'data': {'token': token}}),
+        limit=lambda dataset: len(dataset.users),
+    ),
+    Scenario(
+        'jwt_obtain',
+        lambda dataset, n: _cycle(dataset.users, n),
+        lambda user: _json('/api/token/', {'username': user.username, 'password': PASSWORD}),
+    ),
+    Scenario(
+        'jwt_refresh',
+        lambda dataset, n: [str(RefreshToken.for_user(user)) for user in _cycle(dataset.users, n)],
+        lambda token: _json('/api/token/refresh/', {'refresh': token}),
+    ),
+    Scenario(
+        'route_proxy',
+        _prepare_route,
+        lambda arg: ('get', '/api/route/forward/', {'data': {'target': arg[0]}, 'HTTP_AUTHORIZATION': f'Bearer {arg[1]}'}),
+    ),
+]
+SCENARIO_NAMES = [scenario.name for scenario in SCENARIOS]
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class Result:
+    """Outcome of one scenario run."""
+
+    def __init__(self, name, elapsed, samples, failures):
+        self.name = name
+        self.elapsed = elapsed
+        self.requests = len(samples)
+        self.errors = len(failures)
+        self.failures = failures
+        self.latencies = sorted(latency for latency, _ in samples)
+        self.queries = sum(queries for _, queries in samples) / len(samples) if samples else 0.0
+
+    @property
+    def throughput(self):
+        return self.requests / self.elapsed if self.elapsed else 0.0
+
+    def percentile(self, fraction):
+        return _percentile(self.latencies, fraction) if self.latencies else 0.0
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'throughput': round(self.throughput, 2),
+            'p50': round(self.percentile(0.50), 6),
+            'p95': round(self.percentile(0.95), 6),
+            'p99': round(self.percentile(0.99), 6),
+            'queries': round(self.queries, 2),
+        }
+
+
+def _drive(scenario, args, concurrency, samples, failures):
+    counter = itertools.count()
+    lock = threading.Lock()
+
+    def worker():
+        client = Client()
+        try:
+            while True:
+                i = next(counter)
+                if i >= len(args):
+                    return
+                method, path, kwargs = scenario.build(args[i])
+                # Every request comes from a new browser, with no cookies
+                client.cookies.clear()
+                recorder = QueryRecorder()
+                started = time.perf_counter()
+                try:
+                    with recorder.record():
+                        response = getattr(client, method)(path, **kwargs)
+                except Exception as e:
+                    with lock:
+                        failures.append(f'{type(e).__name__}: {e}')
+                    continue
+                latency = time.perf_counter() - started
+                with lock:
+                    if response.status_code == 200:
+                        samples.append((latency, recorder.count))
+                    else:
+                        failures.append(f'HTTP {response.status_code}: {response.content[:200]!r}')
+        finally:
+            connection.close()
+
+    threads = [
+        threading.Thread(target=worker, name=f'benchmark-{scenario.name}-{i}')
+        for i in range(min(concurrency, len(args)) or 1)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def run_scenario(scenario, dataset, requests=200, concurrency=4, warmup=20):
+    """Send requests (after warmup untimed ones) to scenario's endpoint from concurrency threads."""
+    limit = scenario.limit(dataset) if scenario.limit else None
+    if limit is not None and requests + warmup > limit:
+        warmup = min(warmup, limit // 10)
+        requests = limit - warmup
+    args = scenario.prepare(dataset, warmup + requests)
+    _drive(scenario, args[:warmup], concurrency, [], [])
+    samples, failures = [], []
+    elapsed = _drive(scenario, args[warmup:], concurrency, samples, failures)
+    return Result(scenario.name, elapsed, samples, failures)
+
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baseline(path, results, **details):
+    with open(path, 'w') as f:
+        json.dump({'details': details, 'results': {r.name: r.as_dict() for r in results}}, f, indent=2)
+        f.write('\n')
+
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Regressions of results against a saved baseline: throughput down or p95
+    latency up by more than tolerance (a fraction), more than half a query
+    per request added, or errors where there were none.
+    """
+    regressions = []
+    previous = baseline.get('results', {})
+    for result in results:
+        base = previous.get(result.name)
+        if base is None:
+            continue
+        current = result.as_dict()
+        if current['throughput'] < base['throughput'] * (1 - tolerance):
+            regressions.append(
+                f"{result.name}: throughput {current['throughput']:.0f}/s, baseline {base['throughput']:.0f}/s"
+            )
+        if current['p95'] > base['p95'] * (1 + tolerance):
+            regressions.append(
+                f"{result.name}: p95 {current['p95'] * 1000:.1f} ms, baseline {base['p95'] * 1000:.1f} ms"
+            )
+        if current['queries'] > base['queries'] + 0.5:
+            regressions.append(
+                f"{result.name}: {current['queries']:.1f} queries per request, baseline {base['queries']:.1f}"
+            )
+        if current['errors'] and not base.get('errors'):
+            regressions.append(f"{result.name}: {current['errors']} failed requests")
+    return regressions
@@ -0,0 +1,259 @@
+"""
+In-process caching primitives shared by the authentication apps.
+"""
+import secrets
+import threading
+import time
+from collections import OrderedDict, deque
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+
+
+_MISSING = object()
+
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+class LRUCache:
+    """
+    Bounded, thread-safe LRU cache with optional per-entry TTL.
+
+    get_or_load() collapses concurrent misses for the same key into a single
+    loader call so a cold key cannot trigger a query stampede.
+    """
+
+    def __init__(self, max_size=1024, ttl=None, load_timeout=5.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.load_timeout = load_timeout
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _get_locked(self, key):
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            return _MISSING
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._get_locked(key)
+        return default if value is _MISSING else value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_or_load(self, key, loader):
+        """
+        Return the cached value for key, calling loader() on a miss.
+        None results are returned but never cached.
+        """
+        with self._lock:
+            value = self._get_locked(key)
+            if value is not _MISSING:
+                self.hits += 1
+                return value
+            self.misses += 1
+            event = self._loading.get(key)
+            owner = event is None
+            if owner:
+                event = self._loading[key] = threading.Event()
+
+        if not owner:
+            event.wait(self.load_timeout)
+            value = self.get(key, _MISSING)
+            return loader() if value is _MISSING else value
+
+        try:
+            value = loader()
+            if value is not None:
+                self.set(key, value)
+            return value
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+            event.set()
+
+
+def _version_key(namespace, key):
+    return f'auth_core:version:{namespace}:{key}'
+
+
+def get_version(namespace, key=''):
+    """
+    Return the current version token for (namespace, key) from the shared
+    Django cache, initialising it if it is missing or was evicted.
+    """
+    cache_key = _version_key(namespace, key)
+    version = cache.get(cache_key)
+    if version is None:
+        version = secrets.token_hex(8)
+        if not cache.add(cache_key, version, timeout=None):
+            version = cache.get(cache_key, version)
+    return version
+
+
+def bump_version(namespace, key=''):
+    """
+    Invalidate every cache entry derived from (namespace, key) in every
+    process sharing the Django cache.
+    """
+    version = secrets.token_hex(8)
+    cache.set(_version_key(namespace, key), version, timeout=None)
+    return version
+
+
+def is_cache_shared():
+    """Whether the default Django cache, which holds version tokens, is shared between processes."""
+    return settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_BACKENDS
+
+
+def versioned_ttl(ttl):
+    """
+    TTL for in-process entries invalidated by version token. With a
+    process-local default cache a bump_version() never reaches the other
+    workers, so only the TTL bounds how stale their entries get; it is then
+    capped at LOCAL_CACHE_MAX_TTL.
+    """
+    if is_cache_shared():
+        return ttl
+    return min(ttl, getattr(settings, 'LOCAL_CACHE_MAX_TTL', 5))
+
+
+class TTLStore:
+    """
+    Bounded in-process key/value store whose entries expire after a fixed TTL.
+
+    Entries expire in insertion order, so expired ones are swept from the
+    front of a deque on every add() in amortised O(1). pop() is atomic,
+    which makes it suitable for single-use secrets.
+    """
+
+    def __init__(self, ttl, max_size=100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data = {}
+        self._order = deque()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def _sweep_locked(self, now):
+        while self._order:
+            expires_at, key = self._order[0]
+            if expires_at > now and len(self._data) < self.max_size:
+                break
+            self._order.popleft()
+            entry = self._data.get(key)
+            if entry is not None and entry[1] == expires_at:
+                del self._data[key]
+
+    def add(self, key, value):
+        """Store value under key unless a live entry exists; return success."""
+        now = time.monotonic()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._sweep_locked(now)
+            entry = self._data.get(key)
+            if entry is not None and entry[1] > now:
+                return False
+            self._data[key] = (value, expires_at)
+            self._order.append((expires_at, key))
+            return True
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def pop(self, key):
+        """Remove and return the live value for key, or None."""
+        with self._lock:
+            entry = self._data.pop(key, None)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def sweep(self):
+        with self._lock:
+            self._sweep_locked(time.monotonic())
+
+
+class CacheTTLStore:
+    """
+    TTLStore interface backed by the shared Django cache, for deployments
+    with several worker processes. pop() relies on cache.delete() reporting
+    whether the key existed, so only one caller can win a given entry.
+    """
+
+    def __init__(self, prefix, ttl):
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _key(self, key):
+        return f'{self.prefix}:{key}'
+
+    def add(self, key, value):
+        return cache.add(self._key(key), value, timeout=self.ttl)
+
+    def get(self, key):
+        return cache.get(self._key(key))
+
+    def pop(self, key):
+        cache_key = self._key(key)
+        value = cache.get(cache_key)
+        if value is None or not cache.delete(cache_key):
+            return None
+        return value
+
+    def sweep(self):
+        # The cache backend expires entries itself
+        pass
+
+
+def ttl_store(prefix, ttl, setting, default='cache', max_size=100000):
+    """
+    Build a TTL store for the backend named by the setting ('cache' or
+    'memory'). The stores hold single-use secrets and in-flight ceremonies,
+    so with WORKER_PROCESSES > 1 a process-local store, or a 'cache' store
+    over a process-local cache, is refused.
+    """
+    backend = getattr(settings, setting, default)
+    if getattr(settings, 'WORKER_PROCESSES', 1) > 1 and (backend != 'cache' or not is_cache_shared()):
+        raise ImproperlyConfigured(
+            f'With WORKER_PROCESSES > 1, {setting} must be "cache" and CACHES must be shared (e.g. Redis)'
+        )
+    if backend == 'cache':
+        return CacheTTLStore(prefix, ttl)
+    return TTLStore(ttl, max_size=max_size)
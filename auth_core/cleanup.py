@@ -0,0 +1,212 @@
+"""
+Incremental garbage collection of expired sessions and spent credentials.
+
+Rows are deleted in bounded primary-key ranges so no statement holds locks
+for long, and the collector sleeps between chunks in proportion to how long
+each chunk took, backing off automatically when the database is busy.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+
+logger = logging.getLogger(__name__)
+
+
+class CleanupTarget:
+    """A table and the condition that marks its rows as garbage."""
+
+    def __init__(self, label, model, condition):
+        self.label = label
+        self.model = model
+        self.condition = condition
+
+    def queryset(self, now):
+        model = apps.get_model(self.model)
+        return model._default_manager.filter(self.condition(now))
+
+
+TARGETS = [
+    CleanupTarget(
+        'sessions', 'sessions.Session',
+        lambda now: Q(expire_date__lt=now),
+    ),
+    CleanupTarget(
+        'magic_links', 'auth_passwordless.MagicLink',
+        lambda now: Q(is_used=True) | Q(expires_at__lt=now),
+    ),
+    CleanupTarget(
+        'one_time_codes', 'auth_passwordless.OneTimeCode',
+        lambda now: Q(is_used=True) | Q(expires_at__lt=now),
+    ),
+    CleanupTarget(
+        'backup_codes', 'auth_mfa.BackupCode',
+        lambda now: Q(is_used=True),
+    ),
+    CleanupTarget(
+        'outbound_messages', 'auth_passwordless.OutboundMessage',
+        lambda now: Q(status__in=('sent', 'dead'), created_at__lt=now - timedelta(days=1)),
+    ),
+]
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _update_stats(label, **values):
+    with _stats_lock:
+        entry = _stats.setdefault(label, {
+            'rows_reclaimed': 0,
+            'chunks': 0,
+            'runs': 0,
+            'cursor': None,
+            'last_run_started': None,
+            'last_run_finished': None,
+            'last_run_rows': 0,
+        })
+        for name, value in values.items():
+            if name in ('rows_reclaimed', 'chunks', 'runs'):
+                entry[name] += value
+            else:
+                entry[name] = value
+
+
+def get_stats():
+    """Per-table progress and rows-reclaimed counters for this process."""
+    with _stats_lock:
+        return {label: dict(entry) for label, entry in _stats.items()}
+
+
+class Throttle:
+    """
+    Adapts chunk size and inter-chunk sleep to observed statement latency.
+
+    duty_cycle is the fraction of wall time the collector may spend inside
+    DELETE statements; a slow chunk therefore buys a proportionally longer
+    pause. Chunks slower than target_seconds halve the chunk size, chunks
+    well under it grow it again up to max_chunk_size.
+    """
+
+    def __init__(self, chunk_size=1000, duty_cycle=0.5, target_seconds=0.1,
+                 min_chunk_size=50, max_chunk_size=10000):
+        self.chunk_size = chunk_size
+        self.duty_cycle = duty_cycle
+        self.target_seconds = target_seconds
+        self.min_chunk_size = min_chunk_size
+        self.max_chunk_size = max_chunk_size
+
+    def after_chunk(self, elapsed):
+        if elapsed > self.target_seconds:
+            self.chunk_size = max(self.min_chunk_size, self.chunk_size // 2)
+        elif elapsed < self.target_seconds / 4:
+            self.chunk_size = min(self.max_chunk_size, self.chunk_size * 2)
+        if self.duty_cycle >= 1:
+            return 0.0
+        return elapsed * (1 - self.duty_cycle) / self.duty_cycle
+
+
+def collect_target(target, throttle, now=None, stop_event=None, max_chunks=None):
+    """Delete garbage rows of one target chunk by chunk; return rows deleted."""
+    now = now or timezone.now()
+    queryset = target.queryset(now)
+    cursor = None
+    deleted_total = 0
+    chunks = 0
+
+    _update_stats(target.label, runs=1, cursor=None, last_run_rows=0,
+                  last_run_started=timezone.now(), last_run_finished=None)
+
+    while not (stop_event and stop_event.is_set()):
+        if max_chunks is not None and chunks >= max_chunks:
+            break
+
+        window = queryset if cursor is None else queryset.filter(pk__gt=cursor)
+        upper = list(
+            window.order_by('pk').values_list('pk', flat=True)[throttle.chunk_size - 1:throttle.chunk_size]
+        )
+
+        started = time.monotonic()
+        if upper:
+            deleted, _ = window.filter(pk__lte=upper[0]).delete()
+        else:
+            deleted, _ = window.delete()
+        elapsed = time.monotonic() - started
+
+        chunks += 1
+        deleted_total += deleted
+        cursor = upper[0] if upper else None
+        _update_stats(target.label, rows_reclaimed=deleted, chunks=1,
+                      cursor=cursor, last_run_rows=deleted_total)
+
+        if not upper:
+            break
+
+        pause = throttle.after_chunk(elapsed)
+        if pause:
+            if stop_event:
+                stop_event.wait(pause)
+            else:
+                time.sleep(pause)
+
+    _update_stats(target.label, last_run_finished=timezone.now())
+    return deleted_total
+
+
+def run_cleanup(labels=None, chunk_size=None, duty_cycle=None, stop_event=None, max_chunks=None):
+    """Run one collection pass over every (or the selected) target."""
+    throttle = Throttle(
+        chunk_size=chunk_size or getattr(settings, 'CLEANUP_CHUNK_SIZE', 1000),
+        duty_cycle=duty_cycle or getattr(settings, 'CLEANUP_DUTY_CYCLE', 0.5),
+    )
+    results = {}
+    for target in TARGETS:
+        if labels and target.label not in labels:
+            continue
+        results[target.label] = collect_target(
+            target, throttle, stop_event=stop_event, max_chunks=max_chunks
+        )
+    return results
+
+
+_worker = None
+_worker_stop = threading.Event()
+
+
+def _periodic_loop(interval):
+    while not _worker_stop.is_set():
+        try:
+            run_cleanup(stop_event=_worker_stop)
+        except Exception:
+            logger.exception('Periodic cleanup run failed')
+        finally:
+            close_old_connections()
+        _worker_stop.wait(interval)
+
+
+def start_periodic_cleanup(interval=None):
+    """
+    Start the in-process collector thread if CLEANUP_INTERVAL is set.
+    Safe to call more than once.
+    """
+    global _worker
+    interval = interval or getattr(settings, 'CLEANUP_INTERVAL', 0)
+    if not interval or (_worker and _worker.is_alive()):
+        return _worker
+    _worker_stop.clear()
+    _worker = threading.Thread(
+        target=_periodic_loop, args=(interval,), name='auth-cleanup', daemon=True
+    )
+    _worker.start()
+    return _worker
+
+
+def stop_periodic_cleanup():
+    _worker_stop.set()
@@ -0,0 +1,64 @@
+"""
+Per-request client metadata, computed once by RequestContextMiddleware and
+shared by the authentication views, throttling and the audit log.
+"""
+import hashlib
+import re
+import time
+import uuid
+
+from auth_core import networks
+
+
+_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+
+def fingerprint(user_agent):
+    """16-byte digest identifying a user agent string in the user_agents table."""
+    return hashlib.blake2b(user_agent.encode('utf-8', 'replace'), digest_size=16).digest()
+
+
+class RequestContext:
+    """
+    Client address, user agent, request id and start time of one request.
+    The user agent fingerprint is computed on first use, since most
+    requests never write an audit row.
+    """
+
+    __slots__ = ('request_id', 'client_ip', 'user_agent', '_fingerprint', 'started')
+
+    def __init__(self, request_id, client_ip, user_agent, started=None):
+        self.request_id = request_id
+        self.client_ip = client_ip
+        self.user_agent = user_agent
+        self._fingerprint = None
+        self.started = time.monotonic() if started is None else started
+
+    @classmethod
+    def from_request(cls, request):
+        started = time.monotonic()
+        meta = request.META
+        client_ip = networks.resolve_client_ip(meta)
+        request_id = meta.get('HTTP_X_REQUEST_ID', '')
+        # Only a trusted proxy may choose the id; anything else gets a fresh one
+        if not (request_id and _REQUEST_ID.match(request_id) and networks.from_trusted_proxy(meta)):
+            request_id = uuid.uuid4().hex
+        return cls(request_id, client_ip, meta.get('HTTP_USER_AGENT', ''), started)
+
+    @property
+    def user_agent_fingerprint(self):
+        if self._fingerprint is None and self.user_agent:
+            self._fingerprint = fingerprint(self.user_agent)
+        return self._fingerprint
+
+    def elapsed(self):
+        """Seconds since the request reached the middleware."""
+        return time.monotonic() - self.started
+
+
+def get_context(request):
+    """The RequestContext of request, built here if the middleware did not run."""
+    context = getattr(request, 'request_context', None)
+    if context is None:
+        context = request.request_context = RequestContext.from_request(request)
+    return context
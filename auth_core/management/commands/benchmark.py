@@ -0,0 +1,95 @@
+import platform
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from auth_core import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Load-test the authentication endpoints concurrently against a seeded throwaway database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scenario', action='append', dest='scenarios', choices=benchmark.SCENARIO_NAMES,
+            help='Only run this scenario (may be repeated)',
+        )
+        parser.add_argument('--requests', type=int, default=200, help='Timed requests per scenario')
+        parser.add_argument('--concurrency', type=int, default=4, help='Client threads')
+        parser.add_argument('--warmup', type=int, default=20, help='Untimed requests per scenario before timing')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--api-keys', type=int, default=2000)
+        parser.add_argument('--clients', type=int, default=100, help='OAuth clients')
+        parser.add_argument('--routes', type=int, default=200)
+        parser.add_argument('--logs', type=int, default=50000, help='Authentication log entries')
+        parser.add_argument('--baseline', help='Fail if results regressed against this baseline file')
+        parser.add_argument('--save-baseline', help='Write the results to this baseline file')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help='Allowed throughput drop and p95 increase against the baseline, as a fraction',
+        )
+
+    def handle(self, *args, **options):
+        names = options['scenarios'] or benchmark.SCENARIO_NAMES
+        scenarios = [scenario for scenario in benchmark.SCENARIOS if scenario.name in names]
+        baseline = benchmark.load_baseline(options['baseline']) if options['baseline'] else None
+        concurrency = max(options['concurrency'], 1)
+        verbosity = max(options['verbosity'] - 1, 0)
+
+        results = []
+        with benchmark.test_database(verbosity), benchmark.stand_in_upstream() as upstream_url:
+            started = time.perf_counter()
+            dataset = benchmark.seed(
+                users=max(options['users'], 1),
+                api_keys=max(options['api_keys'], 1),
+                clients=options['clients'],
+                routes=max(options['routes'], 1),
+                logs=options['logs'],
+                upstream_url=upstream_url,
+            )
+            vendor = connection.vendor
+            self.stdout.write(
+                f"Seeded {options['users']} users, {options['api_keys']} API keys, {options['clients']} OAuth clients, "
+                f"{options['routes']} routes and {options['logs']} log entries in {time.perf_counter() - started:.1f}s ({vendor})"
+            )
+            self.stdout.write(
+                f"{options['requests']} requests per scenario from {concurrency} threads, "
+                f"after {options['warmup']} warm-up requests\n"
+            )
+            self.stdout.write(
+                f"{'scenario':<14} {'requests':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'errors':>7}"
+            )
+            for scenario in scenarios:
+                result = benchmark.run_scenario(
+                    scenario, dataset, requests=max(options['requests'], 1),
+                    concurrency=concurrency, warmup=max(options['warmup'], 0),
+                )
+                results.append(result)
+                line = (
+                    f'{result.name:<14} {result.requests:>8} {result.throughput:>8.1f} '
+                    f'{result.percentile(0.50) * 1000:>8.1f} {result.percentile(0.95) * 1000:>8.1f} '
+                    f'{result.percentile(0.99) * 1000:>8.1f} {result.queries:>8.1f} {result.errors:>7}'
+                )
+                base = (baseline or {}).get('results', {}).get(result.name)
+                if base and base['throughput']:
+                    line += f"  {(result.throughput / base['throughput'] - 1) * 100:+.0f}% vs baseline"
+                self.stdout.write(line)
+                for failure in sorted(set(result.failures))[:3]:
+                    self.stderr.write(f'  {failure}')
+
+        if options['save_baseline']:
+            benchmark.save_baseline(
+                options['save_baseline'], results,
+                database=vendor, concurrency=concurrency, requests=options['requests'],
+                python=platform.python_version(),
+            )
+            self.stdout.write(f"Baseline written to {options['save_baseline']}")
+
+        failed = [result.name for result in results if result.errors]
+        regressions = benchmark.compare(results, baseline, options['tolerance']) if baseline else []
+        if regressions:
+            raise CommandError('Regressions against the baseline:\n  ' + '\n  '.join(regressions))
+        if failed and not baseline:
+            raise CommandError(f"Requests failed in: {', '.join(failed)}")
+        self.stdout.write(self.style.SUCCESS('No regressions' if baseline else 'Done'))
@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from auth_core.profiling import issue_token
+
+
+class Command(BaseCommand):
+    help = 'Print a signed X-Profile header value that makes requests carrying it be profiled'
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            self.stderr.write(self.style.WARNING('PROFILING_ENABLED is off; the token has no effect until it is set'))
+        max_age = getattr(settings, 'PROFILING_TOKEN_MAX_AGE', 900)
+        self.stdout.write(f'X-Profile: {issue_token()}')
+        self.stderr.write(f'Valid for {max_age} seconds')
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from auth_core.cleanup import TARGETS, get_stats, run_cleanup
+
+
+class Command(BaseCommand):
+    help = 'Delete expired sessions, spent magic links, one-time codes and backup codes, and old outbound messages in bounded chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--table', action='append', dest='tables',
+            choices=[target.label for target in TARGETS],
+            help='Only collect this table (may be repeated)',
+        )
+        parser.add_argument('--chunk-size', type=int, help='Initial rows per DELETE')
+        parser.add_argument(
+            '--duty-cycle', type=float,
+            help='Fraction of wall time spent deleting (0-1]; lower is gentler on the database',
+        )
+        parser.add_argument('--max-chunks', type=int, help='Stop each table after this many chunks')
+
+    def handle(self, *args, **options):
+        results = run_cleanup(
+            labels=options['tables'],
+            chunk_size=options['chunk_size'],
+            duty_cycle=options['duty_cycle'],
+            max_chunks=options['max_chunks'],
+        )
+        stats = get_stats()
+        for label, deleted in results.items():
+            self.stdout.write(
+                f"{label}: {deleted} rows reclaimed in {stats[label]['chunks']} chunks"
+            )
+        self.stdout.write(self.style.SUCCESS(f'Total: {sum(results.values())} rows reclaimed'))
@@ -0,0 +1,262 @@
+"""
+Request, authentication, database and upstream metrics in the Prometheus
+text format.
+
+Each thread records into its own shard (a plain dict reached through a
+thread-local), so recording takes no lock. A scrape merges the shards of
+the process; shards of finished threads are folded into a retired total.
+
+With METRICS_DIR set (ideally on tmpfs such as /dev/shm), every process
+writes a snapshot of its totals there every METRICS_FLUSH_INTERVAL seconds
+and on exit, and a scrape served by any worker merges the snapshots of all
+of them. Clear the directory when the service starts, as snapshots of
+exited processes are kept so counters never go backwards.
+"""
+import atexit
+import json
+import logging
+import os
+import secrets
+import threading
+import weakref
+from bisect import bisect_left
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_registry = {}
+_local = threading.local()
+_shards = []
+_shards_lock = threading.Lock()
+_retired = {}
+
+
+def _values():
+    try:
+        return _local.values
+    except AttributeError:
+        values = _local.values = {}
+        with _shards_lock:
+            _shards.append((weakref.ref(threading.current_thread()), values))
+        return values
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        _registry[name] = self
+
+    def inc(self, *labels, amount=1):
+        values = _values()
+        key = (self.name, labels)
+        values[key] = values.get(key, 0) + amount
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        _registry[name] = self
+
+    def observe(self, value, *labels):
+        values = _values()
+        key = (self.name, labels)
+        # Per-bucket (not cumulative) counts, the +Inf bucket, then the sum
+        slot = values.get(key)
+        if slot is None:
+            slot = values[key] = [0] * (len(self.buckets) + 2)
+        slot[bisect_left(self.buckets, value)] += 1
+        slot[-1] += value
+
+
+REQUESTS = Counter(
+    'auth_http_requests_total', 'HTTP requests by view, method and status code.',
+    ('view', 'method', 'status'),
+)
+REQUEST_DURATION = Histogram(
+    'auth_http_request_duration_seconds', 'Time to produce a response, by view and method.',
+    ('view', 'method'),
+)
+REQUEST_QUERIES = Histogram(
+    'auth_http_request_db_queries', 'Database queries per request, by view.',
+    ('view',), buckets=QUERY_BUCKETS,
+)
+REQUEST_QUERY_DURATION = Histogram(
+    'auth_http_request_db_duration_seconds', 'Time spent in database queries per request, by view.',
+    ('view',),
+)
+AUTH_ATTEMPTS = Counter(
+    'auth_attempts_total', 'Authentication attempts recorded in the audit log, by method and result.',
+    ('method', 'result'),
+)
+AUTH_THROTTLED = Counter(
+    'auth_throttled_total', 'Requests refused by failed-attempt throttling.',
+)
+UPSTREAM_REQUESTS = Counter(
+    'auth_upstream_requests_total', 'Requests forwarded to upstream services, by route and status code.',
+    ('route', 'status'),
+)
+UPSTREAM_DURATION = Histogram(
+    'auth_upstream_request_duration_seconds', 'Upstream response time, by route.',
+    ('route',),
+)
+QUERY_BUDGET_VIOLATIONS = Counter(
+    'auth_query_budget_violations_total',
+    'Requests over their query budget (budget) or repeating a statement (repeat), by view.',
+    ('view', 'kind'),
+)
+
+
+def _merge(into, items):
+    for key, value in items:
+        current = into.get(key)
+        if current is None:
+            into[key] = list(value) if isinstance(value, list) else value
+        elif isinstance(value, list):
+            for i, part in enumerate(value):
+                current[i] += part
+        else:
+            into[key] = current + value
+
+
+def collect():
+    """This process's totals as {(metric name, label values): value}."""
+    with _shards_lock:
+        shards, live = [], []
+        for reference, values in _shards:
+            thread = reference()
+            if thread is not None and thread.is_alive():
+                shards.append((reference, values))
+                live.append(values)
+            else:
+                _merge(_retired, list(values.items()))
+        _shards[:] = shards
+        totals = {}
+        _merge(totals, _retired.items())
+    for values in live:
+        # list() copies the items without running Python code, so the owning
+        # thread cannot resize the dict while it is read
+        _merge(totals, list(values.items()))
+    return totals
+
+
+_snapshot_name = f'{os.getpid()}-{secrets.token_hex(4)}.json'
+
+
+def write_snapshot():
+    """Write this process's totals to METRICS_DIR, replacing its previous snapshot."""
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, _snapshot_name)
+    rows = [[name, list(labels), value] for (name, labels), value in collect().items()]
+    with open(path + '.tmp', 'w') as f:
+        json.dump(rows, f, separators=(',', ':'))
+    os.replace(path + '.tmp', path)
+
+
+def collect_all():
+    """Totals of every process sharing METRICS_DIR, or of this process alone."""
+    directory = getattr(settings, 'METRICS_DIR', None)
+    if not directory:
+        return collect()
+    write_snapshot()
+    totals = {}
+    for entry in os.scandir(directory):
+        if not entry.name.endswith('.json'):
+            continue
+        try:
+            with open(entry.path) as f:
+                rows = json.load(f)
+        except (OSError, ValueError):
+            # Removed or being replaced meanwhile
+            continue
+        _merge(totals, (((name, tuple(labels)), value) for name, labels, value in rows))
+    return totals
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(totals=None):
+    """Totals in the Prometheus text exposition format (version 0.0.4)."""
+    totals = collect_all() if totals is None else totals
+    by_name = {}
+    for (name, labels), value in totals.items():
+        by_name.setdefault(name, []).append((labels, value))
+    lines = []
+    for name, metric in _registry.items():
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.type}')
+        for labels, value in sorted(by_name.get(name, ()), key=lambda item: [str(v) for v in item[0]]):
+            if metric.type == 'counter':
+                lines.append(f'{name}{_labels(metric.labels, labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(metric.buckets + ('+Inf',), value[:-1]):
+                cumulative += count
+                le = 'le="%s"' % (bound if bound == '+Inf' else _number(float(bound)))
+                lines.append(f'{name}_bucket{_labels(metric.labels, labels, le)} {cumulative}')
+            lines.append(f'{name}_sum{_labels(metric.labels, labels)} {_number(float(value[-1]))}')
+            lines.append(f'{name}_count{_labels(metric.labels, labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+_worker = None
+_worker_stop = threading.Event()
+
+
+def _flush_loop(interval):
+    while not _worker_stop.wait(interval):
+        try:
+            write_snapshot()
+        except Exception:
+            logger.exception('Writing the metrics snapshot failed')
+
+
+def start_metrics_flusher(interval=None):
+    """
+    Start the thread writing this process's snapshot to METRICS_DIR, if set.
+    Safe to call more than once.
+    """
+    global _worker
+    interval = interval or getattr(settings, 'METRICS_FLUSH_INTERVAL', 5)
+    if not getattr(settings, 'METRICS_DIR', None) or (_worker and _worker.is_alive()):
+        return _worker
+    _worker_stop.clear()
+    _worker = threading.Thread(
+        target=_flush_loop, args=(interval,), name='auth-metrics', daemon=True
+    )
+    _worker.start()
+    atexit.register(write_snapshot)
+    return _worker
+
+
+def stop_metrics_flusher():
+    _worker_stop.set()
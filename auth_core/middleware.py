@@ -0,0 +1,143 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import JsonResponse
+
+from auth_core import metrics, networks, profiling, querybudget
+from auth_core.context import RequestContext, get_context
+
+
+logger = logging.getLogger(__name__)
+
+
+class RequestContextMiddleware:
+    """
+    Builds the request's RequestContext once (request.request_context),
+    refuses clients on the IP blocklist and returns the request id in the
+    X-Request-ID response header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Load the blocklist when the process starts rather than on a request
+        networks.get_blocklist()
+
+    def __call__(self, request):
+        context = request.request_context = RequestContext.from_request(request)
+        blocklist = networks.get_blocklist()
+        if blocklist is not None and blocklist.blocks(context.client_ip):
+            response = JsonResponse({'error': 'Access denied'}, status=403)
+        else:
+            response = self.get_response(request)
+        response['X-Request-ID'] = context.request_id
+        return response
+
+
+class _QueryTimer:
+    """Database execute wrapper counting a request's queries and their time."""
+
+    __slots__ = ('count', 'duration')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """
+    Records each request's count, latency and database queries per view
+    (see auth_core.metrics). Must come after RequestContextMiddleware, whose
+    start time it measures from.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = _QueryTimer()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        match = request.resolver_match
+        view = match.view_name if match is not None else 'unmatched'
+        metrics.REQUESTS.inc(view, request.method, str(response.status_code))
+        metrics.REQUEST_DURATION.observe(get_context(request).elapsed(), view, request.method)
+        metrics.REQUEST_QUERIES.observe(timer.count, view)
+        metrics.REQUEST_QUERY_DURATION.observe(timer.duration, view)
+        return response
+
+
+class QueryBudgetMiddleware:
+    """
+    Checks each request's queries against the budget its view declares with
+    @query_budget and for statements repeated within it (see
+    auth_core.querybudget).
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_BUDGET_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = querybudget.QueryRecorder()
+        with recorder.record():
+            response = self.get_response(request)
+        match = request.resolver_match
+        if match is not None:
+            querybudget.enforce(match.view_name, querybudget.violations(recorder, *querybudget.budget_of(match.func)))
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profiles requests selected by auth_core.profiling.trigger() from just
+    before the view runs until the response comes back here, and returns the
+    stored profile's id in X-Profile-Id. Not loaded at all unless
+    PROFILING_ENABLED is set; list it last so the view dominates the profile.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        profile = getattr(request, 'profile', None)
+        if profile is None:
+            return response
+        profile.stop()
+        match = request.resolver_match
+        try:
+            response['X-Profile-Id'] = profile.save(
+                url_name=match.view_name if match is not None else None,
+                method=request.method,
+                path=request.path,
+                status=response.status_code,
+                request_id=get_context(request).request_id,
+            )
+        except OSError:
+            logger.exception('Could not store the profile of %s', request.path)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        reason = profiling.trigger(request, match.view_name if match is not None else None)
+        if reason:
+            request.profile = profiling.RequestProfile.start(reason)
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='samlserviceprovider',
+            name='metadata_etag',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='samlserviceprovider',
+            name='metadata_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='samlserviceprovider',
+            name='metadata_last_modified',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='samlserviceprovider',
+            name='metadata_refreshed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='samlserviceprovider',
+            index=models.Index(fields=['metadata_url'], name='saml_servic_metadat_6848b5_idx'),
+        ),
+    ]
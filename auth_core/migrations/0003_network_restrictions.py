@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:50
+
+import auth_core.networks
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_core', '0002_saml_metadata_refresh'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='apikey',
+            name='allowed_networks',
+            field=models.TextField(blank=True, help_text='CIDRs the key may be used from, one per line; empty allows any', validators=[auth_core.networks.validate_networks]),
+        ),
+        migrations.AddField(
+            model_name='apikey',
+            name='denied_networks',
+            field=models.TextField(blank=True, help_text='CIDRs the key may not be used from, one per line', validators=[auth_core.networks.validate_networks]),
+        ),
+        migrations.AddField(
+            model_name='routingrule',
+            name='allowed_networks',
+            field=models.TextField(blank=True, help_text='CIDRs the route may be used from, one per line; empty allows any', validators=[auth_core.networks.validate_networks]),
+        ),
+        migrations.AddField(
+            model_name='routingrule',
+            name='denied_networks',
+            field=models.TextField(blank=True, help_text='CIDRs the route may not be used from, one per line', validators=[auth_core.networks.validate_networks]),
+        ),
+    ]
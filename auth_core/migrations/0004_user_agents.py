@@ -0,0 +1,64 @@
+import hashlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fingerprint(value):
+    return hashlib.blake2b(value.encode('utf-8', 'replace'), digest_size=16).digest()
+
+
+def move_user_agents(apps, schema_editor):
+    AuthenticationLog = apps.get_model('auth_core', 'AuthenticationLog')
+    UserAgent = apps.get_model('auth_core', 'UserAgent')
+    values = (
+        AuthenticationLog.objects.exclude(user_agent='')
+        .values_list('user_agent', flat=True).distinct().order_by()
+    )
+    for value in values.iterator(chunk_size=2000):
+        user_agent, _ = UserAgent.objects.get_or_create(fingerprint=fingerprint(value), defaults={'value': value})
+        AuthenticationLog.objects.filter(user_agent=value).update(user_agent_ref=user_agent)
+
+
+def restore_user_agents(apps, schema_editor):
+    AuthenticationLog = apps.get_model('auth_core', 'AuthenticationLog')
+    UserAgent = apps.get_model('auth_core', 'UserAgent')
+    for user_agent in UserAgent.objects.iterator(chunk_size=2000):
+        AuthenticationLog.objects.filter(user_agent_ref=user_agent).update(user_agent=user_agent.value)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_core', '0003_network_restrictions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserAgent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.BinaryField(max_length=16, unique=True)),
+                ('value', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'user_agents',
+            },
+        ),
+        migrations.AddField(
+            model_name='authenticationlog',
+            name='user_agent_ref',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='auth_core.useragent'),
+        ),
+        migrations.RunPython(move_user_agents, restore_user_agents),
+        migrations.RemoveField(
+            model_name='authenticationlog',
+            name='user_agent',
+        ),
+        migrations.RenameField(
+            model_name='authenticationlog',
+            old_name='user_agent_ref',
+            new_name='user_agent',
+        ),
+    ]
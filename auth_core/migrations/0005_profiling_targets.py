@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_core', '0004_user_agents'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfilingTarget',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_name', models.CharField(help_text='e.g. session_login or admin:index', max_length=200, unique=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('sample_rate', models.FloatField(default=1.0, help_text="Fraction of the view's requests to profile")),
+                ('remaining', models.PositiveIntegerField(blank=True, help_text='Profiles left to capture; empty for no limit', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'profiling_targets',
+                'ordering': ['url_name'],
+            },
+        ),
+    ]
@@ -3,6 +3,8 @@ from django.contrib.auth.models import User
 from django.utils import timezone
 import secrets
 
+from auth_core.networks import validate_networks
+
 
 class APIKey(models.Model):
     """Model for API key based authentication"""
@@ -13,6 +15,14 @@ class APIKey(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     last_used = models.DateTimeField(null=True, blank=True)
     expires_at = models.DateTimeField(null=True, blank=True)
+    allowed_networks = models.TextField(
+        blank=True, validators=[validate_networks],
+        help_text="CIDRs the key may be used from, one per line; empty allows any"
+    )
+    denied_networks = models.TextField(
+        blank=True, validators=[validate_networks],
+        help_text="CIDRs the key may not be used from, one per line"
+    )
     
     class Meta:
         db_table = 'api_keys'
@@ -65,9 +75,17 @@ class SAMLServiceProvider(models.Model):
     certificate = models.TextField(blank=True)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Maintained by the metadata refresher (auth_saml.metadata)
+    metadata_etag = models.CharField(max_length=255, blank=True)
+    metadata_last_modified = models.CharField(max_length=64, blank=True)
+    metadata_hash = models.CharField(max_length=64, blank=True)
+    metadata_refreshed_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         db_table = 'saml_service_providers'
+        indexes = [
+            models.Index(fields=['metadata_url']),
+        ]
     
     def __str__(self):
         return self.entity_id
@@ -93,6 +111,14 @@ class RoutingRule(models.Model):
     )
     is_active = models.BooleanField(default=True)
     priority = models.IntegerField(default=100)
+    allowed_networks = models.TextField(
+        blank=True, validators=[validate_networks],
+        help_text="CIDRs the route may be used from, one per line; empty allows any"
+    )
+    denied_networks = models.TextField(
+        blank=True, validators=[validate_networks],
+        help_text="CIDRs the route may not be used from, one per line"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -103,13 +129,26 @@ class RoutingRule(models.Model):
         return f"{self.name}: {self.source_path} -> {self.target_url}"
 
 
+class UserAgent(models.Model):
+    """Distinct user agent strings referenced by authentication logs"""
+    fingerprint = models.BinaryField(max_length=16, unique=True)
+    value = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'user_agents'
+    
+    def __str__(self):
+        return self.value
+
+
 class AuthenticationLog(models.Model):
     """Model for logging authentication attempts"""
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     auth_method = models.CharField(max_length=50)
     success = models.BooleanField()
     ip_address = models.GenericIPAddressField(null=True)
-    user_agent = models.TextField(blank=True)
+    user_agent = models.ForeignKey(UserAgent, on_delete=models.PROTECT, null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     details = models.JSONField(default=dict, blank=True)
     
@@ -126,3 +165,21 @@ class AuthenticationLog(models.Model):
         status = "Success" if self.success else "Failed"
         return f"{user_str} - {self.auth_method} - {status}"
 
+
+
+class ProfilingTarget(models.Model):
+    """View (by URL name) whose requests are profiled while active"""
+    url_name = models.CharField(max_length=200, unique=True, help_text="e.g. session_login or admin:index")
+    is_active = models.BooleanField(default=True)
+    sample_rate = models.FloatField(default=1.0, help_text="Fraction of the view's requests to profile")
+    remaining = models.PositiveIntegerField(
+        null=True, blank=True, help_text="Profiles left to capture; empty for no limit"
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'profiling_targets'
+        ordering = ['url_name']
+    
+    def __str__(self):
+        return self.url_name
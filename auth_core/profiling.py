@@ -0,0 +1,283 @@
+"""
+On-demand profiling of production requests.
+
+A request is profiled when ProfilingMiddleware is installed and
+PROFILING_ENABLED is set, and one of these holds:
+- it carries an X-Profile header holding a token from `manage.py
+  profiling_token`, signed with SECRET_KEY;
+- it is picked at PROFILING_SAMPLE_RATE;
+- its URL name has an active ProfilingTarget, set in the admin.
+
+The view runs under cProfile, for exact call counts and CPU time, while a
+sampling thread records the thread's stack every PROFILING_INTERVAL seconds
+in collapsed-stack form for flame graphs. Wall-clock samples include time
+blocked on the database or upstreams. Profiles are written to
+PROFILING_DIR, which keeps only the newest PROFILING_MAX_PROFILES. They are
+listed and downloaded from the ProfilingTarget admin.
+"""
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import F
+
+from auth_core.cache import LRUCache
+from auth_core.models import ProfilingTarget
+
+
+logger = logging.getLogger(__name__)
+
+SALT = 'auth_core.profiling'
+KINDS = {
+    'prof': 'application/octet-stream',
+    'collapsed': 'text/plain; charset=utf-8',
+}
+PROFILE_ID = re.compile(r'^\d{8}T\d{12}-[0-9a-f]{8}$')
+
+
+def issue_token():
+    """A token for the X-Profile header, valid for PROFILING_TOKEN_MAX_AGE seconds."""
+    return signing.TimestampSigner(salt=SALT).sign('profile')
+
+
+def valid_token(token):
+    try:
+        signing.TimestampSigner(salt=SALT).unsign(
+            token, max_age=getattr(settings, 'PROFILING_TOKEN_MAX_AGE', 900)
+        )
+    except signing.BadSignature:
+        return False
+    return True
+
+
+_targets = LRUCache(max_size=1, ttl=getattr(settings, 'PROFILING_TARGETS_TTL', 10))
+
+
+def _load_targets():
+    return {
+        target.url_name: target
+        for target in ProfilingTarget.objects.filter(is_active=True).exclude(remaining=0)
+    }
+
+
+def active_targets():
+    """Active ProfilingTargets by URL name, reloaded every PROFILING_TARGETS_TTL seconds."""
+    return _targets.get_or_load('targets', _load_targets)
+
+
+def invalidate_targets():
+    _targets.clear()
+
+
+def _claim_target(target):
+    """Use up one of a limited target's remaining profiles; False if none are left."""
+    if target.remaining is None:
+        return True
+    claimed = ProfilingTarget.objects.filter(pk=target.pk, remaining__gt=0).update(
+        remaining=F('remaining') - 1
+    )
+    if not claimed or target.remaining <= 1:
+        invalidate_targets()
+    return bool(claimed)
+
+
+def trigger(request, url_name):
+    """Why request should be profiled ('header', 'sample' or 'target'), or None."""
+    token = request.META.get('HTTP_X_PROFILE')
+    if token and valid_token(token):
+        return 'header'
+    rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+    if rate and random.random() < rate:
+        return 'sample'
+    target = active_targets().get(url_name) if url_name else None
+    if target is not None and random.random() < target.sample_rate and _claim_target(target):
+        return 'target'
+    return None
+
+
+def _frame_name(code):
+    filename = code.co_filename
+    base = str(settings.BASE_DIR) + os.sep
+    if filename.startswith(base):
+        filename = filename[len(base):]
+    else:
+        # Keep the package path of library code, e.g. django/db/models/query.py
+        marker = filename.rfind('site-packages' + os.sep)
+        if marker != -1:
+            filename = filename[marker + len('site-packages') + 1:]
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'
+
+
+class StackSampler(threading.Thread):
+    """Samples the stack of one thread until stopped, counting collapsed stacks."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='auth-profiler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+def max_concurrent():
+    """
+    Profiles a process may capture at once. From Python 3.12 cProfile hooks
+    sys.monitoring, which is process-wide: only one profiler can be enabled
+    at a time, so the limit is capped at 1.
+    """
+    limit = getattr(settings, 'PROFILING_MAX_CONCURRENT', 2)
+    return min(limit, 1) if sys.version_info >= (3, 12) else limit
+
+
+_slots = threading.BoundedSemaphore(max_concurrent())
+
+
+class RequestProfile:
+    """Profiles the current thread between start() and stop()."""
+
+    def __init__(self, trigger):
+        self.trigger = trigger
+        self.profiler = cProfile.Profile()
+        self.sampler = StackSampler(threading.get_ident(), getattr(settings, 'PROFILING_INTERVAL', 0.005))
+        self.wall_time = self.cpu_time = 0.0
+
+    @classmethod
+    def start(cls, trigger):
+        """
+        A running RequestProfile, or None if max_concurrent() are already
+        running or profiling could not be started.
+        """
+        if not _slots.acquire(blocking=False):
+            return None
+        profile = cls(trigger)
+        profile.wall_time = -time.perf_counter()
+        profile.cpu_time = -time.thread_time()
+        try:
+            profile.sampler.start()
+            profile.profiler.enable()
+        except Exception:
+            # e.g. no thread could be started, or another profiler is active
+            logger.warning('Could not start profiling a request', exc_info=True)
+            if profile.sampler.is_alive():
+                profile.sampler.stop()
+            _slots.release()
+            return None
+        return profile
+
+    def stop(self):
+        try:
+            self.profiler.disable()
+            self.wall_time += time.perf_counter()
+            self.cpu_time += time.thread_time()
+            self.sampler.stop()
+        finally:
+            _slots.release()
+
+    def save(self, **details):
+        """Write the profile into the ring and return its id."""
+        directory = profile_dir()
+        os.makedirs(directory, exist_ok=True)
+        now = datetime.now(timezone.utc)
+        # Sorts by creation time, to the microsecond
+        profile_id = f'{now:%Y%m%dT%H%M%S%f}-{os.urandom(4).hex()}'
+        path = os.path.join(directory, profile_id)
+        self.profiler.dump_stats(path + '.prof')
+        with open(path + '.collapsed', 'w', encoding='utf-8') as f:
+            f.write(self.sampler.collapsed())
+        metadata = dict(
+            details,
+            id=profile_id,
+            trigger=self.trigger,
+            created_at=now.isoformat(),
+            wall_time=round(self.wall_time, 6),
+            cpu_time=round(self.cpu_time, 6),
+            samples=sum(self.sampler.stacks.values()),
+        )
+        # Written last: a profile is listed once its metadata exists
+        with open(path + '.json.tmp', 'w', encoding='utf-8') as f:
+            json.dump(metadata, f)
+        os.replace(path + '.json.tmp', path + '.json')
+        prune()
+        return profile_id
+
+
+def profile_dir():
+    return str(getattr(settings, 'PROFILING_DIR', os.path.join(settings.BASE_DIR, 'profiles')))
+
+
+def list_profiles():
+    """Metadata of the stored profiles, newest first."""
+    directory = profile_dir()
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in sorted((n for n in names if n.endswith('.json')), reverse=True):
+        try:
+            with open(os.path.join(directory, name), encoding='utf-8') as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def prune():
+    """Delete all but the newest PROFILING_MAX_PROFILES profiles."""
+    keep = getattr(settings, 'PROFILING_MAX_PROFILES', 100)
+    directory = profile_dir()
+    ids = sorted({name.split('.', 1)[0] for name in os.listdir(directory) if PROFILE_ID.match(name.split('.', 1)[0])})
+    for profile_id in ids[:-keep] if keep else ids:
+        for suffix in ('.json', '.prof', '.collapsed'):
+            try:
+                os.remove(os.path.join(directory, profile_id + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def profile_path(profile_id, kind):
+    """Path of a stored profile's file of kind ('prof' or 'collapsed'), or None."""
+    if not PROFILE_ID.match(profile_id) or kind not in KINDS:
+        return None
+    path = os.path.join(profile_dir(), f'{profile_id}.{kind}')
+    return path if os.path.exists(path) else None
+
+
+def summary(profile_id, limit=40):
+    """The top functions of a stored profile by cumulative time, as text."""
+    path = profile_path(profile_id, 'prof')
+    if path is None:
+        return None
+    output = io.StringIO()
+    stats = pstats.Stats(path, stream=output)
+    stats.strip_dirs().sort_stats('cumulative').print_stats(limit)
+    return output.getvalue()
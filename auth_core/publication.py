@@ -0,0 +1,78 @@
+"""
+Pre-rendered publication of static-ish documents (OIDC discovery, JWKS,
+SAML metadata).
+
+Each document is rendered once per (name, version, base URL), kept in memory
+as raw and gzip-compressed bytes with strong ETags, and served as a plain
+HttpResponse. Conditional GETs are answered with 304 before anything is
+rendered or serialized.
+"""
+import gzip
+import hashlib
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+
+from auth_core.cache import LRUCache, bump_version, get_version
+
+
+class PublishedDocument:
+    __slots__ = ('body', 'gzipped', 'etag', 'gzip_etag', 'content_type')
+
+    def __init__(self, body, content_type):
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        self.body = body
+        self.content_type = content_type
+        self.etag = f'"{digest}"'
+        compressed = gzip.compress(body, compresslevel=9, mtime=0)
+        self.gzipped = compressed if len(compressed) < len(body) else None
+        self.gzip_etag = f'"{digest}-gz"'
+
+
+_documents = LRUCache(max_size=getattr(settings, 'PUBLISHED_DOCUMENTS_MAX', 512))
+
+
+def invalidate(name):
+    """Drop every rendering of document name in all processes."""
+    bump_version('published', name)
+
+
+def _matches(if_none_match, document):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    tags = set()
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        tags.add(tag[2:] if tag.startswith('W/') else tag)
+    return document.etag in tags or document.gzip_etag in tags
+
+
+def publish(request, name, render, content_type, max_age=None):
+    """
+    Serve document name for this request's base URL.
+
+    render(base_url) must return the document as bytes; it is only called
+    the first time a (name, version, base URL) combination is requested.
+    """
+    base_url = request.build_absolute_uri('/')[:-1]
+    key = (name, get_version('published', name), base_url)
+    document = _documents.get_or_load(key, lambda: PublishedDocument(render(base_url), content_type))
+
+    if max_age is None:
+        max_age = getattr(settings, 'PUBLISHED_DOCUMENTS_MAX_AGE', 3600)
+    use_gzip = document.gzipped is not None and 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+    etag = document.gzip_etag if use_gzip else document.etag
+
+    if _matches(request.META.get('HTTP_IF_NONE_MATCH'), document):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(document.gzipped if use_gzip else document.body, content_type=content_type)
+        if use_gzip:
+            response['Content-Encoding'] = 'gzip'
+    response['ETag'] = etag
+    response['Cache-Control'] = f'public, max-age={max_age}'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
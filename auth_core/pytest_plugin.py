@@ -0,0 +1,54 @@
+"""
+pytest plugin enforcing query budgets in tests; enabled by the project's
+conftest.py.
+
+Requests made during a test raise QueryBudgetExceeded when their view goes
+over its @query_budget or repeats a statement (see auth_core.querybudget),
+so the test fails. A test can also bound its own queries, wherever they are
+run from, with @pytest.mark.query_budget(max_queries). Only the test body
+counts towards that, not its fixtures. Tests run without Django settings
+configured are left alone.
+"""
+import pytest
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        'markers', 'query_budget(max_queries, max_repeats=None): fail the test if it runs more queries'
+    )
+
+
+def _django_configured():
+    try:
+        from django.conf import settings
+    except ImportError:
+        return False
+    return settings.configured
+
+
+@pytest.fixture(autouse=True)
+def _query_budget_settings():
+    if not _django_configured():
+        yield
+        return
+    from django.test import override_settings
+
+    with override_settings(QUERY_BUDGET_ENABLED=True, QUERY_BUDGET_RAISE=True):
+        yield
+
+
+@pytest.hookimpl(wrapper=True)
+def pytest_runtest_call(item):
+    marker = item.get_closest_marker('query_budget')
+    if marker is None or not _django_configured():
+        return (yield)
+    from auth_core import querybudget
+
+    # Only the test body counts, not its fixtures
+    recorder = querybudget.QueryRecorder()
+    with recorder.record():
+        result = yield
+    found = querybudget.violations(recorder, *marker.args, **marker.kwargs)
+    if found:
+        pytest.fail('; '.join(message for _, message in found), pytrace=False)
+    return result
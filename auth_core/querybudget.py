@@ -0,0 +1,108 @@
+"""
+Per-view database query budgets and N+1 detection.
+
+A view declares the most queries one request to it may run with
+@query_budget(n), placed above the DRF decorators. QueryBudgetMiddleware
+counts every query of a request and flags both a request over its view's
+budget and any statement run more than QUERY_BUDGET_MAX_REPEATS times with
+identical SQL, the mark of a relation loaded lazily in a loop (N+1).
+Transaction control (BEGIN, COMMIT, SAVEPOINT, ...) is not counted: it is
+not a query, and how much of it a backend sends through the cursor varies.
+
+Violations are logged and counted in metrics; with QUERY_BUDGET_RAISE set
+they raise QueryBudgetExceeded instead. The pytest plugin in
+auth_core.pytest_plugin sets it, so a test whose requests break a budget
+fails.
+"""
+import logging
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+from auth_core import metrics
+
+
+logger = logging.getLogger(__name__)
+
+TRANSACTION_CONTROL = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'START TRANSACTION')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(max_queries, max_repeats=None):
+    """
+    Declare the most queries a request to the view may run, and optionally
+    how often one statement may repeat (default QUERY_BUDGET_MAX_REPEATS).
+    """
+    def decorator(view_func):
+        view_func.query_budget = (max_queries, max_repeats)
+        return view_func
+    return decorator
+
+
+def is_transaction_control(sql):
+    return sql.lstrip()[:17].upper().startswith(TRANSACTION_CONTROL)
+
+
+class QueryRecorder:
+    """Database execute wrapper counting queries and runs of each statement."""
+
+    __slots__ = ('count', 'statements')
+
+    def __init__(self):
+        self.count = 0
+        self.statements = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        if is_transaction_control(sql):
+            return execute(sql, params, many, context)
+        self.count += 1
+        # Placeholders keep the SQL of one statement identical whatever its
+        # parameters, so it serves as the statement's shape
+        self.statements[sql] = self.statements.get(sql, 0) + 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def record(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    def repeated(self, max_repeats):
+        """(sql, runs) of statements run more than max_repeats times, most runs first."""
+        return sorted(
+            ((sql, runs) for sql, runs in self.statements.items() if runs > max_repeats),
+            key=lambda item: -item[1],
+        )
+
+
+def violations(recorder, max_queries=None, max_repeats=None):
+    """(kind, message) pairs for what recorder saw beyond the budget."""
+    if max_repeats is None:
+        max_repeats = getattr(settings, 'QUERY_BUDGET_MAX_REPEATS', 3)
+    found = []
+    if max_queries is not None and recorder.count > max_queries:
+        found.append(('budget', f'{recorder.count} queries, budget {max_queries}'))
+    for sql, runs in recorder.repeated(max_repeats):
+        found.append(('repeat', f'same statement run {runs} times (N+1?): {sql[:300]}'))
+    return found
+
+
+def enforce(label, found):
+    """Log and count found violations, raising QueryBudgetExceeded if QUERY_BUDGET_RAISE is set."""
+    if not found:
+        return
+    for kind, message in found:
+        metrics.QUERY_BUDGET_VIOLATIONS.inc(label, kind)
+        logger.warning('%s: %s', label, message)
+    if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+        raise QueryBudgetExceeded(f'{label}: ' + '; '.join(message for _, message in found))
+
+
+def budget_of(view_func):
+    """(max_queries, max_repeats) declared for a view, or (QUERY_BUDGET_DEFAULT, None)."""
+    return getattr(view_func, 'query_budget', None) or (getattr(settings, 'QUERY_BUDGET_DEFAULT', None), None)
@@ -0,0 +1,21 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from auth_core import profiling
+from auth_core.cache import bump_version
+from auth_core.models import ProfilingTarget
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_version(sender, instance, **kwargs):
+    """Bump the user version so cached copies of this user are discarded."""
+    bump_version('user', instance.pk)
+
+
+@receiver(post_save, sender=ProfilingTarget)
+@receiver(post_delete, sender=ProfilingTarget)
+def reload_profiling_targets(sender, instance, **kwargs):
+    """Pick up target changes in this process at once; others within PROFILING_TARGETS_TTL."""
+    profiling.invalidate_targets()
@@ -0,0 +1,71 @@
+"""
+Tests of the query budget pytest plugin, run in a child pytest with Django
+configured so the plugin is active.
+"""
+import os
+from pathlib import Path
+
+import pytest
+
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture
+def run_with_django(pytester, monkeypatch):
+    pythonpath = os.pathsep.join(filter(None, [str(PROJECT_ROOT), os.environ.get('PYTHONPATH')]))
+    monkeypatch.setenv('PYTHONPATH', pythonpath)
+    monkeypatch.setenv('DJANGO_SETTINGS_MODULE', 'auth_service.settings')
+
+    def run(source):
+        pytester.makepyfile(test_budget=source)
+        return pytester.runpytest_subprocess('-p', 'auth_core.pytest_plugin', '-p', 'no:cacheprovider')
+    return run
+
+
+def test_marker_fails_test_over_budget(run_with_django):
+    result = run_with_django('''
+import pytest
+from django.contrib.auth.models import User
+
+@pytest.mark.django_db
+@pytest.mark.query_budget(1)
+def test_two_queries():
+    User.objects.count()
+    User.objects.exists()
+''')
+    result.assert_outcomes(failed=1)
+    result.stdout.fnmatch_lines(['*2 queries, budget 1*'])
+
+
+def test_transaction_control_is_not_counted(run_with_django):
+    result = run_with_django('''
+import pytest
+from django.contrib.auth.models import User
+from django.db import transaction
+
+@pytest.mark.django_db
+@pytest.mark.query_budget(1)
+def test_savepoints():
+    with transaction.atomic():
+        with transaction.atomic():
+            User.objects.count()
+''')
+    result.assert_outcomes(passed=1)
+
+
+def test_fresh_session_login_is_within_view_budget(run_with_django):
+    result = run_with_django('''
+import pytest
+from django.contrib.auth.models import User
+
+@pytest.mark.django_db
+def test_login(client):
+    User.objects.create_user('alice', 'alice@example.com', 'correct-horse')
+    response = client.post(
+        '/api/auth/session/login/', {'username': 'alice', 'password': 'correct-horse'},
+        content_type='application/json', HTTP_USER_AGENT='Mozilla/5.0 (first visit)',
+    )
+    assert response.status_code == 200
+''')
+    result.assert_outcomes(passed=1)
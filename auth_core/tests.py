@@ -1,3 +1,357 @@
-from django.test import TestCase
+import base64
+import threading
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from auth_core import audit, cleanup, networks, profiling, throttling
+from auth_core.context import RequestContext, fingerprint
+from auth_core.models import AuthenticationLog, UserAgent
+from auth_core.cache import CacheTTLStore, TTLStore, ttl_store
+from auth_passwordless.models import MagicLink
+
+
+class NetworkParsingTests(SimpleTestCase):
+
+    def test_empty_prefix_is_invalid(self):
+        with self.assertRaises(ValueError):
+            networks.parse_network('10.0.0.0/')
+
+    def test_bare_address_is_a_host(self):
+        self.assertEqual(networks.parse_network('10.0.0.1'), (4, 0x0A000001, 32))
+
+    def test_clean_networks_accepts_text_and_lists(self):
+        self.assertEqual(networks.clean_networks('10.0.0.0/8\n# office\n192.0.2.1'), '10.0.0.0/8\n192.0.2.1')
+        self.assertEqual(networks.clean_networks(['10.0.0.0/8', '2001:db8::/32']), '10.0.0.0/8\n2001:db8::/32')
+        self.assertEqual(networks.clean_networks(None), '')
+
+    def test_clean_networks_rejects_other_json_types(self):
+        for value in (10, 1.5, True, {'network': '10.0.0.0/8'}, [10], ['10.0.0.0/8', None]):
+            with self.subTest(value=value), self.assertRaises(ValidationError):
+                networks.clean_networks(value)
+
+
+class ResolveClientIPTests(SimpleTestCase):
+
+    def setUp(self):
+        proxies = networks.NetworkTable(['10.0.0.0/8', '127.0.0.1'], networks.ALLOW)
+        patcher = mock.patch.object(networks, '_trusted_proxies', proxies)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reads_forwarded_for_from_the_right_past_trusted_hops(self):
+        meta = {'REMOTE_ADDR': '10.0.0.1', 'HTTP_X_FORWARDED_FOR': '198.51.100.7, 203.0.113.5, 10.1.2.3:8080'}
+        self.assertEqual(networks.resolve_client_ip(meta), '203.0.113.5')
+
+    def test_ignores_forwarded_for_from_an_untrusted_peer(self):
+        meta = {'REMOTE_ADDR': '203.0.113.5', 'HTTP_X_FORWARDED_FOR': '10.0.0.9'}
+        self.assertEqual(networks.resolve_client_ip(meta), '203.0.113.5')
+
+    def test_stops_at_a_malformed_entry(self):
+        meta = {'REMOTE_ADDR': '10.0.0.1', 'HTTP_X_FORWARDED_FOR': '198.51.100.7, bogus, 10.0.0.2'}
+        self.assertEqual(networks.resolve_client_ip(meta), '10.0.0.2')
+
+    def test_unix_socket_peer_is_a_trusted_proxy(self):
+        meta = {'REMOTE_ADDR': '', 'HTTP_X_FORWARDED_FOR': '[2001:db8::1]:443'}
+        self.assertEqual(networks.resolve_client_ip(meta), '2001:db8::1')
+        self.assertIsNone(networks.resolve_client_ip({'REMOTE_ADDR': ''}))
+
+    def test_rejects_malformed_peer_address(self):
+        self.assertIsNone(networks.resolve_client_ip({'REMOTE_ADDR': 'unix:/run/app.sock'}))
+
+
+class NetworkPolicyTests(SimpleTestCase):
+
+    def test_most_specific_network_wins(self):
+        policy = networks.NetworkPolicy(allowed=['10.0.0.0/8', '10.1.2.0/24'], denied=['10.1.0.0/16'])
+        self.assertTrue(policy.permits('10.9.9.9'))
+        self.assertFalse(policy.permits('10.1.9.9'))
+        self.assertTrue(policy.permits('10.1.2.3'))
+        self.assertFalse(policy.permits('192.0.2.1'))
+
+    def test_deny_wins_a_tie(self):
+        policy = networks.NetworkPolicy(allowed=['192.0.2.0/24'], denied=['192.0.2.0/24'])
+        self.assertFalse(policy.permits('192.0.2.1'))
+
+    def test_deny_list_alone_permits_everything_else(self):
+        policy = networks.NetworkPolicy(denied=['2001:db8::/32'])
+        self.assertFalse(policy.permits('2001:db8::1'))
+        self.assertTrue(policy.permits('::ffff:192.0.2.1'))
+        self.assertFalse(networks.NetworkPolicy(denied=['192.0.2.0/24']).permits('::ffff:192.0.2.1'))
+
+
+LOCMEM = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+REDIS = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost'}}
+
+
+class TTLStoreFactoryTests(SimpleTestCase):
+
+    def test_single_worker_may_keep_stores_in_memory(self):
+        with override_settings(WORKER_PROCESSES=1, CACHES=LOCMEM, EXAMPLE_STORE='memory'):
+            self.assertIsInstance(ttl_store('example', 60, 'EXAMPLE_STORE'), TTLStore)
+            self.assertIsInstance(ttl_store('example', 60, 'UNSET_STORE'), CacheTTLStore)
+
+    def test_several_workers_need_a_shared_cache_store(self):
+        with override_settings(WORKER_PROCESSES=4, CACHES=REDIS, EXAMPLE_STORE='memory'):
+            with self.assertRaisesMessage(ImproperlyConfigured, 'EXAMPLE_STORE'):
+                ttl_store('example', 60, 'EXAMPLE_STORE')
+            self.assertIsInstance(ttl_store('example', 60, 'UNSET_STORE'), CacheTTLStore)
+        with override_settings(WORKER_PROCESSES=4, CACHES=LOCMEM), self.assertRaises(ImproperlyConfigured):
+            ttl_store('example', 60, 'UNSET_STORE')
+
+
+class RequestProfileStartTests(SimpleTestCase):
+
+    def test_failed_start_gives_back_its_slot(self):
+        busy = ValueError('Another profiling tool is already active')
+        with mock.patch('cProfile.Profile.enable', side_effect=busy), \
+                self.assertLogs('auth_core.profiling', 'WARNING'):
+            for _ in range(profiling.max_concurrent() + 1):
+                self.assertIsNone(profiling.RequestProfile.start('header'))
+        self.assertNotIn('auth-profiler', [thread.name for thread in threading.enumerate()])
+
+        profile = profiling.RequestProfile.start('header')
+        self.assertIsNotNone(profile)
+        profile.stop()
+
+
+class SketchStoreTests(SimpleTestCase):
+
+    def test_counts_never_undercount(self):
+        store = throttling.SketchStore(width=8, depth=2)
+        for n in range(40):
+            store.hit([(f'key{n % 10}', 60)] * (n % 10 + 1), 0)
+        counts = store.counts([(f'key{n}', 60) for n in range(10)], 0)
+        for n, (previous, current) in enumerate(counts):
+            self.assertEqual(previous, 0)
+            self.assertGreaterEqual(current, 4 * (n + 1))
+
+    def test_conservative_update_leaves_higher_cells_alone(self):
+        store = throttling.SketchStore(width=4, depth=2)
+        keys = [f'key{n}' for n in range(200)]
+        # Two keys sharing their first row's cell but not their second
+        a, b = next(
+            (a, b) for a in keys for b in keys
+            if store._cells(a)[0] == store._cells(b)[0] and store._cells(a)[1] != store._cells(b)[1]
+        )
+        for _ in range(5):
+            store.hit([(a, 60)], 0)
+        store.hit([(b, 60)], 0)
+        self.assertEqual(store.counts([(a, 60), (b, 60)], 0), [(0, 5), (0, 1)])
+        shared = store._cells(a)[0]
+        self.assertEqual(store._windows[60][1][shared], 5)
+
+    def test_current_window_becomes_previous(self):
+        store = throttling.SketchStore(width=64, depth=2)
+        store.hit([('key', 60)], 30)
+        self.assertEqual(store.counts([('key', 60)], 90), [(1, 0)])
+        self.assertEqual(store.counts([('key', 60)], 150), [(0, 0)])
+
+
+class SlidingWindowWaitTests(SimpleTestCase):
+
+    @staticmethod
+    def estimate(previous, current, fraction, window, after):
+        """The sliding estimate `after` seconds from now, with no further failures."""
+        position = fraction + after / window
+        if position < 1:
+            return previous * (1 - position) + current
+        return current * max(0.0, 2 - position)
+
+    def test_locked_by_current_window(self):
+        self.assertAlmostEqual(throttling._wait(0, 10, 0.5, 5, 60), 60)
+
+    def test_locked_by_fading_previous_window(self):
+        self.assertAlmostEqual(throttling._wait(8, 3, 0.25, 5, 60), 30)
+
+    def test_estimate_reaches_limit_when_wait_ends(self):
+        for previous, current, fraction in [(0, 5, 0.0), (20, 1, 0.1), (6, 4, 0.5), (3, 9, 0.9), (50, 50, 0.3)]:
+            with self.subTest(previous=previous, current=current, fraction=fraction):
+                wait = throttling._wait(previous, current, fraction, 5, 60)
+                # check() refuses while the estimate is at or over the limit
+                self.assertLess(self.estimate(previous, current, fraction, 60, wait + 0.01), 5)
+                if wait > 1:
+                    self.assertGreaterEqual(self.estimate(previous, current, fraction, 60, wait - 1), 5)
+
+
+@override_settings(THROTTLE_ENABLED=True, THROTTLE_RULES={'username': [(3, 86400)]})
+class LockoutTests(TestCase):
+
+    def setUp(self):
+        User.objects.create_user('alice', 'alice@example.com', 'correct-horse')
+        patcher = mock.patch.object(throttling, 'store', throttling.SketchStore(width=256, depth=2))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def session_login(self, password):
+        return self.client.post(
+            '/api/auth/session/login/', {'username': 'alice', 'password': password}, content_type='application/json'
+        )
+
+    def basic(self, password):
+        return 'Basic ' + base64.b64encode(f'alice:{password}'.encode()).decode('ascii')
+
+    def assertLockedWithoutHashing(self, send):
+        with mock.patch('django.contrib.auth.base_user.check_password') as check_password, \
+                mock.patch('django.contrib.auth.base_user.make_password') as make_password:
+            response = send('correct-horse')
+        self.assertEqual(response.status_code, 429)
+        # Three failures in the current day only fade out once it is over
+        self.assertTrue(0 < int(response['Retry-After']) <= 86400)
+        check_password.assert_not_called()
+        make_password.assert_not_called()
+
+    def test_session_login_locks_after_the_tier(self):
+        for _ in range(3):
+            self.assertEqual(self.session_login('wrong').status_code, 401)
+        self.assertLockedWithoutHashing(self.session_login)
+
+    def test_basic_auth_endpoint_locks_after_the_tier(self):
+        def send(password):
+            return self.client.get('/api/auth/token/basic/', HTTP_AUTHORIZATION=self.basic(password))
+
+        for _ in range(3):
+            self.assertEqual(send('wrong').status_code, 401)
+        self.assertLockedWithoutHashing(send)
+
+    def test_basic_authentication_class_locks_after_the_tier(self):
+        def send(password):
+            return self.client.get('/api/auth/session/status/', HTTP_AUTHORIZATION=self.basic(password))
+
+        for _ in range(3):
+            self.assertEqual(send('wrong').status_code, 401)
+        self.assertLockedWithoutHashing(send)
+
+
+class CleanupThrottleTests(SimpleTestCase):
+
+    def test_chunk_size_follows_latency(self):
+        throttle = cleanup.Throttle(chunk_size=1000, target_seconds=0.1, min_chunk_size=50, max_chunk_size=4000)
+        throttle.after_chunk(0.5)
+        self.assertEqual(throttle.chunk_size, 500)
+        throttle.after_chunk(0.05)
+        self.assertEqual(throttle.chunk_size, 500)
+        for _ in range(5):
+            throttle.after_chunk(0.01)
+        self.assertEqual(throttle.chunk_size, 4000)
+        for _ in range(10):
+            throttle.after_chunk(1)
+        self.assertEqual(throttle.chunk_size, 50)
+
+    def test_pause_keeps_the_duty_cycle(self):
+        self.assertAlmostEqual(cleanup.Throttle(duty_cycle=0.25).after_chunk(0.2), 0.6)
+        self.assertEqual(cleanup.Throttle(duty_cycle=1).after_chunk(0.2), 0)
+
+
+class CollectTargetTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'unused-password')
+        now = timezone.now()
+        for n in range(7):
+            # Interleave garbage with live links so every chunk has both
+            self.link(f'expired{n}', expires_at=now - timedelta(minutes=1))
+            self.link(f'used{n}', expires_at=now + timedelta(minutes=10), is_used=True)
+            self.link(f'live{n}', expires_at=now + timedelta(minutes=10))
+        self.target = next(target for target in cleanup.TARGETS if target.label == 'magic_links')
+
+    def link(self, token, **fields):
+        MagicLink.objects.create(user=self.user, token=token, email=self.user.email, **fields)
+
+    def test_deletes_garbage_in_chunks(self):
+        throttle = cleanup.Throttle(chunk_size=4, duty_cycle=1, target_seconds=60, max_chunk_size=4)
+        self.assertEqual(cleanup.collect_target(self.target, throttle), 14)
+        self.assertEqual(sorted(MagicLink.objects.values_list('token', flat=True)), [f'live{n}' for n in range(7)])
+        stats = cleanup.get_stats()['magic_links']
+        self.assertEqual(stats['last_run_rows'], 14)
+        self.assertIsNone(stats['cursor'])
+        self.assertIsNotNone(stats['last_run_finished'])
+
+    def test_max_chunks_stops_early_and_a_later_run_finishes(self):
+        throttle = cleanup.Throttle(chunk_size=4, duty_cycle=1, target_seconds=60, max_chunk_size=4)
+        self.assertEqual(cleanup.collect_target(self.target, throttle, max_chunks=2), 8)
+        self.assertEqual(MagicLink.objects.count(), 13)
+        self.assertIsNotNone(cleanup.get_stats()['magic_links']['cursor'])
+        self.assertEqual(cleanup.collect_target(self.target, throttle), 6)
+        self.assertEqual(MagicLink.objects.count(), 7)
+
+    def test_stop_event_ends_the_run(self):
+        stop = threading.Event()
+        stop.set()
+        self.assertEqual(cleanup.collect_target(self.target, cleanup.Throttle(duty_cycle=1), stop_event=stop), 0)
+        self.assertEqual(MagicLink.objects.count(), 21)
+
+
+class UserAgentMigrationTests(TransactionTestCase):
+
+    before = [('auth_core', '0003_network_restrictions')]
+    after = [('auth_core', '0004_user_agents')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def test_user_agents_move_forward_and_back(self):
+        old_apps = self.migrate(self.before)
+        Log = old_apps.get_model('auth_core', 'AuthenticationLog')
+        for value in ('curl/8.0', 'Firefox/130.0', 'curl/8.0', ''):
+            Log.objects.create(auth_method='session', success=True, user_agent=value, details={})
+
+        new_apps = self.migrate(self.after)
+        Log = new_apps.get_model('auth_core', 'AuthenticationLog')
+        UserAgent = new_apps.get_model('auth_core', 'UserAgent')
+        self.assertEqual(sorted(UserAgent.objects.values_list('value', flat=True)), ['Firefox/130.0', 'curl/8.0'])
+        self.assertEqual(
+            bytes(UserAgent.objects.get(value='curl/8.0').fingerprint), fingerprint('curl/8.0')
+        )
+        self.assertEqual(
+            sorted((log.user_agent.value if log.user_agent else '') for log in Log.objects.all()),
+            ['', 'Firefox/130.0', 'curl/8.0', 'curl/8.0'],
+        )
+
+        old_apps = self.migrate(self.before)
+        Log = old_apps.get_model('auth_core', 'AuthenticationLog')
+        self.assertEqual(
+            sorted(Log.objects.values_list('user_agent', flat=True)), ['', 'Firefox/130.0', 'curl/8.0', 'curl/8.0']
+        )
+
+
+class UserAgentIdTests(TestCase):
+
+    def setUp(self):
+        audit._user_agent_ids.clear()
+        self.addCleanup(audit._user_agent_ids.clear)
+
+    def context(self, user_agent):
+        return RequestContext('request', '192.0.2.1', user_agent)
+
+    def test_rows_are_shared_by_fingerprint(self):
+        first = audit.user_agent_id(self.context('curl/8.0'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(audit.user_agent_id(self.context('curl/8.0')), first)
+        self.assertIsNone(audit.user_agent_id(self.context('')))
+        self.assertEqual(UserAgent.objects.count(), 1)
+
+    def test_row_stored_by_a_parallel_request(self):
+        # Another request inserts the row between our lookup and our INSERT
+        stored = UserAgent.objects.create(fingerprint=fingerprint('curl/8.0'), value='curl/8.0')
+        lookups = UserAgent.objects.none().values_list('pk', flat=True)
+        with mock.patch.object(UserAgent.objects, 'filter', return_value=lookups):
+            self.assertEqual(audit.user_agent_id(self.context('curl/8.0')), stored.pk)
+        self.assertEqual(UserAgent.objects.count(), 1)
+
+    def test_logged_attempt_references_the_user_agent(self):
+        request = RequestFactory().post('/', HTTP_USER_AGENT='Firefox/130.0')
+        audit.log_authentication(request, 'session', False, details={'username': 'alice'})
+        self.assertEqual(AuthenticationLog.objects.get().user_agent.value, 'Firefox/130.0')
@@ -0,0 +1,212 @@
+"""
+Failed-attempt throttling for the credential-checking endpoints.
+
+Failures are counted per username, client IP, client subnet (/24 for IPv4,
+/64 for IPv6) and API key in sliding windows, approximated from the current
+and previous fixed window. Each dimension has tiers of (limit, window)
+(see THROTTLE_RULES): a few failures lock a key for a minute, persistent
+ones for hours, so lockouts grow with the attack. check() runs before any
+password hashing or database lookup and raises DRF's Throttled, which
+answers 429 with Retry-After.
+
+Counters live in THROTTLE_STORE: 'memory' keeps count-min sketches per
+window in this process, so memory is fixed however many keys an attacker
+cycles through (sketches only ever overestimate); 'cache' keeps exact
+counters in the shared Django cache for multi-process deployments.
+"""
+import hashlib
+import ipaddress
+import math
+import os
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.exceptions import Throttled
+
+from auth_core import metrics
+from auth_core.context import get_context
+
+
+DEFAULT_RULES = {
+    'username': [(5, 60), (20, 900), (100, 86400)],
+    'ip': [(30, 60), (300, 3600)],
+    'subnet': [(100, 60), (1000, 3600)],
+    'api_key': [(10, 60), (100, 3600)],
+}
+
+
+class SketchStore:
+    """
+    Per-process counters held in count-min sketches, one pair (current and
+    previous window) per window length. Cells are chosen with a keyed hash
+    so an attacker cannot aim collisions at another user's counters.
+    """
+
+    def __init__(self, width=32768, depth=4):
+        self.width = width
+        self.depth = depth
+        self._salt = os.urandom(16)
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def _cells(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=4 * self.depth, key=self._salt).digest()
+        return [
+            row * self.width + int.from_bytes(digest[row * 4:row * 4 + 4], 'little') % self.width
+            for row in range(self.depth)
+        ]
+
+    def _empty(self):
+        return array('I', bytes(4 * self.width * self.depth))
+
+    def _sketches_locked(self, window, index):
+        entry = self._windows.get(window)
+        if entry is None or entry[0] != index:
+            previous = entry[1] if entry is not None and entry[0] == index - 1 else None
+            entry = self._windows[window] = (index, self._empty(), previous)
+        return entry[1], entry[2]
+
+    def counts(self, pairs, now):
+        """(previous, current) window counts for each (key, window) pair."""
+        result = []
+        with self._lock:
+            for key, window in pairs:
+                current, previous = self._sketches_locked(window, int(now // window))
+                cells = self._cells(key)
+                result.append((
+                    min(previous[cell] for cell in cells) if previous is not None else 0,
+                    min(current[cell] for cell in cells),
+                ))
+        return result
+
+    def hit(self, pairs, now):
+        with self._lock:
+            for key, window in pairs:
+                current, _ = self._sketches_locked(window, int(now // window))
+                cells = self._cells(key)
+                # Conservative update: only raise the cells at the key's
+                # estimate, which keeps collisions from inflating the others
+                value = min(min(current[cell] for cell in cells) + 1, 0xFFFFFFFF)
+                for cell in cells:
+                    if current[cell] < value:
+                        current[cell] = value
+
+
+class CacheStore:
+    """Exact counters in the shared Django cache, one key per key and window."""
+
+    prefix = 'auth_core:throttle'
+
+    def _cache_key(self, key, window, index):
+        # Hashed so raw usernames and API keys never appear in the cache
+        digest = hashlib.sha256(key.encode()).hexdigest()[:32]
+        return f'{self.prefix}:{window}:{index}:{digest}'
+
+    def counts(self, pairs, now):
+        keys = []
+        for key, window in pairs:
+            index = int(now // window)
+            keys.append((self._cache_key(key, window, index - 1), self._cache_key(key, window, index)))
+        values = cache.get_many([k for pair in keys for k in pair])
+        return [(values.get(previous, 0), values.get(current, 0)) for previous, current in keys]
+
+    def hit(self, pairs, now):
+        for key, window in pairs:
+            cache_key = self._cache_key(key, window, int(now // window))
+            cache.add(cache_key, 0, timeout=2 * window)
+            try:
+                cache.incr(cache_key)
+            except ValueError:
+                # Evicted between add() and incr()
+                cache.set(cache_key, 1, timeout=2 * window)
+
+
+def _build_store():
+    if getattr(settings, 'THROTTLE_STORE', 'memory') == 'cache':
+        return CacheStore()
+    return SketchStore(
+        width=getattr(settings, 'THROTTLE_SKETCH_WIDTH', 32768),
+        depth=getattr(settings, 'THROTTLE_SKETCH_DEPTH', 4),
+    )
+
+
+store = _build_store()
+
+
+def _rules():
+    return getattr(settings, 'THROTTLE_RULES', DEFAULT_RULES)
+
+
+def subnet_of(ip):
+    """The /24 (IPv4) or /64 (IPv6) network containing ip, or None if ip is not an address."""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    prefix = 24 if address.version == 4 else 64
+    return str(ipaddress.ip_network(f'{address}/{prefix}', strict=False))
+
+
+def request_keys(request, username=None, api_key=None):
+    """The (dimension, value) pairs a request's failures are counted under."""
+    keys = []
+    if username:
+        keys.append(('username', str(username).strip().lower()))
+    if api_key:
+        keys.append(('api_key', api_key))
+    ip = get_context(request).client_ip
+    if ip:
+        keys.append(('ip', ip))
+        subnet = subnet_of(ip)
+        if subnet:
+            keys.append(('subnet', subnet))
+    return keys
+
+
+def _pairs(keys):
+    rules = _rules()
+    return [
+        (f'{dimension}:{value}', window, limit)
+        for dimension, value in keys
+        for limit, window in rules.get(dimension, ())
+    ]
+
+
+def _wait(previous, current, fraction, limit, window):
+    """Seconds until the sliding estimate of a locked key drops below limit."""
+    if current < limit and previous:
+        # Still inside the current window, as the previous one fades out
+        return window * max(0.0, 1 - fraction - (limit - current) / previous)
+    # In the next window the current count fades out in turn
+    return window * (1 - fraction) + window * max(0.0, 1 - limit / current)
+
+
+def check(request, username=None, api_key=None):
+    """Raise Throttled if any of the request's keys has reached a limit."""
+    if not getattr(settings, 'THROTTLE_ENABLED', True):
+        return
+    pairs = _pairs(request_keys(request, username, api_key))
+    if not pairs:
+        return
+    now = time.time()
+    wait = None
+    counts = store.counts([(key, window) for key, window, _ in pairs], now)
+    for (key, window, limit), (previous, current) in zip(pairs, counts):
+        fraction = (now % window) / window
+        if previous * (1 - fraction) + current >= limit:
+            wait = max(wait or 0.0, _wait(previous, current, fraction, limit, window))
+    if wait is not None:
+        metrics.AUTH_THROTTLED.inc()
+        raise Throttled(wait=max(1, math.ceil(wait)))
+
+
+def failure(request, username=None, api_key=None):
+    """Count a failed attempt against each of the request's keys."""
+    if not getattr(settings, 'THROTTLE_ENABLED', True):
+        return
+    pairs = _pairs(request_keys(request, username, api_key))
+    if pairs:
+        store.hit([(key, window) for key, window, _ in pairs], time.time())
@@ -1,3 +1,15 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_GET
 
-# Create your views here.
+from auth_core import metrics, networks
+from auth_core.context import get_context
+
+
+@require_GET
+def metrics_view(request):
+    """Prometheus scrape endpoint, restricted to METRICS_ALLOWED_NETWORKS."""
+    allowed = '\n'.join(getattr(settings, 'METRICS_ALLOWED_NETWORKS', ['127.0.0.1', '::1']))
+    if not networks.compile_policy(allowed, '').permits(get_context(request).client_ip):
+        return JsonResponse({'error': 'Access denied'}, status=403)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class AuthMfaConfig(AppConfig):
     name = 'auth_mfa'
+
+    def ready(self):
+        from auth_mfa import signals  # noqa: F401
@@ -0,0 +1,47 @@
+from django.db import migrations, models
+from django.utils.crypto import salted_hmac
+
+
+def hash_code(user_id, code):
+    # Frozen copy of BackupCode.hash_code
+    normalized = ''.join(str(code).split()).replace('-', '').upper()
+    return salted_hmac('auth_mfa.BackupCode', f'{user_id}:{normalized}').hexdigest()
+
+
+def hash_existing_codes(apps, schema_editor):
+    BackupCode = apps.get_model('auth_mfa', 'BackupCode')
+    batch = []
+    for backup_code in BackupCode.objects.only('pk', 'user_id', 'code').iterator(chunk_size=2000):
+        backup_code.code_hash = hash_code(backup_code.user_id, backup_code.code)
+        batch.append(backup_code)
+        if len(batch) >= 2000:
+            BackupCode.objects.bulk_update(batch, ['code_hash'])
+            batch = []
+    if batch:
+        BackupCode.objects.bulk_update(batch, ['code_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_mfa', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='backupcode',
+            name='code_hash',
+            field=models.CharField(default='', max_length=64),
+            preserve_default=False,
+        ),
+        # Irreversible: plain-text codes cannot be recovered from their hashes
+        migrations.RunPython(hash_existing_codes),
+        migrations.RemoveField(
+            model_name='backupcode',
+            name='code',
+        ),
+        migrations.AddIndex(
+            model_name='backupcode',
+            index=models.Index(fields=['user', 'code_hash'], name='backup_code_user_id_330edd_idx'),
+        ),
+    ]
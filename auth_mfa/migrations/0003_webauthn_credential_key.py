@@ -0,0 +1,57 @@
+import base64
+import binascii
+import hashlib
+
+from django.db import migrations, models
+
+
+def raw_credential_id(credential_id):
+    # Credential IDs are stored base64url-encoded; keep undecodable legacy values as-is
+    try:
+        return base64.urlsafe_b64decode(credential_id + '=' * (-len(credential_id) % 4))
+    except (binascii.Error, ValueError):
+        return credential_id.encode()
+
+
+def fill_credential_keys(apps, schema_editor):
+    WebAuthnCredential = apps.get_model('auth_mfa', 'WebAuthnCredential')
+    batch = []
+    for credential in WebAuthnCredential.objects.only('pk', 'credential_id').iterator(chunk_size=2000):
+        credential.credential_key = hashlib.sha256(raw_credential_id(credential.credential_id)).digest()
+        batch.append(credential)
+        if len(batch) >= 2000:
+            WebAuthnCredential.objects.bulk_update(batch, ['credential_key'])
+            batch = []
+    if batch:
+        WebAuthnCredential.objects.bulk_update(batch, ['credential_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_mfa', '0002_hashed_backup_codes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webauthncredential',
+            name='credential_key',
+            field=models.BinaryField(max_length=32, null=True),
+        ),
+        migrations.RunPython(fill_credential_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='webauthncredential',
+            name='credential_key',
+            field=models.BinaryField(max_length=32, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='webauthncredential',
+            name='credential_id',
+            field=models.TextField(),
+        ),
+        migrations.AlterField(
+            model_name='webauthncredential',
+            name='sign_count',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
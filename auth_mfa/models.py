@@ -1,5 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
 import secrets
 
 
@@ -24,15 +26,18 @@ class TOTPDevice(models.Model):
 
 
 class BackupCode(models.Model):
-    """Model for backup codes for 2FA"""
+    """Model for backup codes for 2FA (stored as keyed hashes)"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='backup_codes')
-    code = models.CharField(max_length=16, unique=True)
+    code_hash = models.CharField(max_length=64)
     is_used = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     used_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         db_table = 'backup_codes'
+        indexes = [
+            models.Index(fields=['user', 'code_hash']),
+        ]
     
     def __str__(self):
         status = "Used" if self.is_used else "Active"
@@ -41,14 +46,40 @@ class BackupCode(models.Model):
     @staticmethod
     def generate_code():
         return secrets.token_hex(8).upper()
+    
+    @staticmethod
+    def hash_code(user_id, code):
+        """Keyed hash of a backup code, bound to its user; input is normalized."""
+        normalized = ''.join(str(code).split()).replace('-', '').upper()
+        return salted_hmac('auth_mfa.BackupCode', f'{user_id}:{normalized}').hexdigest()
+    
+    @classmethod
+    def issue(cls, user, count=10):
+        """Create count codes with a single INSERT and return them in plain text."""
+        codes = [cls.generate_code() for _ in range(count)]
+        cls.objects.bulk_create([
+            cls(user=user, code_hash=cls.hash_code(user.pk, code)) for code in codes
+        ])
+        return codes
+    
+    @classmethod
+    def consume(cls, user, code):
+        """
+        Mark the matching unused code as used. The check and the update are a
+        single conditional UPDATE, so a code can never be used twice.
+        """
+        return cls.objects.filter(
+            user=user, code_hash=cls.hash_code(user.pk, code), is_used=False
+        ).update(is_used=True, used_at=timezone.now()) > 0
 
 
 class WebAuthnCredential(models.Model):
-    """Model for WebAuthn/FIDO2 credentials"""
+    """Model for WebAuthn/FIDO2 credentials (see auth_mfa.passkeys)"""
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='webauthn_credentials')
-    credential_id = models.CharField(max_length=255, unique=True)
-    public_key = models.TextField()
-    sign_count = models.IntegerField(default=0)
+    credential_id = models.TextField()  # base64url
+    credential_key = models.BinaryField(max_length=32, unique=True)  # SHA-256 of the raw credential ID
+    public_key = models.TextField()  # base64url COSE key
+    sign_count = models.BigIntegerField(default=0)
     name = models.CharField(max_length=100, default="Security Key")
     created_at = models.DateTimeField(auto_now_add=True)
     last_used = models.DateTimeField(null=True, blank=True)
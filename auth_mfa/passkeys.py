@@ -0,0 +1,308 @@
+"""
+WebAuthn registration and authentication ceremonies.
+
+Challenges are kept in a TTL store rather than the database and can be
+answered once. Credentials are found by credential_key, the SHA-256 of the
+credential ID, and their COSE public keys are decoded once into cached
+verifiers, so an assertion costs one signature check and one conditional
+UPDATE of the signature counter.
+"""
+import hashlib
+import hmac
+import logging
+
+from cryptography.exceptions import InvalidSignature
+from django.conf import settings
+from django.db import IntegrityError
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+from webauthn import (
+    generate_authentication_options,
+    generate_registration_options,
+    verify_registration_response,
+)
+from webauthn.helpers import (
+    base64url_to_bytes,
+    bytes_to_base64url,
+    byteslike_to_bytes,
+    decode_credential_public_key,
+    decoded_public_key_to_cryptography,
+    generate_challenge,
+    options_to_json_dict,
+    parse_authentication_credential_json,
+    parse_authenticator_data,
+    parse_client_data_json,
+    parse_registration_credential_json,
+    verify_signature,
+)
+from webauthn.helpers.exceptions import WebAuthnException
+from webauthn.helpers.structs import (
+    AuthenticatorSelectionCriteria,
+    ClientDataType,
+    PublicKeyCredentialDescriptor,
+    ResidentKeyRequirement,
+    UserVerificationRequirement,
+)
+
+from auth_core.cache import LRUCache, bump_version, get_version, ttl_store
+from auth_mfa.models import WebAuthnCredential
+
+
+logger = logging.getLogger(__name__)
+
+REGISTER = 'register'
+AUTHENTICATE = 'authenticate'
+VERSION_NAMESPACE = 'webauthn_credential'
+
+
+class CeremonyError(Exception):
+    """The client's response does not complete the ceremony."""
+
+
+class ClonedAuthenticator(CeremonyError):
+    """The signature counter went backwards, so the key may have been copied."""
+
+    def __init__(self, message, user_id):
+        super().__init__(message)
+        self.user_id = user_id
+
+
+challenges = ttl_store(
+    'auth_mfa:webauthn',
+    ttl=getattr(settings, 'WEBAUTHN_CHALLENGE_TTL', 300),
+    setting='WEBAUTHN_CHALLENGE_STORE',
+)
+_verifiers = LRUCache(
+    max_size=getattr(settings, 'WEBAUTHN_VERIFIER_CACHE_MAX_SIZE', 10000),
+    ttl=getattr(settings, 'WEBAUTHN_VERIFIER_CACHE_TTL', 3600),
+)
+
+
+def credential_key(raw_id):
+    """Fixed-size lookup key for a raw credential ID (which may be up to 1023 bytes)."""
+    return hashlib.sha256(raw_id).digest()
+
+
+def user_handle(user_id):
+    """Opaque WebAuthn user handle; never reveals the user id."""
+    return salted_hmac('auth_mfa.passkeys.user_handle', str(user_id)).digest()
+
+
+def _user_verification():
+    return UserVerificationRequirement(getattr(settings, 'WEBAUTHN_USER_VERIFICATION', 'preferred'))
+
+
+def _require_user_verification():
+    return _user_verification() == UserVerificationRequirement.REQUIRED
+
+
+def _expected_origins():
+    origin = settings.WEBAUTHN_ORIGIN
+    return [origin] if isinstance(origin, str) else list(origin)
+
+
+def _timeout_ms():
+    return getattr(settings, 'WEBAUTHN_CHALLENGE_TTL', 300) * 1000
+
+
+def _issue_challenge(ceremony, user_id):
+    while True:
+        challenge = generate_challenge()
+        if challenges.add(bytes_to_base64url(challenge), (ceremony, user_id)):
+            return challenge
+
+
+def _take_challenge(client_data, ceremony):
+    """Consume the challenge the client signed; return the user id it was issued for."""
+    entry = challenges.pop(bytes_to_base64url(client_data.challenge))
+    if entry is None or entry[0] != ceremony:
+        raise CeremonyError('Unknown or expired challenge')
+    return entry[1]
+
+
+def _descriptors(user):
+    return [
+        PublicKeyCredentialDescriptor(id=base64url_to_bytes(credential_id))
+        for credential_id in WebAuthnCredential.objects.filter(user=user).values_list('credential_id', flat=True)
+    ]
+
+
+def registration_options(user):
+    """PublicKeyCredentialCreationOptions for navigator.credentials.create()."""
+    options = generate_registration_options(
+        rp_id=settings.WEBAUTHN_RP_ID,
+        rp_name=settings.WEBAUTHN_RP_NAME,
+        user_id=user_handle(user.pk),
+        user_name=user.username,
+        user_display_name=user.get_full_name() or user.username,
+        challenge=_issue_challenge(REGISTER, user.pk),
+        timeout=_timeout_ms(),
+        authenticator_selection=AuthenticatorSelectionCriteria(
+            resident_key=ResidentKeyRequirement.PREFERRED,
+            user_verification=_user_verification(),
+        ),
+        exclude_credentials=_descriptors(user),
+    )
+    return options_to_json_dict(options)
+
+
+def register(user, credential, name='Security Key'):
+    """Verify a navigator.credentials.create() response and store the credential."""
+    try:
+        parsed = parse_registration_credential_json(credential)
+        client_data = parse_client_data_json(byteslike_to_bytes(parsed.response.client_data_json))
+    except WebAuthnException as e:
+        raise CeremonyError(f'Malformed credential: {e}')
+    if _take_challenge(client_data, REGISTER) != user.pk:
+        raise CeremonyError('Unknown or expired challenge')
+    try:
+        verified = verify_registration_response(
+            credential=parsed,
+            expected_challenge=client_data.challenge,
+            expected_rp_id=settings.WEBAUTHN_RP_ID,
+            expected_origin=_expected_origins(),
+            require_user_verification=_require_user_verification(),
+        )
+    except WebAuthnException as e:
+        raise CeremonyError(str(e))
+    try:
+        return WebAuthnCredential.objects.create(
+            user=user,
+            credential_id=bytes_to_base64url(verified.credential_id),
+            credential_key=credential_key(verified.credential_id),
+            public_key=bytes_to_base64url(verified.credential_public_key),
+            sign_count=verified.sign_count,
+            name=name,
+        )
+    except IntegrityError:
+        raise CeremonyError('Credential is already registered')
+
+
+def _decoy_descriptors(username):
+    """A stable, made-up credential for a username that has no passkeys."""
+    raw_id = salted_hmac('auth_mfa.passkeys.decoy_credential', username, algorithm='sha256').digest()
+    return [PublicKeyCredentialDescriptor(id=raw_id)]
+
+
+def authentication_options(user=None, username=None):
+    """
+    PublicKeyCredentialRequestOptions for navigator.credentials.get(). Without
+    a username the browser offers any discoverable credential (passkey) it
+    holds. An unknown username, or a user without passkeys, gets a decoy
+    credential so the options do not reveal which accounts exist.
+    """
+    descriptors = _descriptors(user) if user else []
+    if username and not descriptors:
+        descriptors = _decoy_descriptors(username)
+    options = generate_authentication_options(
+        rp_id=settings.WEBAUTHN_RP_ID,
+        challenge=_issue_challenge(AUTHENTICATE, user.pk if user else None),
+        timeout=_timeout_ms(),
+        allow_credentials=descriptors,
+        user_verification=_user_verification(),
+    )
+    return options_to_json_dict(options)
+
+
+class CredentialVerifier:
+    """A credential's decoded public key, ready to check assertion signatures."""
+
+    __slots__ = ('pk', 'user_id', 'public_key', 'algorithm')
+
+    def __init__(self, pk, user_id, public_key, algorithm):
+        self.pk = pk
+        self.user_id = user_id
+        self.public_key = public_key
+        self.algorithm = algorithm
+
+    def verify(self, signature, data):
+        verify_signature(
+            public_key=self.public_key, signature_alg=self.algorithm, signature=signature, data=data
+        )
+
+
+def _load_verifier(key):
+    row = WebAuthnCredential.objects.filter(credential_key=key).values_list('pk', 'user_id', 'public_key').first()
+    if row is None:
+        return None
+    pk, user_id, public_key = row
+    try:
+        decoded = decode_credential_public_key(base64url_to_bytes(public_key))
+        return CredentialVerifier(pk, user_id, decoded_public_key_to_cryptography(decoded), decoded.alg)
+    except (WebAuthnException, ValueError) as e:
+        logger.warning('Unusable public key on WebAuthn credential %s: %s', pk, e)
+        return None
+
+
+def get_verifier(key):
+    """Cached verifier for a credential_key, or None if no usable credential has it."""
+    version = get_version(VERSION_NAMESPACE, key.hex())
+    return _verifiers.get_or_load((key, version), lambda: _load_verifier(key))
+
+
+def invalidate(key):
+    """Drop the cached verifier for a credential_key in every process."""
+    bump_version(VERSION_NAMESPACE, bytes(key).hex())
+
+
+def record_use(verifier, sign_count):
+    """
+    Store the new signature counter and last_used time in one conditional
+    UPDATE. The counter must increase, or stay at zero for authenticators
+    that do not keep one; anything else means two copies of the key exist.
+    """
+    now = timezone.now()
+    credentials = WebAuthnCredential.objects.filter(pk=verifier.pk)
+    if sign_count:
+        updated = credentials.filter(sign_count__lt=sign_count).update(sign_count=sign_count, last_used=now)
+    else:
+        updated = credentials.filter(sign_count=0).update(last_used=now)
+    if not updated:
+        logger.warning('WebAuthn credential %s presented a stale signature counter (%d)', verifier.pk, sign_count)
+        raise ClonedAuthenticator('Signature counter did not increase', verifier.user_id)
+
+
+def authenticate(credential):
+    """
+    Verify a navigator.credentials.get() response and return the
+    CredentialVerifier of the credential that signed it.
+    """
+    try:
+        parsed = parse_authentication_credential_json(credential)
+        response = parsed.response
+        client_data_bytes = byteslike_to_bytes(response.client_data_json)
+        authenticator_data_bytes = byteslike_to_bytes(response.authenticator_data)
+        client_data = parse_client_data_json(client_data_bytes)
+        authenticator_data = parse_authenticator_data(authenticator_data_bytes)
+    except WebAuthnException as e:
+        raise CeremonyError(f'Malformed credential: {e}')
+    if bytes_to_base64url(parsed.raw_id) != parsed.id:
+        raise CeremonyError('id and rawId do not match')
+    if client_data.type != ClientDataType.WEBAUTHN_GET:
+        raise CeremonyError('Unexpected client data type')
+    expected_user_id = _take_challenge(client_data, AUTHENTICATE)
+    if client_data.origin not in _expected_origins():
+        raise CeremonyError('Unexpected origin')
+    rp_id_hash = hashlib.sha256(settings.WEBAUTHN_RP_ID.encode()).digest()
+    if authenticator_data.rp_id_hash != rp_id_hash:
+        raise CeremonyError('Unexpected RP ID')
+    if not authenticator_data.flags.up:
+        raise CeremonyError('User presence is required')
+    if _require_user_verification() and not authenticator_data.flags.uv:
+        raise CeremonyError('User verification is required')
+
+    verifier = get_verifier(credential_key(parsed.raw_id))
+    if verifier is None:
+        raise CeremonyError('Unknown credential')
+    if expected_user_id is not None and verifier.user_id != expected_user_id:
+        raise CeremonyError('Credential does not belong to this user')
+    if response.user_handle and not hmac.compare_digest(byteslike_to_bytes(response.user_handle), user_handle(verifier.user_id)):
+        raise CeremonyError('User handle does not match the credential')
+    signed = authenticator_data_bytes + hashlib.sha256(client_data_bytes).digest()
+    try:
+        verifier.verify(byteslike_to_bytes(response.signature), signed)
+    except (InvalidSignature, WebAuthnException):
+        raise CeremonyError('Invalid signature')
+
+    record_use(verifier, authenticator_data.sign_count)
+    return verifier
@@ -0,0 +1,142 @@
+"""
+QR code rendering for TOTP enrollment.
+
+The QR matrix is computed once per provisioning URI and rendered as SVG, a
+text matrix or PNG. Rendering runs on a small bounded thread pool so an
+enrollment burst cannot take every CPU, and results are cached per URI
+until the device is confirmed or disabled (see evict()).
+"""
+import base64
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+import qrcode
+from django.conf import settings
+from PIL import Image
+
+from auth_core.cache import LRUCache
+
+
+FORMATS = ('svg', 'matrix', 'png')
+QUIET_ZONE = 4  # modules, as required by the QR specification
+PNG_MODULE_SIZE = 8  # pixels per module
+MASK_PATTERN = 0
+
+
+class RenderBusy(Exception):
+    """
+    Raised when the render queue is full or a render outlasts
+    QR_RENDER_TIMEOUT; the client should retry shortly.
+    """
+
+
+_renders = LRUCache(
+    max_size=getattr(settings, 'QR_CACHE_MAX_SIZE', 10000),
+    ttl=getattr(settings, 'QR_CACHE_TTL', 3600),
+)
+_pending = threading.BoundedSemaphore(getattr(settings, 'QR_RENDER_QUEUE', 32))
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'QR_RENDER_WORKERS', 2),
+                    thread_name_prefix='qr-render',
+                )
+    return _executor
+
+
+def _matrix(uri):
+    def load():
+        # A fixed mask skips scoring all eight candidates, which is most of the
+        # encoding cost; every mask decodes and on-screen codes scan fine
+        qr = qrcode.QRCode(
+            error_correction=qrcode.constants.ERROR_CORRECT_M,
+            border=QUIET_ZONE,
+            mask_pattern=MASK_PATTERN,
+        )
+        qr.add_data(uri)
+        qr.make(fit=True)
+        return tuple(tuple(row) for row in qr.get_matrix())
+
+    return _renders.get_or_load((uri, 'modules'), load)
+
+
+def render_matrix(uri):
+    """Rows of '1' (dark) and '0' (light) modules, quiet zone included."""
+    return [''.join('1' if dark else '0' for dark in row) for row in _matrix(uri)]
+
+
+def render_svg(uri):
+    matrix = _matrix(uri)
+    size = len(matrix)
+    path = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < size and row[x]:
+                x += 1
+            path.append(f'M{start} {y}h{x - start}v1h-{x - start}z')
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/><path d="{"".join(path)}" fill="#000"/></svg>'
+    )
+
+
+def render_png(uri):
+    matrix = _matrix(uri)
+    size = len(matrix)
+    image = Image.new('1', (size, size))
+    image.putdata([0 if dark else 255 for row in matrix for dark in row])
+    image = image.resize((size * PNG_MODULE_SIZE, size * PNG_MODULE_SIZE), Image.NEAREST)
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+RENDERERS = {
+    'svg': render_svg,
+    'matrix': render_matrix,
+    'png': render_png,
+}
+
+
+def _render_on_pool(uri, fmt):
+    if not _pending.acquire(blocking=False):
+        raise RenderBusy()
+    try:
+        future = _get_executor().submit(RENDERERS[fmt], uri)
+    except BaseException:
+        _pending.release()
+        raise
+    future.add_done_callback(lambda _: _pending.release())
+    try:
+        return future.result(timeout=getattr(settings, 'QR_RENDER_TIMEOUT', 5))
+    except FutureTimeout:
+        # The render keeps its queue slot until it finishes
+        raise RenderBusy()
+
+
+def render(uri, fmt):
+    """Return uri rendered as fmt (cached); raises RenderBusy when saturated."""
+    return _renders.get_or_load((uri, fmt), lambda: _render_on_pool(uri, fmt))
+
+
+def png_data_uri(uri):
+    return 'data:image/png;base64,' + base64.b64encode(render(uri, 'png')).decode()
+
+
+def evict(uri):
+    """Forget every rendering of uri, e.g. once its device is confirmed."""
+    for key in FORMATS + ('modules',):
+        _renders.delete((uri, key))
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from auth_mfa import passkeys
+from auth_mfa.models import WebAuthnCredential
+
+
+@receiver(post_save, sender=WebAuthnCredential)
+@receiver(post_delete, sender=WebAuthnCredential)
+def invalidate_webauthn_verifier(sender, instance, **kwargs):
+    passkeys.invalidate(instance.credential_key)
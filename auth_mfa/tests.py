@@ -1,3 +1,94 @@
-from django.test import TestCase
+import threading
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from auth_core.cache import CacheTTLStore
+from auth_mfa import passkeys, qr
+from auth_mfa.models import BackupCode, TOTPDevice, WebAuthnCredential
+
+
+class RenderTimeoutTests(SimpleTestCase):
+
+    @override_settings(QR_RENDER_TIMEOUT=0.01)
+    def test_slow_render_raises_render_busy(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def slow_render(uri):
+            release.wait(5)
+            return '<svg/>'
+
+        with mock.patch.dict(qr.RENDERERS, {'svg': slow_render}):
+            with self.assertRaises(qr.RenderBusy):
+                qr.render('otpauth://totp/slow', 'svg')
+
+
+class AuthenticateBeginTests(TestCase):
+
+    def setUp(self):
+        alice = User.objects.create_user('alice', 'alice@example.com', 'unused-password')
+        User.objects.create_user('bob', 'bob@example.com', 'unused-password')
+        WebAuthnCredential.objects.create(
+            user=alice, credential_id='AAAAAAAAAAAAAAAAAAAAAA', credential_key=b'k' * 32, public_key='',
+        )
+
+    def begin(self, username):
+        response = self.client.post(
+            '/api/auth/mfa/webauthn/authenticate/begin/', {'username': username}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_options_do_not_reveal_accounts_or_passkeys(self):
+        alice, bob, nobody = self.begin('alice'), self.begin('bob'), self.begin('nobody')
+        self.assertEqual(alice.keys(), nobody.keys())
+        for options in (alice, bob, nobody):
+            self.assertEqual(len(options['allowCredentials']), 1)
+            self.assertEqual(options['allowCredentials'][0].keys(), alice['allowCredentials'][0].keys())
+        self.assertEqual(alice['allowCredentials'][0]['id'], 'AAAAAAAAAAAAAAAAAAAAAA')
+        # A stand-in must not change between requests, or it would give itself away
+        self.assertEqual(self.begin('nobody')['allowCredentials'], nobody['allowCredentials'])
+        self.assertNotEqual(bob['allowCredentials'], nobody['allowCredentials'])
+
+    def test_challenges_are_kept_in_the_shared_cache(self):
+        self.assertIsInstance(passkeys.challenges, CacheTTLStore)
+
+
+class BackupCodeTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'unused-password')
+        self.codes = BackupCode.issue(self.user, count=3)
+
+    def test_only_keyed_hashes_are_stored(self):
+        stored = set(BackupCode.objects.filter(user=self.user).values_list('code_hash', flat=True))
+        self.assertEqual(len(stored), 3)
+        self.assertFalse(stored & set(self.codes))
+        # Bound to the user: the same code hashes differently for someone else
+        self.assertNotEqual(BackupCode.hash_code(self.user.pk, self.codes[0]), BackupCode.hash_code(0, self.codes[0]))
+
+    def test_code_is_consumed_exactly_once(self):
+        code = self.codes[0]
+        formatted = f' {code[:4].lower()}-{code[4:]} '
+        self.assertTrue(BackupCode.consume(self.user, formatted))
+        self.assertFalse(BackupCode.consume(self.user, code))
+        self.assertEqual(BackupCode.objects.filter(user=self.user, is_used=True).count(), 1)
+
+    def test_code_of_another_user_is_refused(self):
+        bob = User.objects.create_user('bob', 'bob@example.com', 'unused-password')
+        self.assertFalse(BackupCode.consume(bob, self.codes[0]))
+        self.assertTrue(BackupCode.consume(self.user, self.codes[0]))
+
+    def test_validate_endpoint_accepts_a_backup_code_once(self):
+        TOTPDevice.objects.create(user=self.user, secret='JBSWY3DPEHPK3PXP', is_confirmed=True)
+
+        def validate():
+            return self.client.post(
+                '/api/auth/mfa/totp/validate/', {'username': 'alice', 'code': self.codes[1]},
+                content_type='application/json',
+            )
+
+        self.assertEqual(validate().status_code, 200)
+        self.assertEqual(validate().status_code, 400)
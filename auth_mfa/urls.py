@@ -3,10 +3,14 @@ from . import views
 
 urlpatterns = [
     path('totp/setup/', views.setup_totp, name='setup_totp'),
+    path('totp/qr/', views.totp_qr, name='totp_qr'),
     path('totp/verify/', views.verify_totp, name='verify_totp'),
     path('totp/validate/', views.validate_totp, name='validate_totp'),
     path('totp/disable/', views.disable_totp, name='disable_totp'),
-    path('webauthn/register/', views.register_webauthn, name='register_webauthn'),
+    path('webauthn/register/begin/', views.webauthn_register_begin, name='webauthn_register_begin'),
+    path('webauthn/register/complete/', views.webauthn_register_complete, name='webauthn_register_complete'),
+    path('webauthn/authenticate/begin/', views.webauthn_authenticate_begin, name='webauthn_authenticate_begin'),
+    path('webauthn/authenticate/complete/', views.webauthn_authenticate_complete, name='webauthn_authenticate_complete'),
     path('webauthn/list/', views.list_webauthn, name='list_webauthn'),
     path('webauthn/<int:credential_id>/delete/', views.delete_webauthn, name='delete_webauthn'),
 ]
@@ -2,12 +2,38 @@ from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
+from django.conf import settings
+from django.contrib.auth import login
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.urls import reverse
 from django.utils import timezone
+from auth_core import throttling
+from auth_core.audit import log_authentication
+from auth_core.backends import CachedModelBackend
+from auth_core.querybudget import query_budget
+from auth_mfa import passkeys, qr
 from auth_mfa.models import TOTPDevice, BackupCode, WebAuthnCredential
 import pyotp
-import qrcode
-import io
-import base64
+
+
+def _provisioning_uri(device, user):
+    return pyotp.TOTP(device.secret).provisioning_uri(
+        name=user.username,
+        issuer_name=settings.MFA_ISSUER_NAME
+    )
+
+
+QR_FORMATS = ('url',) + qr.FORMATS
+
+
+def _qr_busy():
+    response = Response(
+        {'error': 'QR rendering is busy, retry shortly'},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+    response['Retry-After'] = '1'
+    return response
 
 
 @api_view(['POST'])
@@ -15,8 +41,16 @@ import base64
 def setup_totp(request):
     """
     Setup TOTP (Time-based One-Time Password) for 2FA.
-    Returns secret and QR code for authenticator app.
+    Returns the secret and the QR code for the authenticator app: by default
+    a URL to fetch the image from; qr_format may ask for svg, matrix or png.
     """
+    qr_format = request.data.get('qr_format', 'url')
+    if qr_format not in QR_FORMATS:
+        return Response(
+            {'error': f"qr_format must be one of {', '.join(QR_FORMATS)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
     device, created = TOTPDevice.objects.get_or_create(user=request.user)
     
     if not created and device.is_confirmed:
@@ -25,29 +59,58 @@ def setup_totp(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # Generate provisioning URI for QR code
-    totp = pyotp.TOTP(device.secret)
-    provisioning_uri = totp.provisioning_uri(
-        name=request.user.username,
-        issuer_name='Auth Service'
-    )
-    
-    # Generate QR code
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(provisioning_uri)
-    qr.make(fit=True)
-    
-    img = qr.make_image(fill_color="black", back_color="white")
-    buffer = io.BytesIO()
-    img.save(buffer, format='PNG')
-    qr_code_base64 = base64.b64encode(buffer.getvalue()).decode()
-    
-    return Response({
+    provisioning_uri = _provisioning_uri(device, request.user)
+    data = {
         'secret': device.secret,
-        'qr_code': f'data:image/png;base64,{qr_code_base64}',
         'provisioning_uri': provisioning_uri,
         'message': 'Scan the QR code with your authenticator app and verify with a code'
-    })
+    }
+    
+    try:
+        if qr_format == 'url':
+            data['qr_code_url'] = request.build_absolute_uri(reverse('totp_qr'))
+        elif qr_format == 'png':
+            data['qr_code'] = qr.png_data_uri(provisioning_uri)
+        else:
+            data['qr_code'] = qr.render(provisioning_uri, qr_format)
+    except qr.RenderBusy:
+        return _qr_busy()
+    
+    response = Response(data)
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def totp_qr(request):
+    """
+    QR code image for a pending TOTP enrollment (?qr_format=svg|png, default svg).
+    """
+    image_format = request.query_params.get('qr_format', 'svg')
+    if image_format not in ('svg', 'png'):
+        return Response(
+            {'error': 'qr_format must be svg or png'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    device = TOTPDevice.objects.filter(user=request.user, is_confirmed=False).first()
+    if device is None:
+        return Response(
+            {'error': 'No pending TOTP enrollment'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    try:
+        image = qr.render(_provisioning_uri(device, request.user), image_format)
+    except qr.RenderBusy:
+        return _qr_busy()
+    
+    content_type = 'image/svg+xml' if image_format == 'svg' else 'image/png'
+    response = HttpResponse(image, content_type=content_type)
+    # The image encodes the TOTP secret
+    response['Cache-Control'] = 'no-store'
+    return response
 
 
 @api_view(['POST'])
@@ -72,15 +135,10 @@ def verify_totp(request):
             device.is_confirmed = True
             device.last_used = timezone.now()
             device.save()
+            qr.evict(_provisioning_uri(device, request.user))
             
-            # Generate backup codes
-            backup_codes = []
-            for _ in range(10):
-                backup_code = BackupCode.objects.create(
-                    user=request.user,
-                    code=BackupCode.generate_code()
-                )
-                backup_codes.append(backup_code.code)
+            # Generate backup codes; only their hashes are stored
+            backup_codes = BackupCode.issue(request.user)
             
             return Response({
                 'message': 'TOTP enabled successfully',
@@ -100,6 +158,7 @@ def verify_totp(request):
         )
 
 
+@query_budget(4)
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def validate_totp(request):
@@ -115,16 +174,17 @@ def validate_totp(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
+    throttling.check(request, username=username)
+    
     try:
-        from django.contrib.auth.models import User
-        user = User.objects.get(username=username)
-        device = TOTPDevice.objects.get(user=user, is_confirmed=True)
+        device = TOTPDevice.objects.select_related('user').get(user__username=username, is_confirmed=True)
+        user = device.user
         
         totp = pyotp.TOTP(device.secret)
         
         if totp.verify(code, valid_window=1):
             device.last_used = timezone.now()
-            device.save()
+            device.save(update_fields=['last_used'])
             
             return Response({
                 'valid': True,
@@ -132,29 +192,21 @@ def validate_totp(request):
             })
         else:
             # Try backup codes
-            backup_code = BackupCode.objects.filter(
-                user=user,
-                code=code,
-                is_used=False
-            ).first()
-            
-            if backup_code:
-                backup_code.is_used = True
-                backup_code.used_at = timezone.now()
-                backup_code.save()
-                
+            if BackupCode.consume(user, code):
                 return Response({
                     'valid': True,
                     'message': 'Backup code validated successfully',
                     'warning': 'This backup code has been used and cannot be used again'
                 })
             
+            throttling.failure(request, username=username)
             return Response(
                 {'error': 'Invalid code'},
                 status=status.HTTP_400_BAD_REQUEST
             )
     
-    except (User.DoesNotExist, TOTPDevice.DoesNotExist):
+    except TOTPDevice.DoesNotExist:
+        throttling.failure(request, username=username)
         return Response(
             {'error': 'TOTP not configured for this user'},
             status=status.HTTP_400_BAD_REQUEST
@@ -170,6 +222,7 @@ def disable_totp(request):
     try:
         device = TOTPDevice.objects.get(user=request.user)
         device.delete()
+        qr.evict(_provisioning_uri(device, request.user))
         
         # Delete backup codes
         BackupCode.objects.filter(user=request.user).delete()
@@ -185,26 +238,38 @@ def disable_totp(request):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
-def register_webauthn(request):
+def webauthn_register_begin(request):
     """
-    Register a WebAuthn/FIDO2 credential (passkey, security key).
+    Start registering a WebAuthn/FIDO2 credential (passkey, security key).
+    Returns the options for navigator.credentials.create().
     """
-    credential_id = request.data.get('credential_id')
-    public_key = request.data.get('public_key')
+    response = Response(passkeys.registration_options(request.user))
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def webauthn_register_complete(request):
+    """
+    Verify the navigator.credentials.create() response and store the credential.
+    """
+    credential = request.data.get('credential')
     name = request.data.get('name', 'Security Key')
     
-    if not credential_id or not public_key:
+    if not credential:
         return Response(
-            {'error': 'credential_id and public_key are required'},
+            {'error': 'credential is required'},
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    credential = WebAuthnCredential.objects.create(
-        user=request.user,
-        credential_id=credential_id,
-        public_key=public_key,
-        name=name
-    )
+    try:
+        credential = passkeys.register(request.user, credential, name=name)
+    except passkeys.CeremonyError as e:
+        return Response(
+            {'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
     return Response({
         'message': 'WebAuthn credential registered successfully',
@@ -216,13 +281,80 @@ def register_webauthn(request):
     }, status=status.HTTP_201_CREATED)
 
 
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def webauthn_authenticate_begin(request):
+    """
+    Start a WebAuthn login. Returns the options for navigator.credentials.get();
+    without a username any passkey the browser holds may be used.
+    """
+    username = request.data.get('username')
+    if not isinstance(username, str):
+        username = None
+    user = User.objects.filter(username=username).first() if username else None
+    response = Response(passkeys.authentication_options(user, username=username))
+    response['Cache-Control'] = 'no-store'
+    return response
+
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def webauthn_authenticate_complete(request):
+    """
+    Verify the navigator.credentials.get() response and log the user in.
+    """
+    credential = request.data.get('credential')
+    
+    if not credential:
+        return Response(
+            {'error': 'credential is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        verifier = passkeys.authenticate(credential)
+    except passkeys.CeremonyError as e:
+        log_authentication(
+            request, 'webauthn', False,
+            user_id=e.user_id if isinstance(e, passkeys.ClonedAuthenticator) else None,
+            details={'reason': str(e)}
+        )
+        return Response(
+            {'error': 'WebAuthn authentication failed'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+    
+    user = CachedModelBackend().get_user(verifier.user_id)
+    if user is None or not user.is_active:
+        return Response(
+            {'error': 'WebAuthn authentication failed'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+    
+    log_authentication(request, 'webauthn', True, user=user, details={'credential': verifier.pk})
+    login(request, user, backend='auth_core.backends.CachedModelBackend')
+    
+    return Response({
+        'message': 'Authentication successful',
+        'user': {
+            'id': user.id,
+            'username': user.username,
+            'email': user.email,
+        }
+    })
+
+
+@query_budget(3)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def list_webauthn(request):
     """
     List all WebAuthn credentials for the user.
     """
-    credentials = WebAuthnCredential.objects.filter(user=request.user)
+    # The key material is not listed, so it is not loaded either
+    credentials = WebAuthnCredential.objects.filter(user=request.user).only(
+        'id', 'name', 'created_at', 'last_used'
+    )
     
     return Response({
         'credentials': [
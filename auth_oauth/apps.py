@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class AuthOauthConfig(AppConfig):
     name = 'auth_oauth'
+
+    def ready(self):
+        from auth_oauth import signals  # noqa: F401
@@ -0,0 +1,86 @@
+"""
+Authorization-code store for the OAuth 2.0 authorization code grant.
+
+Codes live in a TTL-bounded store (the shared Django cache, or process
+memory when there is a single worker, see OAUTH_CODE_STORE) rather than the
+database. Redemption pops the
+code atomically, so each code can be exchanged exactly once.
+"""
+import base64
+import hashlib
+import hmac
+import re
+import secrets
+
+from django.conf import settings
+
+from auth_core.cache import ttl_store
+
+
+PKCE_METHODS = ('S256', 'plain')
+# RFC 7636: code verifiers and challenges are 43-128 unreserved characters
+PKCE_VALUE = re.compile(r'[A-Za-z0-9\-._~]{43,128}')
+
+
+def is_pkce_value(value):
+    return isinstance(value, str) and PKCE_VALUE.fullmatch(value) is not None
+
+
+class AuthorizationGrant:
+    """Everything the token endpoint needs to know about an issued code."""
+
+    __slots__ = (
+        'client_id', 'user_id', 'redirect_uri', 'scope',
+        'code_challenge', 'code_challenge_method',
+    )
+
+    def __init__(self, client_id, user_id, redirect_uri, scope,
+                 code_challenge='', code_challenge_method=''):
+        self.client_id = client_id
+        self.user_id = user_id
+        self.redirect_uri = redirect_uri
+        self.scope = scope
+        self.code_challenge = code_challenge
+        self.code_challenge_method = code_challenge_method
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+    def verify_pkce(self, code_verifier):
+        if not self.code_challenge:
+            # A verifier without a challenge means the request was tampered with
+            return not code_verifier
+        if not is_pkce_value(code_verifier):
+            return False
+        verifier = code_verifier.encode('ascii')
+        if self.code_challenge_method == 'S256':
+            expected = base64.urlsafe_b64encode(hashlib.sha256(verifier).digest()).rstrip(b'=')
+        else:
+            expected = verifier
+        return hmac.compare_digest(expected, self.code_challenge.encode('ascii'))
+
+
+code_store = ttl_store(
+    'auth_oauth:code',
+    ttl=getattr(settings, 'OAUTH_CODE_TTL', 60),
+    setting='OAUTH_CODE_STORE',
+)
+
+
+def issue_code(grant):
+    """Store grant under a fresh random code and return the code."""
+    while True:
+        code = secrets.token_urlsafe(32)
+        if code_store.add(code, grant):
+            return code
+
+
+def redeem_code(code):
+    """Consume code and return its AuthorizationGrant, or None if unknown, expired or already used."""
+    if not code:
+        return None
+    return code_store.pop(code)
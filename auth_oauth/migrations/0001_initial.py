@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:19
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SocialIdentity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=50)),
+                ('subject', models.CharField(help_text="Provider's stable user id (sub)", max_length=255)),
+                ('email', models.EmailField(blank=True, max_length=254)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='social_identities', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'social_identities',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='socialidentity',
+            constraint=models.UniqueConstraint(fields=('provider', 'subject'), name='unique_provider_subject'),
+        ),
+    ]
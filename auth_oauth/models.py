@@ -1,3 +1,20 @@
 from django.db import models
+from django.contrib.auth.models import User
 
-# Create your models here.
+
+class SocialIdentity(models.Model):
+    """Model linking an external identity provider account to a local user"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='social_identities')
+    provider = models.CharField(max_length=50)
+    subject = models.CharField(max_length=255, help_text="Provider's stable user id (sub)")
+    email = models.EmailField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'social_identities'
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'subject'], name='unique_provider_subject'),
+        ]
+    
+    def __str__(self):
+        return f"{self.provider}:{self.subject} -> {self.user.username}"
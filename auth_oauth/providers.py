@@ -0,0 +1,189 @@
+"""
+Social/federated identity providers configured in OAUTH2_PROVIDERS.
+
+Discovery documents and JWKS are fetched ahead of time and refreshed by a
+background thread, so provider ID tokens are verified locally with no
+outbound request on the login path. Providers that only issue opaque access
+tokens (e.g. GitHub) still need a profile request; its result is cached per
+token for a short time.
+"""
+import hashlib
+import logging
+import threading
+import time
+
+import jwt
+import requests
+from django.conf import settings
+
+from auth_core.cache import LRUCache
+
+
+logger = logging.getLogger(__name__)
+
+HTTP_TIMEOUT = 5
+
+
+class ProviderError(Exception):
+    """Raised when a provider token cannot be verified."""
+
+
+class Provider:
+    """One configured identity provider and its cached key material."""
+
+    def __init__(self, name, config):
+        self.name = name
+        self.client_id = config.get('client_id', '')
+        self.issuer = config.get('issuer', '')
+        self.discovery_url = config.get('discovery_url', '')
+        self.jwks_uri = config.get('jwks_uri', '')
+        self.userinfo_url = config.get('userinfo_url', '')
+        self.subject_claim = config.get('subject_claim', 'sub')
+        self.algorithms = config.get('algorithms', ['RS256'])
+        self.keys = {}
+        self.refreshed_at = None
+        self._session = requests.Session()
+        self._profiles = LRUCache(max_size=10000, ttl=config.get('profile_cache_ttl', 300))
+
+    @property
+    def is_configured(self):
+        return bool(self.client_id)
+
+    @property
+    def supports_id_tokens(self):
+        return bool(self.discovery_url or self.jwks_uri)
+
+    def refresh(self):
+        """Fetch discovery and JWKS documents; called from the refresher thread."""
+        if self.discovery_url:
+            response = self._session.get(self.discovery_url, timeout=HTTP_TIMEOUT)
+            response.raise_for_status()
+            discovery = response.json()
+            self.issuer = self.issuer or discovery.get('issuer', '')
+            self.jwks_uri = discovery.get('jwks_uri') or self.jwks_uri
+            self.userinfo_url = self.userinfo_url or discovery.get('userinfo_endpoint', '')
+        if self.jwks_uri:
+            response = self._session.get(self.jwks_uri, timeout=HTTP_TIMEOUT)
+            response.raise_for_status()
+            keys = {}
+            for data in response.json().get('keys', []):
+                if data.get('use', 'sig') != 'sig':
+                    continue
+                try:
+                    keys[data.get('kid')] = jwt.PyJWK(data)
+                except jwt.PyJWTError:
+                    logger.warning('Skipping unusable %s signing key %s', self.name, data.get('kid'))
+            # Swap the whole dict so readers never see a partial key set
+            self.keys = keys
+        self.refreshed_at = time.time()
+
+    def verify_id_token(self, id_token):
+        """Verify signature, issuer, audience and expiry locally; return the claims."""
+        try:
+            header = jwt.get_unverified_header(id_token)
+        except jwt.PyJWTError:
+            raise ProviderError('Malformed ID token')
+
+        key = self.keys.get(header.get('kid'))
+        if key is None and len(self.keys) == 1 and not header.get('kid'):
+            key = next(iter(self.keys.values()))
+        if key is None:
+            # Possibly a key rotation: refresh in the background, not on this request
+            provider_refresher.request_refresh()
+            raise ProviderError('Unknown signing key')
+
+        try:
+            return jwt.decode(
+                id_token,
+                key=key.key,
+                algorithms=self.algorithms,
+                audience=self.client_id,
+                issuer=self.issuer or None,
+                options={'require': ['exp', 'iat', self.subject_claim]},
+            )
+        except jwt.PyJWTError as e:
+            raise ProviderError(str(e))
+
+    def fetch_profile(self, access_token):
+        """Resolve an opaque access token to the provider's profile (cached per token)."""
+        if not self.userinfo_url:
+            raise ProviderError('Provider does not accept access tokens')
+        key = hashlib.sha256(access_token.encode()).hexdigest()
+
+        def load():
+            try:
+                response = self._session.get(
+                    self.userinfo_url,
+                    headers={'Authorization': f'Bearer {access_token}', 'Accept': 'application/json'},
+                    timeout=HTTP_TIMEOUT,
+                )
+            except requests.RequestException as e:
+                raise ProviderError(f'Provider unreachable: {e}')
+            if response.status_code != 200:
+                return None
+            return response.json()
+
+        profile = self._profiles.get_or_load(key, load)
+        if not profile or profile.get(self.subject_claim) in (None, ''):
+            raise ProviderError('Invalid access token')
+        return profile
+
+
+class ProviderRefresher:
+    """Keeps every provider's discovery document and JWKS current."""
+
+    def __init__(self):
+        self.providers = {}
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._last_forced = 0.0
+
+    def load(self):
+        self.providers = {
+            name: Provider(name, config)
+            for name, config in getattr(settings, 'OAUTH2_PROVIDERS', {}).items()
+        }
+
+    def get(self, name):
+        if not self.providers:
+            self.load()
+        provider = self.providers.get(name)
+        return provider if provider is not None and provider.is_configured else None
+
+    def refresh_all(self):
+        for provider in self.providers.values():
+            if not provider.is_configured:
+                continue
+            try:
+                provider.refresh()
+            except (requests.RequestException, ValueError) as e:
+                logger.warning('Refreshing %s provider keys failed: %s', provider.name, e)
+
+    def request_refresh(self):
+        # Rate-limited so a flood of bad tokens cannot hammer the provider
+        if time.monotonic() - self._last_forced > 60:
+            self._last_forced = time.monotonic()
+            self._wakeup.set()
+
+    def _run(self, interval):
+        while True:
+            self.refresh_all()
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+
+    def start(self, interval=None):
+        """Load providers and start the background refresher (idempotent)."""
+        if self._thread and self._thread.is_alive():
+            return self._thread
+        self.load()
+        if not any(p.is_configured and p.supports_id_tokens for p in self.providers.values()):
+            return None
+        interval = interval or getattr(settings, 'SOCIAL_KEYS_REFRESH_INTERVAL', 3600)
+        self._thread = threading.Thread(
+            target=self._run, args=(interval,), name='social-keys', daemon=True
+        )
+        self._thread.start()
+        return self._thread
+
+
+provider_refresher = ProviderRefresher()
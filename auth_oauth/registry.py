@@ -0,0 +1,125 @@
+"""
+In-memory registry of active OAuth clients.
+
+The registry is loaded from OAuthClient rows with a single query and kept
+current by model signals; other processes notice changes through a
+version token in the shared Django cache and reload. Secrets are held only
+as keyed hashes and verified in constant time.
+"""
+import hmac
+import threading
+
+from django.utils.crypto import salted_hmac
+
+from auth_core.cache import bump_version, get_version
+
+
+VERSION_NAMESPACE = 'oauth_clients'
+
+
+def hash_secret(secret):
+    return salted_hmac('auth_oauth.registry.client_secret', secret or '').digest()
+
+
+_scope_bits = {}
+_scope_bits_lock = threading.Lock()
+
+
+def scope_mask(scopes, register=False):
+    """
+    Return the bitmask for an iterable of scope names. Bits are assigned per
+    process as scopes are registered by clients; with register=False a scope
+    no client allows yields None.
+    """
+    mask = 0
+    for scope in scopes:
+        bit = _scope_bits.get(scope)
+        if bit is None:
+            if not register:
+                return None
+            with _scope_bits_lock:
+                bit = _scope_bits.setdefault(scope, 1 << len(_scope_bits))
+        mask |= bit
+    return mask
+
+
+def _split_lines(value):
+    return frozenset(line.strip() for line in (value or '').splitlines() if line.strip())
+
+
+class RegisteredClient:
+    """Immutable, precomputed view of an active OAuthClient."""
+
+    __slots__ = (
+        'client_id', 'client_name', 'secret_hash', 'redirect_uris',
+        'scopes', 'scope_mask', 'is_confidential',
+    )
+
+    def __init__(self, client):
+        self.client_id = client.client_id
+        self.client_name = client.client_name
+        self.secret_hash = hash_secret(client.client_secret)
+        self.redirect_uris = _split_lines(client.redirect_uris)
+        self.scopes = frozenset(client.allowed_scopes.split())
+        self.scope_mask = scope_mask(self.scopes, register=True)
+        self.is_confidential = client.is_confidential
+
+    def verify_secret(self, secret):
+        return hmac.compare_digest(hash_secret(secret), self.secret_hash)
+
+    def allows_scope_mask(self, mask):
+        return mask is not None and mask & ~self.scope_mask == 0
+
+
+class ClientRegistry:
+
+    def __init__(self):
+        self._clients = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _load(self, version):
+        from auth_core.models import OAuthClient
+
+        clients = {
+            client.client_id: RegisteredClient(client)
+            for client in OAuthClient.objects.filter(is_active=True)
+        }
+        self._clients = clients
+        self._version = version
+
+    def get(self, client_id):
+        """Return the RegisteredClient for client_id, or None if unknown or inactive."""
+        version = get_version(VERSION_NAMESPACE)
+        if self._clients is None or version != self._version:
+            with self._lock:
+                if self._clients is None or version != self._version:
+                    self._load(version)
+        return self._clients.get(client_id)
+
+    def update(self, client):
+        """Apply a saved OAuthClient locally and invalidate other processes."""
+        with self._lock:
+            if self._clients is not None:
+                clients = dict(self._clients)
+                clients.pop(getattr(client, '_registry_client_id', client.client_id), None)
+                if client.is_active:
+                    clients[client.client_id] = RegisteredClient(client)
+                self._clients = clients
+            self._version = bump_version(VERSION_NAMESPACE)
+
+    def remove(self, client):
+        with self._lock:
+            if self._clients is not None:
+                clients = dict(self._clients)
+                clients.pop(client.client_id, None)
+                self._clients = clients
+            self._version = bump_version(VERSION_NAMESPACE)
+
+    def clear(self):
+        with self._lock:
+            self._clients = None
+            self._version = None
+
+
+client_registry = ClientRegistry()
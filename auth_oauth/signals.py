@@ -0,0 +1,22 @@
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from auth_core.models import OAuthClient
+from auth_oauth.registry import client_registry
+
+
+@receiver(post_init, sender=OAuthClient)
+def remember_client_id(sender, instance, **kwargs):
+    # Lets the registry drop the old entry if client_id is edited
+    instance._registry_client_id = instance.client_id
+
+
+@receiver(post_save, sender=OAuthClient)
+def update_client_registry(sender, instance, **kwargs):
+    client_registry.update(instance)
+    instance._registry_client_id = instance.client_id
+
+
+@receiver(post_delete, sender=OAuthClient)
+def remove_from_client_registry(sender, instance, **kwargs):
+    client_registry.remove(instance)
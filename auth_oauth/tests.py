@@ -1,3 +1,247 @@
+import base64
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.contrib.auth.models import User
 from django.test import TestCase
 
-# Create your tests here.
+from auth_core.models import OAuthClient
+from auth_oauth.models import SocialIdentity
+from auth_oauth.providers import Provider, ProviderError, provider_refresher
+from auth_oauth.tokens import issue_client_token
+from auth_oauth.views import _link_social_identity, _verified_email
+
+
+class ClientCredentialsScopeTests(TestCase):
+
+    def setUp(self):
+        OAuthClient.objects.create(
+            client_id='gateway', client_secret='unused', client_name='Gateway',
+            redirect_uris='', allowed_scopes='read',
+        )
+        token, _ = issue_client_token('gateway', ['read'])
+        self.authorization = f'Bearer {token}'
+
+    def test_user_endpoints_refuse_client_token(self):
+        for path in ('/api/auth/token/api-key/list/', '/api/auth/session/status/'):
+            response = self.client.get(path, HTTP_AUTHORIZATION=self.authorization)
+            self.assertEqual(response.status_code, 401, path)
+        response = self.client.post(
+            '/api/auth/token/api-key/create/', {'name': 'svc'},
+            content_type='application/json', HTTP_AUTHORIZATION=self.authorization,
+        )
+        self.assertEqual(response.status_code, 401)
+
+    def test_route_list_accepts_client_token(self):
+        response = self.client.get('/api/route/list/', HTTP_AUTHORIZATION=self.authorization)
+        self.assertEqual(response.status_code, 200)
+
+
+class SocialIdentityLinkTests(TestCase):
+
+    def test_links_verified_email_of_regular_account(self):
+        user = User.objects.create_user('alice', 'alice@example.com')
+        self.assertEqual(_link_social_identity('google', '1', 'alice@example.com'), user)
+        self.assertEqual(_link_social_identity('google', '1', 'alice@example.com'), user)
+
+    def test_never_links_privileged_account(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'unused-password')
+        user = _link_social_identity('google', '1', 'admin@example.com')
+        self.assertNotEqual(user, admin)
+        self.assertEqual(user.email, '')
+
+    def test_unrelated_account_holding_username(self):
+        squatter = User.objects.create_user('google_1', 'squatter@example.com')
+        user = _link_social_identity('google', '1', None)
+        self.assertNotEqual(user, squatter)
+        self.assertTrue(user.username.startswith('google_1_'))
+
+    def test_links_only_asserted_verified_email(self):
+        self.assertIsNone(_verified_email({'email': 'alice@example.com'}))
+        self.assertIsNone(_verified_email({'email': 'alice@example.com', 'email_verified': False}))
+        self.assertEqual(_verified_email({'email': 'alice@example.com', 'email_verified': 'true'}), 'alice@example.com')
+
+
+VERIFIER = 'v' * 43
+CHALLENGE = base64.urlsafe_b64encode(hashlib.sha256(VERIFIER.encode()).digest()).rstrip(b'=').decode()
+
+
+class AuthorizationCodeTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'correct-horse')
+        OAuthClient.objects.create(
+            client_id='app', client_secret='', client_name='App', redirect_uris='https://app.example/cb',
+            allowed_scopes='openid profile email', is_confidential=False,
+        )
+        self.client.force_login(self.user)
+
+    def authorize(self, challenge=CHALLENGE):
+        return self.client.get('/api/auth/oauth/authorize/', {
+            'client_id': 'app', 'redirect_uri': 'https://app.example/cb', 'scope': 'openid',
+            'code_challenge': challenge, 'code_challenge_method': 'S256',
+        })
+
+    def exchange(self, verifier=VERIFIER):
+        code = parse_qs(urlsplit(self.authorize()['Location']).query)['code'][0]
+        return self.client.post('/api/auth/oauth/token/', {
+            'grant_type': 'authorization_code', 'code': code, 'client_id': 'app',
+            'redirect_uri': 'https://app.example/cb', 'code_verifier': verifier,
+        }, content_type='application/json')
+
+    def test_delegated_tokens_only_work_where_scope_is_checked(self):
+        tokens = self.exchange().json()
+        self.client.logout()
+        bearer = f'Bearer {tokens["access_token"]}'
+        self.assertEqual(self.client.get('/api/auth/session/status/', HTTP_AUTHORIZATION=bearer).status_code, 401)
+        self.assertEqual(self.client.get('/api/auth/token/api-key/list/', HTTP_AUTHORIZATION=bearer).status_code, 401)
+        response = self.client.post(
+            '/api/token/refresh/', {'refresh': tokens['refresh_token']}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 401)
+
+        response = self.client.get('/api/auth/oauth/userinfo/', HTTP_AUTHORIZATION=bearer)
+        self.assertEqual(response.json(), {'sub': str(self.user.pk)})
+
+    def test_refresh_token_grant(self):
+        tokens = self.exchange().json()
+        response = self.client.post('/api/auth/oauth/token/', {
+            'grant_type': 'refresh_token', 'refresh_token': tokens['refresh_token'], 'client_id': 'app',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['scope'], 'openid')
+
+    def test_non_ascii_pkce_values_are_rejected(self):
+        self.assertEqual(self.authorize('\u00e9' * 43).status_code, 400)
+        response = self.exchange('\u00e9' * 43)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'invalid_grant')
+
+
+class StandInProvider(BaseHTTPRequestHandler):
+    """A local identity provider serving discovery, JWKS and userinfo documents."""
+
+    documents = {}
+    profiles = {}
+    requests = []
+
+    def do_GET(self):
+        type(self).requests.append(self.path)
+        if self.path == '/userinfo':
+            token = self.headers.get('Authorization', '').removeprefix('Bearer ')
+            body = self.profiles.get(token)
+        else:
+            body = self.documents.get(self.path)
+        payload = json.dumps(body).encode()
+        self.send_response(200 if body is not None else 401)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class SocialProviderTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInProvider)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f'http://127.0.0.1:{cls.server.server_address[1]}'
+        cls.signing_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        jwk = jwt.algorithms.RSAAlgorithm.to_jwk(cls.signing_key.public_key(), as_dict=True)
+        StandInProvider.documents = {
+            '/.well-known/openid-configuration': {
+                'issuer': cls.base_url, 'jwks_uri': f'{cls.base_url}/jwks', 'userinfo_endpoint': f'{cls.base_url}/userinfo',
+            },
+            '/jwks': {'keys': [dict(jwk, kid='k1', use='sig'), dict(jwk, kid='enc', use='enc')]},
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        StandInProvider.requests = []
+        StandInProvider.profiles = {'opaque': {'sub': '42', 'email': 'bob@example.com', 'email_verified': True}}
+        self.provider = Provider('local', {
+            'client_id': 'our-client', 'discovery_url': f'{self.base_url}/.well-known/openid-configuration',
+        })
+        self.provider.refresh()
+        patcher = mock.patch.object(provider_refresher, 'providers', {'local': self.provider})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def id_token(self, kid='k1', **claims):
+        now = int(time.time())
+        claims = {'iss': self.base_url, 'aud': 'our-client', 'sub': '7', 'iat': now, 'exp': now + 300, **claims}
+        return jwt.encode(claims, self.signing_key, algorithm='RS256', headers={'kid': kid})
+
+    def social_login(self, **tokens):
+        return self.client.post(
+            '/api/auth/oauth/social/', {'provider': 'local', **tokens}, content_type='application/json'
+        )
+
+    def test_refresh_loads_discovery_and_signing_keys(self):
+        self.assertEqual(self.provider.issuer, self.base_url)
+        self.assertEqual(self.provider.userinfo_url, f'{self.base_url}/userinfo')
+        self.assertEqual(list(self.provider.keys), ['k1'])
+
+    def test_id_token_is_verified_without_a_request(self):
+        with self.assertNumQueries(0):
+            claims = self.provider.verify_id_token(self.id_token())
+        self.assertEqual(claims['sub'], '7')
+        self.assertEqual(StandInProvider.requests, ['/.well-known/openid-configuration', '/jwks'])
+
+    def test_rejects_wrong_audience_issuer_and_expired_tokens(self):
+        for claims in ({'aud': 'someone-else'}, {'iss': 'https://evil.example'}, {'exp': int(time.time()) - 60}):
+            with self.subTest(claims=claims), self.assertRaises(ProviderError):
+                self.provider.verify_id_token(self.id_token(**claims))
+
+    def test_unknown_key_asks_for_a_background_refresh(self):
+        with mock.patch.object(provider_refresher, 'request_refresh') as request_refresh:
+            with self.assertRaisesMessage(ProviderError, 'Unknown signing key'):
+                self.provider.verify_id_token(self.id_token(kid='rotated'))
+        request_refresh.assert_called_once()
+
+    def test_access_token_profile_is_cached(self):
+        self.assertEqual(self.provider.fetch_profile('opaque')['sub'], '42')
+        self.assertEqual(self.provider.fetch_profile('opaque')['sub'], '42')
+        self.assertEqual(StandInProvider.requests.count('/userinfo'), 1)
+        with self.assertRaisesMessage(ProviderError, 'Invalid access token'):
+            self.provider.fetch_profile('revoked')
+
+    def test_social_login_with_id_token(self):
+        alice = User.objects.create_user('alice', 'alice@example.com')
+        response = self.social_login(id_token=self.id_token(email='alice@example.com', email_verified=True))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.session['_auth_user_id'], str(alice.pk))
+        self.assertTrue(SocialIdentity.objects.filter(user=alice, provider='local', subject='7').exists())
+
+    def test_social_login_with_access_token(self):
+        response = self.social_login(access_token='opaque')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['user']['email'], 'bob@example.com')
+
+    def test_social_login_refuses_forged_token(self):
+        forger = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        now = int(time.time())
+        forged = jwt.encode(
+            {'iss': self.base_url, 'aud': 'our-client', 'sub': '7', 'iat': now, 'exp': now + 300},
+            forger, algorithm='RS256', headers={'kid': 'k1'},
+        )
+        response = self.social_login(id_token=forged)
+        self.assertEqual(response.status_code, 401)
+        self.assertNotIn('_auth_user_id', self.client.session)
@@ -0,0 +1,73 @@
+"""
+Tokens issued by the OAuth 2.0 token endpoint.
+
+Tokens a user delegates to a client (authorization_code grant) have their
+own token types, so the first-party JWT authenticator and /api/token/refresh/
+refuse them; only endpoints that check their scope accept them.
+
+Client_credentials tokens are short-lived. While a token for the same client
+and scope set still has most of its lifetime left, issue_client_token()
+hands the same token back instead of
+signing a new one; the reuse window is held in the shared Django cache.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+
+CLIENT_TOKEN_LIFETIME = getattr(settings, 'OAUTH_CLIENT_TOKEN_LIFETIME', 300)
+CLIENT_TOKEN_REUSE = getattr(settings, 'OAUTH_CLIENT_TOKEN_REUSE', 0.5)
+
+
+class ClientAccessToken(AccessToken):
+    """Access token issued to an OAuth client acting on its own behalf."""
+
+    token_type = 'client_access'
+    lifetime = timedelta(seconds=CLIENT_TOKEN_LIFETIME)
+
+
+class DelegatedAccessToken(AccessToken):
+    """Access token a user delegated to an OAuth client, limited to its scope."""
+
+    token_type = 'oauth_access'
+
+
+class DelegatedRefreshToken(RefreshToken):
+    """Refresh token of a delegated grant; redeemed only at the OAuth token endpoint."""
+
+    token_type = 'oauth_refresh'
+    access_token_class = DelegatedAccessToken
+
+
+def issue_delegated_tokens(user, client_id, scope):
+    """Return a DelegatedRefreshToken for user, client_id and scope."""
+    refresh = DelegatedRefreshToken.for_user(user)
+    refresh['client_id'] = client_id
+    refresh['scope'] = scope
+    return refresh
+
+
+def issue_client_token(client_id, scopes):
+    """Return (token, expires_in) for client_id and the given scope names."""
+    scope = ' '.join(sorted(scopes))
+    cache_key = f'auth_oauth:client_token:{client_id}:{scope}'
+
+    cached = cache.get(cache_key)
+    if cached is not None:
+        token, expires_at = cached
+        return token, int(expires_at - time.time())
+
+    access = ClientAccessToken()
+    access['client_id'] = client_id
+    access['scope'] = scope
+    token = str(access)
+    expires_at = access['exp']
+
+    # Only hand out a cached token while at least (1 - reuse) of its lifetime remains
+    reuse_for = int(CLIENT_TOKEN_LIFETIME * CLIENT_TOKEN_REUSE)
+    if reuse_for > 0:
+        cache.set(cache_key, (token, expires_at), timeout=reuse_for)
+    return token, int(expires_at - time.time())
@@ -6,5 +6,6 @@ urlpatterns = [
     path('token/', views.oauth_token, name='oauth_token'),
     path('userinfo/', views.oauth_userinfo, name='oauth_userinfo'),
     path('.well-known/openid-configuration/', views.oidc_discovery, name='oidc_discovery'),
+    path('jwks/', views.oidc_jwks, name='oidc_jwks'),
     path('social/', views.social_login, name='social_login'),
 ]
@@ -0,0 +1,70 @@
+"""
+OIDC userinfo claim sets, projected by scope and cached per
+(subject, scope set, user version) so repeated polling is served from
+memory without touching the database.
+"""
+from django.conf import settings
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from auth_core.backends import CachedModelBackend, get_user_version
+from auth_core.cache import LRUCache, versioned_ttl
+from auth_oauth.tokens import DelegatedAccessToken
+
+
+# Tokens without a scope claim (e.g. from /api/token/) are first-party
+DEFAULT_SCOPES = frozenset(['openid', 'profile', 'email'])
+
+SCOPE_CLAIMS = {
+    'profile': lambda user: {
+        'name': f'{user.first_name} {user.last_name}'.strip(),
+        'given_name': user.first_name,
+        'family_name': user.last_name,
+        'preferred_username': user.username,
+    },
+    'email': lambda user: {
+        'email': user.email,
+        'email_verified': True,
+    },
+}
+
+
+_claims_cache = LRUCache(
+    max_size=getattr(settings, 'USERINFO_CACHE_MAX_SIZE', 10000),
+    ttl=versioned_ttl(getattr(settings, 'USERINFO_CACHE_TTL', 300)),
+)
+
+
+def build_claims(user, scopes):
+    claims = {'sub': str(user.pk)}
+    for scope in sorted(scopes):
+        project = SCOPE_CLAIMS.get(scope)
+        if project:
+            claims.update(project(user))
+    return claims
+
+
+def get_userinfo(raw_token):
+    """Return the claims allowed by a valid first-party or delegated access token, or None."""
+    token = None
+    for token_class in (DelegatedAccessToken, AccessToken):
+        try:
+            token = token_class(raw_token)
+            break
+        except TokenError:
+            continue
+    if token is None:
+        return None
+
+    user_id = token.get(api_settings.USER_ID_CLAIM)
+    if user_id is None:
+        return None
+    scope = token.get('scope')
+    scopes = frozenset(scope.split()) if scope is not None else DEFAULT_SCOPES
+
+    def load():
+        user = CachedModelBackend().get_user(user_id)
+        return build_claims(user, scopes) if user is not None else None
+
+    return _claims_cache.get_or_load((str(user_id), scopes, get_user_version(user_id)), load)
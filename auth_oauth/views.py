@@ -1,8 +1,30 @@
 from rest_framework import status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
-from auth_core.models import OAuthClient, AuthenticationLog
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from django.conf import settings
+from django.contrib.auth import login
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.http import HttpResponseRedirect
+from django.views.decorators.http import require_GET
+from urllib.parse import unquote_plus, urlencode
+from auth_core.audit import log_authentication
+from auth_core.backends import CachedModelBackend
+from auth_core.publication import publish
+from auth_oauth.codes import PKCE_METHODS, AuthorizationGrant, is_pkce_value, issue_code, redeem_code
+from auth_oauth.models import SocialIdentity
+from auth_oauth.providers import ProviderError, provider_refresher
+from auth_oauth.registry import client_registry, scope_mask
+from auth_oauth.tokens import DelegatedRefreshToken, issue_client_token, issue_delegated_tokens
+from auth_oauth.userinfo import get_userinfo
+import base64
+import hashlib
+import json
+import jwt
+import secrets
 
 
 @api_view(['GET'])
@@ -10,13 +32,16 @@ from auth_core.models import OAuthClient, AuthenticationLog
 def oauth_authorize(request):
     """
     OAuth 2.0 Authorization endpoint.
-    Implements the authorization code flow.
+    Implements the authorization code flow (with optional PKCE).
+    The resource owner must already be authenticated (session or JWT).
     """
     client_id = request.GET.get('client_id')
     redirect_uri = request.GET.get('redirect_uri')
     response_type = request.GET.get('response_type', 'code')
     scope = request.GET.get('scope', 'openid profile email')
     state = request.GET.get('state', '')
+    code_challenge = request.GET.get('code_challenge', '')
+    code_challenge_method = request.GET.get('code_challenge_method', 'plain' if code_challenge else '')
     
     if not client_id or not redirect_uri:
         return Response(
@@ -24,111 +49,269 @@ def oauth_authorize(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    try:
-        client = OAuthClient.objects.get(client_id=client_id, is_active=True)
-        
-        # Verify redirect URI
-        allowed_uris = client.redirect_uris.split('\n')
-        if redirect_uri not in allowed_uris:
-            return Response(
-                {'error': 'Invalid redirect_uri'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        return Response({
-            'message': 'Authorization request received',
-            'client_name': client.client_name,
-            'scope': scope,
-            'redirect_uri': redirect_uri,
-            'state': state,
-            'note': 'In production, this would redirect to login/consent page'
-        })
-        
-    except OAuthClient.DoesNotExist:
+    client = client_registry.get(client_id)
+    if client is None:
         return Response(
             {'error': 'Invalid client_id'},
             status=status.HTTP_400_BAD_REQUEST
         )
+    
+    # Verify redirect URI
+    if redirect_uri not in client.redirect_uris:
+        return Response(
+            {'error': 'Invalid redirect_uri'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    if response_type != 'code':
+        return Response(
+            {'error': 'unsupported_response_type'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    requested_scopes = scope.split()
+    if not client.scopes.issuperset(requested_scopes):
+        return Response(
+            {'error': 'invalid_scope'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    if code_challenge_method and code_challenge_method not in PKCE_METHODS:
+        return Response(
+            {'error': 'invalid_request', 'error_description': 'Unsupported code_challenge_method'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    if code_challenge and not is_pkce_value(code_challenge):
+        return Response(
+            {'error': 'invalid_request', 'error_description': 'code_challenge must be 43-128 unreserved characters'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    if not client.is_confidential and not code_challenge:
+        return Response(
+            {'error': 'invalid_request', 'error_description': 'Public clients must use PKCE'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    if not request.user.is_authenticated:
+        return Response(
+            {'error': 'login_required', 'error_description': 'Authenticate before authorizing a client'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+    
+    code = issue_code(AuthorizationGrant(
+        client_id=client.client_id,
+        user_id=request.user.pk,
+        redirect_uri=redirect_uri,
+        scope=' '.join(requested_scopes),
+        code_challenge=code_challenge,
+        code_challenge_method=code_challenge_method,
+    ))
+    
+    params = {'code': code}
+    if state:
+        params['state'] = state
+    separator = '&' if '?' in redirect_uri else '?'
+    return HttpResponseRedirect(f'{redirect_uri}{separator}{urlencode(params)}')
 
 
 @api_view(['POST'])
+@authentication_classes([])  # Clients authenticate themselves; Basic here is not a user login
 @permission_classes([AllowAny])
 def oauth_token(request):
     """
     OAuth 2.0 Token endpoint.
-    Exchange authorization code for access token.
+    - authorization_code: exchange a single-use code for delegated tokens
+      (JWTs valid only where their scope is checked, e.g. userinfo).
+    - refresh_token: exchange a delegated refresh token for a new access token.
+    - client_credentials: issue a short-lived token to a confidential client.
     """
     grant_type = request.data.get('grant_type')
     code = request.data.get('code')
-    client_id = request.data.get('client_id')
-    client_secret = request.data.get('client_secret')
+    client_id, client_secret = _get_client_credentials(request)
     redirect_uri = request.data.get('redirect_uri')
+    code_verifier = request.data.get('code_verifier', '')
     
-    if grant_type != 'authorization_code':
+    if grant_type not in ('authorization_code', 'refresh_token', 'client_credentials'):
         return Response(
             {'error': 'unsupported_grant_type'},
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    if not all([code, client_id, client_secret, redirect_uri]):
+    if grant_type == 'authorization_code' and not all([code, client_id, redirect_uri]):
         return Response(
             {'error': 'Missing required parameters'},
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    try:
-        client = OAuthClient.objects.get(
-            client_id=client_id,
-            client_secret=client_secret,
-            is_active=True
-        )
-        
-        # In production, verify the authorization code
-        # For now, return a mock response
-        return Response({
-            'access_token': 'mock_access_token_' + code,
-            'token_type': 'Bearer',
-            'expires_in': 3600,
-            'refresh_token': 'mock_refresh_token',
-            'scope': 'openid profile email',
-            'note': 'This is a mock implementation. Integrate with OAuth toolkit in production.'
-        })
-        
-    except OAuthClient.DoesNotExist:
+    client = client_registry.get(client_id)
+    if client is None or (client.is_confidential and not client.verify_secret(client_secret)):
         return Response(
             {'error': 'invalid_client'},
             status=status.HTTP_401_UNAUTHORIZED
         )
+    
+    if grant_type == 'client_credentials':
+        return _client_credentials_grant(request, client)
+    if grant_type == 'refresh_token':
+        return _refresh_token_grant(request, client)
+    
+    # Popping the code makes redemption single-use even under concurrency
+    grant = redeem_code(code)
+    if (
+        grant is None
+        or grant.client_id != client.client_id
+        or grant.redirect_uri != redirect_uri
+        or not grant.verify_pkce(code_verifier)
+    ):
+        return Response(
+            {'error': 'invalid_grant'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    user = CachedModelBackend().get_user(grant.user_id)
+    if user is None:
+        return Response(
+            {'error': 'invalid_grant'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    refresh = issue_delegated_tokens(user, client.client_id, grant.scope)
+    access = refresh.access_token
+    
+    return Response({
+        'access_token': str(access),
+        'token_type': 'Bearer',
+        'expires_in': int(access.lifetime.total_seconds()),
+        'refresh_token': str(refresh),
+        'scope': grant.scope,
+    }, headers={'Cache-Control': 'no-store', 'Pragma': 'no-cache'})
 
 
-@api_view(['GET'])
-@permission_classes([AllowAny])
-def oidc_discovery(request):
+def _get_client_credentials(request):
     """
-    OpenID Connect Discovery endpoint.
-    Returns the OpenID Connect configuration.
+    Read client_id/client_secret from HTTP Basic (client_secret_basic)
+    or from the request body (client_secret_post).
     """
-    base_url = request.build_absolute_uri('/')[:-1]
+    auth_header = request.META.get('HTTP_AUTHORIZATION', '')
+    if auth_header.startswith('Basic '):
+        try:
+            decoded = base64.b64decode(auth_header[6:]).decode('utf-8')
+            client_id, client_secret = decoded.split(':', 1)
+            return unquote_plus(client_id), unquote_plus(client_secret)
+        except (ValueError, UnicodeDecodeError):
+            return None, ''
+    return request.data.get('client_id'), request.data.get('client_secret', '')
+
+
+def _refresh_token_grant(request, client):
+    try:
+        refresh = DelegatedRefreshToken(request.data.get('refresh_token') or '')
+    except TokenError:
+        refresh = None
+    user = None
+    if refresh is not None and refresh.get('client_id') == client.client_id:
+        user = CachedModelBackend().get_user(refresh.get(jwt_settings.USER_ID_CLAIM))
+    if user is None or not user.is_active:
+        return Response(
+            {'error': 'invalid_grant'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    access = refresh.access_token
+    return Response({
+        'access_token': str(access),
+        'token_type': 'Bearer',
+        'expires_in': int(access.lifetime.total_seconds()),
+        'scope': refresh.get('scope', ''),
+    }, headers={'Cache-Control': 'no-store', 'Pragma': 'no-cache'})
+
+
+def _client_credentials_grant(request, client):
+    if not client.is_confidential:
+        return Response(
+            {'error': 'unauthorized_client'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
+    requested_scopes = (request.data.get('scope') or '').split() or sorted(client.scopes)
+    if not client.allows_scope_mask(scope_mask(requested_scopes)):
+        return Response(
+            {'error': 'invalid_scope'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    token, expires_in = issue_client_token(client.client_id, requested_scopes)
     return Response({
+        'access_token': token,
+        'token_type': 'Bearer',
+        'expires_in': expires_in,
+        'scope': ' '.join(sorted(requested_scopes)),
+    }, headers={'Cache-Control': 'no-store', 'Pragma': 'no-cache'})
+
+
+def _render_discovery(base_url):
+    return json.dumps({
         'issuer': base_url,
         'authorization_endpoint': f'{base_url}/api/auth/oauth/authorize/',
         'token_endpoint': f'{base_url}/api/auth/oauth/token/',
         'userinfo_endpoint': f'{base_url}/api/auth/oauth/userinfo/',
         'jwks_uri': f'{base_url}/api/auth/oauth/jwks/',
-        'response_types_supported': ['code', 'token', 'id_token'],
+        'response_types_supported': ['code'],
+        'grant_types_supported': ['authorization_code', 'refresh_token', 'client_credentials'],
+        'code_challenge_methods_supported': list(PKCE_METHODS),
+        'token_endpoint_auth_methods_supported': ['client_secret_basic', 'client_secret_post', 'none'],
         'subject_types_supported': ['public'],
         'id_token_signing_alg_values_supported': ['RS256'],
         'scopes_supported': ['openid', 'profile', 'email'],
-    })
+    }).encode()
+
+
+def _render_jwks(base_url):
+    """
+    Publish the token verifying key when SIMPLE_JWT uses an asymmetric
+    algorithm. HMAC (HS*) keys are secret, so the set is empty for them.
+    """
+    keys = []
+    algorithm = settings.SIMPLE_JWT.get('ALGORITHM', 'HS256')
+    verifying_key = settings.SIMPLE_JWT.get('VERIFYING_KEY')
+    if verifying_key and not algorithm.startswith('HS'):
+        jwt_algorithm = jwt.get_algorithm_by_name(algorithm)
+        jwk = jwt_algorithm.to_jwk(jwt_algorithm.prepare_key(verifying_key), as_dict=True)
+        jwk.update({
+            'use': 'sig',
+            'alg': algorithm,
+            'kid': hashlib.sha256(json.dumps(jwk, sort_keys=True).encode()).hexdigest()[:16],
+        })
+        keys.append(jwk)
+    return json.dumps({'keys': keys}).encode()
+
+
+@require_GET
+def oidc_discovery(request):
+    """
+    OpenID Connect Discovery endpoint.
+    Returns the OpenID Connect configuration (pre-rendered per host, ETag-cached).
+    """
+    return publish(request, 'oidc_discovery', _render_discovery, 'application/json')
+
+
+@require_GET
+def oidc_jwks(request):
+    """
+    JSON Web Key Set endpoint referenced by the discovery document.
+    """
+    return publish(request, 'oidc_jwks', _render_jwks, 'application/json')
 
 
 @api_view(['GET'])
+@authentication_classes([])  # The bearer token is resolved below, not by the DRF authenticators
 @permission_classes([AllowAny])
 def oauth_userinfo(request):
     """
     OAuth 2.0 / OIDC UserInfo endpoint.
-    Returns information about the authenticated user.
+    Returns the claims of the access token's subject allowed by its scopes.
     """
     auth_header = request.META.get('HTTP_AUTHORIZATION', '')
     
@@ -138,21 +321,64 @@ def oauth_userinfo(request):
             status=status.HTTP_401_UNAUTHORIZED
         )
     
-    # In production, verify the access token
-    # For now, return mock data if user is authenticated
-    if request.user.is_authenticated:
-        return Response({
-            'sub': str(request.user.id),
-            'name': f'{request.user.first_name} {request.user.last_name}',
-            'preferred_username': request.user.username,
-            'email': request.user.email,
-            'email_verified': True,
-        })
-    else:
+    claims = get_userinfo(auth_header[7:].strip())
+    if claims is None:
         return Response(
             {'error': 'Invalid or expired token'},
             status=status.HTTP_401_UNAUTHORIZED
         )
+    
+    return Response(claims)
+
+
+def _verified_email(claims):
+    """The email in provider claims if the provider asserts it is verified, else None."""
+    # Some providers send the flag as a string
+    if claims.get('email_verified') in (True, 'true'):
+        return claims.get('email') or None
+    return None
+
+
+def _social_identity(provider, subject):
+    return SocialIdentity.objects.select_related('user').filter(provider=provider, subject=subject).first()
+
+
+def _create_social_identity(user, provider, subject, email, username):
+    with transaction.atomic():
+        if user is None:
+            user = User(username=username, email=email or '')
+            user.set_unusable_password()
+            user.save()
+        SocialIdentity.objects.create(user=user, provider=provider, subject=subject, email=email or '')
+    return user
+
+
+def _link_social_identity(provider, subject, email):
+    """
+    Return the local user for (provider, subject). On first login it is
+    linked to the account with the same verified email, unless that account
+    is staff or superuser; otherwise a new user is created.
+    """
+    identity = _social_identity(provider, subject)
+    if identity is not None:
+        return identity.user
+    
+    user = User.objects.filter(email=email).first() if email else None
+    if user is not None and (user.is_staff or user.is_superuser):
+        # Privileged accounts are never taken over through an external
+        # identity; the new account goes without the email, which is taken
+        user = email = None
+    
+    username = f'{provider}_{subject}'[:141]
+    try:
+        return _create_social_identity(user, provider, subject, email, username)
+    except IntegrityError:
+        # A concurrent first login for this identity got there first
+        identity = _social_identity(provider, subject)
+        if identity is not None:
+            return identity.user
+    # Otherwise the username was taken by an unrelated account
+    return _create_social_identity(user, provider, subject, email, f'{username}_{secrets.token_hex(4)}')
 
 
 @api_view(['POST'])
@@ -160,23 +386,59 @@ def oauth_userinfo(request):
 def social_login(request):
     """
     Social/Federated login endpoint.
-    Supports Google, GitHub, Facebook, etc.
+    Accepts a provider ID token (verified locally against cached JWKS) or,
+    for providers without ID tokens such as GitHub, an access token.
     """
-    provider = request.data.get('provider')
+    provider_name = request.data.get('provider')
+    id_token = request.data.get('id_token')
     access_token = request.data.get('access_token')
     
-    if not provider or not access_token:
+    if not provider_name or not (id_token or access_token):
         return Response(
-            {'error': 'provider and access_token are required'},
+            {'error': 'provider and id_token or access_token are required'},
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # In production, verify the access token with the social provider
-    # and create/update user account
+    provider = provider_refresher.get(provider_name)
+    if provider is None:
+        return Response(
+            {'error': f'Provider {provider_name} is not configured'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    try:
+        if id_token:
+            claims = provider.verify_id_token(id_token)
+        else:
+            claims = provider.fetch_profile(access_token)
+        email = _verified_email(claims)
+        subject = str(claims[provider.subject_claim])
+    except ProviderError as e:
+        log_authentication(
+            request, 'social', False,
+            details={'provider': provider_name, 'error': str(e)}
+        )
+        return Response(
+            {'error': 'Invalid provider token'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+    
+    user = _link_social_identity(provider_name, subject, email)
+    if not user.is_active:
+        return Response(
+            {'error': 'Account is disabled'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    log_authentication(request, 'social', True, user=user, details={'provider': provider_name})
+    
+    login(request, user, backend='auth_core.backends.CachedModelBackend')
     
     return Response({
-        'message': f'{provider} login initiated',
-        'note': 'Integrate with social-auth-app-django for production use',
-        'supported_providers': ['google', 'github', 'facebook', 'twitter', 'linkedin']
+        'message': f'{provider_name} login successful',
+        'user': {
+            'id': user.id,
+            'username': user.username,
+            'email': user.email,
+        }
     })
-
@@ -1,3 +1,26 @@
 from django.contrib import admin
+from django.utils import timezone
+from .models import OutboundMessage, PhoneNumber
 
-# Register your models here.
+
+@admin.register(PhoneNumber)
+class PhoneNumberAdmin(admin.ModelAdmin):
+    list_display = ['user', 'number', 'created_at']
+    search_fields = ['user__username', 'number']
+
+
+@admin.register(OutboundMessage)
+class OutboundMessageAdmin(admin.ModelAdmin):
+    list_display = ['channel', 'recipient', 'status', 'attempts', 'created_at', 'sent_at', 'last_error']
+    list_filter = ['channel', 'status', 'created_at']
+    search_fields = ['recipient']
+    exclude = ['body']
+    readonly_fields = ['claim', 'created_at', 'sent_at']
+    actions = ['requeue']
+    
+    @admin.action(description='Requeue selected dead-lettered messages')
+    def requeue(self, request, queryset):
+        requeued = queryset.filter(status=OutboundMessage.DEAD).update(
+            status=OutboundMessage.PENDING, attempts=0, next_attempt_at=timezone.now(), last_error=''
+        )
+        self.message_user(request, f'{requeued} messages requeued')
@@ -0,0 +1,335 @@
+"""
+Asynchronous delivery of passwordless codes and links.
+
+Requests only insert an OutboundMessage row. Delivery workers (threads in
+each serving process, or `manage.py deliver_messages`) claim due messages
+in batches per channel and send each batch through one provider connection.
+Each outcome is recorded in bulk:
+- sent: the body, which usually holds a secret, is cleared;
+- retried with exponential backoff after a transient error;
+- dead-lettered after DELIVERY_MAX_ATTEMPTS, a permanent error (including
+  any unexpected exception from the provider), or once the code or link it
+  carries has expired.
+
+Claims are leases, so a batch held by a crashed worker is picked up again
+after DELIVERY_LEASE seconds; delivery is at least once. A worker held up by
+the rate limit for half its lease extends the lease of the rest of its
+batch, and skips any message another worker has taken over meanwhile. Each channel has a
+token-bucket rate limit shared by the workers of a process, and delivery
+latency (enqueue to hand-off) is tracked per channel for get_stats().
+"""
+import logging
+import random
+import secrets
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from auth_passwordless.models import OutboundMessage
+from auth_passwordless.providers import DeliveryError
+
+
+logger = logging.getLogger(__name__)
+
+CHANNELS = ('email', 'sms')
+DEFAULT_PROVIDERS = {
+    'email': 'auth_passwordless.providers.EmailProvider',
+    'sms': 'auth_passwordless.providers.SMSGatewayProvider',
+}
+LATENCY_SAMPLES = 1000
+
+
+_wakeups = {channel: threading.Event() for channel in CHANNELS}
+
+
+def enqueue(channel, recipient, body, subject='', expires_at=None):
+    """Queue a message for delivery and wake this process's workers once committed."""
+    message = OutboundMessage.objects.create(
+        channel=channel, recipient=recipient, subject=subject, body=body, expires_at=expires_at
+    )
+    transaction.on_commit(_wakeups[channel].set)
+    return message
+
+
+class TokenBucket:
+    """Allows rate messages per second on average, in bursts of up to burst."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, stop_event=None):
+        """Take one token, waiting for it if needed; False if stop_event was set meanwhile."""
+        if not self.rate:
+            return True
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if stop_event is None:
+                time.sleep(wait)
+            elif stop_event.wait(wait):
+                return False
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(channel):
+    with _buckets_lock:
+        if channel not in _buckets:
+            rate = getattr(settings, 'DELIVERY_RATE_LIMITS', {}).get(channel, 0)
+            _buckets[channel] = TokenBucket(rate)
+        return _buckets[channel]
+
+
+class _ChannelStats:
+    __slots__ = ('sent', 'retried', 'dead', 'expired', 'batches', 'latencies')
+
+    def __init__(self):
+        self.sent = self.retried = self.dead = self.expired = self.batches = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+
+_stats = {channel: _ChannelStats() for channel in CHANNELS}
+_stats_lock = threading.Lock()
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def get_stats():
+    """Per-channel outcome counters and latency percentiles (seconds) for this process."""
+    result = {}
+    with _stats_lock:
+        for channel, stats in _stats.items():
+            ordered = sorted(stats.latencies)
+            result[channel] = {
+                'sent': stats.sent,
+                'retried': stats.retried,
+                'dead': stats.dead,
+                'expired': stats.expired,
+                'batches': stats.batches,
+                'latency_p50': _percentile(ordered, 0.5) if ordered else None,
+                'latency_p95': _percentile(ordered, 0.95) if ordered else None,
+                'latency_p99': _percentile(ordered, 0.99) if ordered else None,
+                'latency_max': ordered[-1] if ordered else None,
+            }
+    return result
+
+
+def queue_depth():
+    """Messages not yet sent or dead-lettered, per channel (one query)."""
+    depth = dict.fromkeys(CHANNELS, 0)
+    rows = (
+        OutboundMessage.objects.filter(status__in=(OutboundMessage.PENDING, OutboundMessage.SENDING))
+        .values_list('channel').order_by().annotate(count=Count('pk'))
+    )
+    depth.update(rows)
+    return depth
+
+
+def claim(channel, limit=None, lease=None):
+    """Reserve up to limit due messages of channel for this worker and return them."""
+    limit = limit or getattr(settings, 'DELIVERY_BATCH_SIZE', 50)
+    lease = lease or getattr(settings, 'DELIVERY_LEASE', 60)
+    now = timezone.now()
+    due = OutboundMessage.objects.filter(
+        channel=channel,
+        status__in=(OutboundMessage.PENDING, OutboundMessage.SENDING),
+        next_attempt_at__lte=now,
+    )
+    ids = list(due.order_by('next_attempt_at').values_list('pk', flat=True)[:limit])
+    if not ids:
+        return []
+    token = secrets.token_hex(8)
+    # Re-checking the due condition makes the claim atomic: a row another
+    # worker claimed first has moved its next_attempt_at past now
+    due.filter(pk__in=ids).update(
+        status=OutboundMessage.SENDING, claim=token, next_attempt_at=now + timedelta(seconds=lease)
+    )
+    return list(OutboundMessage.objects.filter(pk__in=ids, claim=token).order_by('pk'))
+
+
+def backoff(attempts):
+    """Seconds to wait before retry number attempts, with jitter."""
+    base = getattr(settings, 'DELIVERY_RETRY_BASE', 5)
+    ceiling = getattr(settings, 'DELIVERY_RETRY_MAX', 300)
+    delay = min(ceiling, base * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def deliver_batch(channel, provider, bucket=None, stop_event=None):
+    """Claim and send one batch of channel messages; return how many were claimed."""
+    lease = getattr(settings, 'DELIVERY_LEASE', 60)
+    messages = claim(channel, lease=lease)
+    if not messages:
+        return 0
+    token = messages[0].claim
+    renew_at = time.monotonic() + lease / 2
+    bucket = bucket or get_bucket(channel)
+    max_attempts = getattr(settings, 'DELIVERY_MAX_ATTEMPTS', 5)
+    sent, failed, released = [], [], []
+    lost = set()
+    latencies = []
+    expired = dead = retried = 0
+
+    for index, message in enumerate(messages):
+        if message.pk in lost:
+            continue
+        now = timezone.now()
+        if message.expires_at and message.expires_at <= now:
+            message.status = OutboundMessage.DEAD
+            message.last_error = 'Expired before it could be delivered'
+            failed.append(message)
+            expired += 1
+            continue
+        if not bucket.acquire(stop_event):
+            released.append(message.pk)
+            continue
+        if time.monotonic() >= renew_at:
+            # Extend the lease of the rest of the batch before another
+            # worker may claim it, and drop what was already taken over
+            remaining = [m.pk for m in messages[index:] if m.pk not in lost]
+            renewed = OutboundMessage.objects.filter(pk__in=remaining, claim=token).update(
+                next_attempt_at=timezone.now() + timedelta(seconds=lease)
+            )
+            if renewed < len(remaining):
+                owned = OutboundMessage.objects.filter(pk__in=remaining, claim=token).values_list('pk', flat=True)
+                taken = set(remaining) - set(owned)
+                lost.update(taken)
+                logger.warning('%d %s messages were taken over by another worker', len(taken), channel)
+            renew_at = time.monotonic() + lease / 2
+            if message.pk in lost:
+                continue
+        message.attempts += 1
+        try:
+            provider.send(message)
+        except DeliveryError as e:
+            error = e
+        except Exception as e:
+            # A bug or unexpected provider failure must not abort the batch,
+            # or the messages already sent in it would be sent again
+            logger.exception('Unexpected error sending %s message %s', channel, message.pk)
+            error = DeliveryError(f'{type(e).__name__}: {e}', permanent=True)
+        else:
+            sent.append(message.pk)
+            latencies.append((timezone.now() - message.created_at).total_seconds())
+            continue
+        message.last_error = str(error)[:1000]
+        if error.permanent or message.attempts >= max_attempts:
+            message.status = OutboundMessage.DEAD
+            dead += 1
+            logger.warning('Dead-lettered %s message %s: %s', channel, message.pk, error)
+        else:
+            message.status = OutboundMessage.PENDING
+            message.next_attempt_at = now + timedelta(seconds=backoff(message.attempts))
+            retried += 1
+        failed.append(message)
+
+    now = timezone.now()
+    if sent:
+        OutboundMessage.objects.filter(pk__in=sent).update(
+            status=OutboundMessage.SENT, sent_at=now, body='', claim='', attempts=F('attempts') + 1
+        )
+    if failed:
+        for message in failed:
+            message.claim = ''
+        OutboundMessage.objects.bulk_update(
+            failed, ['status', 'attempts', 'last_error', 'next_attempt_at', 'claim']
+        )
+    if released:
+        # Stopped while waiting for the rate limit; hand them back untouched
+        OutboundMessage.objects.filter(pk__in=released, claim=token).update(
+            status=OutboundMessage.PENDING, claim='', next_attempt_at=now
+        )
+
+    with _stats_lock:
+        stats = _stats[channel]
+        stats.batches += 1
+        stats.sent += len(sent)
+        stats.retried += retried
+        stats.dead += dead + expired
+        stats.expired += expired
+        stats.latencies.extend(latencies)
+    return len(messages)
+
+
+def run_worker(channel, stop_event, drain=False):
+    """
+    Deliver channel messages until stop_event is set. Between empty polls
+    the worker sleeps DELIVERY_POLL_INTERVAL seconds, or until a message is
+    enqueued in this process. With drain, return once the queue is empty.
+    """
+    providers = getattr(settings, 'DELIVERY_PROVIDERS', DEFAULT_PROVIDERS)
+    provider = import_string(providers[channel])()
+    bucket = get_bucket(channel)
+    wakeup = _wakeups[channel]
+    poll_interval = getattr(settings, 'DELIVERY_POLL_INTERVAL', 2)
+    try:
+        while not stop_event.is_set():
+            wakeup.clear()
+            try:
+                claimed = deliver_batch(channel, provider, bucket, stop_event)
+            except Exception:
+                logger.exception('Delivering %s messages failed', channel)
+                claimed = 0
+                stop_event.wait(poll_interval)
+            finally:
+                close_old_connections()
+            if not claimed:
+                if drain:
+                    break
+                wakeup.wait(poll_interval)
+    finally:
+        provider.close()
+
+
+_workers = []
+_workers_stop = threading.Event()
+
+
+def start_delivery_workers(workers=None):
+    """
+    Start DELIVERY_WORKERS threads per channel (e.g. {'email': 2, 'sms': 1}).
+    Safe to call more than once.
+    """
+    workers = getattr(settings, 'DELIVERY_WORKERS', {}) if workers is None else workers
+    if any(thread.is_alive() for thread in _workers):
+        return _workers
+    _workers_stop.clear()
+    _workers.clear()
+    for channel, count in workers.items():
+        for i in range(count):
+            thread = threading.Thread(
+                target=run_worker, args=(channel, _workers_stop),
+                name=f'delivery-{channel}-{i}', daemon=True,
+            )
+            thread.start()
+            _workers.append(thread)
+    return _workers
+
+
+def stop_delivery_workers(timeout=None):
+    _workers_stop.set()
+    for channel in CHANNELS:
+        _wakeups[channel].set()
+    for thread in _workers:
+        thread.join(timeout)
@@ -0,0 +1,87 @@
+"""
+Magic link tokens.
+
+In 'signed' mode (the default) a token is a signed, timestamped payload
+holding the user id and email, so issuing one writes nothing. Single use is
+enforced by remembering the signatures of redeemed tokens, which only has
+to last until they would have expired anyway. 'table' mode stores a
+MagicLink row per link, as before. Both kinds of token are accepted
+whatever the mode, so links already sent survive a switch.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.utils import timezone
+
+from auth_core.backends import CachedModelBackend
+from auth_core.cache import ttl_store
+from auth_passwordless.models import MagicLink
+
+
+SALT = 'auth_passwordless.magic_link'
+
+
+class InvalidMagicLink(Exception):
+    """The token is unknown, tampered with, expired or already used."""
+
+
+def lifetime():
+    return getattr(settings, 'MAGIC_LINK_TTL', 900)
+
+
+used_tokens = ttl_store(
+    'auth_passwordless:magic_link',
+    ttl=lifetime(),
+    setting='MAGIC_LINK_USED_STORE',
+)
+
+
+def issue(user, email, ip_address=None):
+    """Return a new magic link token for user."""
+    if getattr(settings, 'MAGIC_LINK_MODE', 'signed') == 'table':
+        return MagicLink.objects.create(
+            user=user,
+            email=email,
+            ip_address=ip_address,
+            expires_at=timezone.now() + timedelta(seconds=lifetime()),
+        ).token
+    return signing.TimestampSigner(salt=SALT).sign_object({'u': user.pk, 'e': email})
+
+
+def _redeem_signed(token):
+    try:
+        payload = signing.TimestampSigner(salt=SALT).unsign_object(token, max_age=lifetime())
+    except signing.SignatureExpired:
+        raise InvalidMagicLink('Magic link has expired or been used')
+    except signing.BadSignature:
+        raise InvalidMagicLink('Invalid magic link')
+    user = CachedModelBackend().get_user(payload['u'])
+    # The link was sent to this address; it stops working if the email changes
+    if user is None or not user.is_active or user.email != payload['e']:
+        raise InvalidMagicLink('Invalid magic link')
+    if not used_tokens.add(token.rsplit(':', 1)[1], True):
+        raise InvalidMagicLink('Magic link has expired or been used')
+    return user, payload['e']
+
+
+def _redeem_stored(token):
+    magic_link = MagicLink.objects.select_related('user').filter(token=token).first()
+    if magic_link is None:
+        raise InvalidMagicLink('Invalid magic link')
+    now = timezone.now()
+    # Conditional UPDATE so concurrent requests cannot both use the link
+    used = MagicLink.objects.filter(pk=magic_link.pk, is_used=False, expires_at__gte=now).update(
+        is_used=True, used_at=now
+    )
+    if not used:
+        raise InvalidMagicLink('Magic link has expired or been used')
+    return magic_link.user, magic_link.email
+
+
+def redeem(token):
+    """Mark token used and return (user, email); raises InvalidMagicLink."""
+    # Table tokens are URL-safe base64 and never contain the signing separator
+    if ':' in token:
+        return _redeem_signed(token)
+    return _redeem_stored(token)
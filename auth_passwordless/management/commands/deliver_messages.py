@@ -0,0 +1,52 @@
+import threading
+
+from django.core.management.base import BaseCommand
+
+from auth_passwordless.delivery import CHANNELS, get_stats, queue_depth, run_worker
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued email and SMS messages (passwordless codes and links)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--channel', action='append', dest='channels', choices=CHANNELS,
+            help='Only deliver this channel (may be repeated)',
+        )
+        parser.add_argument('--workers', type=int, default=1, help='Threads per channel')
+        parser.add_argument('--drain', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        channels = options['channels'] or CHANNELS
+        stop = threading.Event()
+        threads = [
+            threading.Thread(
+                target=run_worker, args=(channel, stop), kwargs={'drain': options['drain']},
+                name=f'delivery-{channel}-{i}', daemon=True,
+            )
+            for channel in channels
+            for i in range(max(options['workers'], 1))
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(1)
+        except KeyboardInterrupt:
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+        depth = queue_depth()
+        for channel, stats in get_stats().items():
+            if channel not in channels:
+                continue
+            latency = (
+                f"p50 {stats['latency_p50']:.3f}s p95 {stats['latency_p95']:.3f}s p99 {stats['latency_p99']:.3f}s"
+                if stats['latency_p50'] is not None else 'no latency samples'
+            )
+            self.stdout.write(
+                f"{channel}: {stats['sent']} sent, {stats['retried']} retried, {stats['dead']} dead "
+                f"({stats['expired']} expired), {depth[channel]} queued; {latency}"
+            )
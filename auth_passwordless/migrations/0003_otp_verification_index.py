@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 00:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth_passwordless', '0002_outbound_messages'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='onetimecode',
+            index=models.Index(fields=['user', 'is_used', 'created_at'], name='one_time_co_user_id_11c752_idx'),
+        ),
+    ]
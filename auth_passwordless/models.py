@@ -1,6 +1,8 @@
 from django.db import models
+from django.db.models import F
 from django.contrib.auth.models import User
 from django.utils import timezone
+import hmac
 import secrets
 from datetime import timedelta
 
@@ -40,6 +42,14 @@ class MagicLink(models.Model):
 
 class OneTimeCode(models.Model):
     """Model for one-time codes sent via email/SMS"""
+    MAX_ATTEMPTS = 3
+    
+    # verify() results
+    ACCEPTED = 'accepted'
+    REJECTED = 'rejected'
+    EXHAUSTED = 'exhausted'
+    EXPIRED = 'expired'
+    
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='otp_codes')
     code = models.CharField(max_length=10)
     delivery_method = models.CharField(
@@ -56,6 +66,9 @@ class OneTimeCode(models.Model):
     class Meta:
         db_table = 'one_time_codes'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'is_used', 'created_at']),
+        ]
     
     def __str__(self):
         return f"OTP for {self.user.username}"
@@ -74,9 +87,91 @@ class OneTimeCode(models.Model):
     def is_valid(self):
         if self.is_used:
             return False
-        if self.attempts >= 3:  # Max 3 attempts
+        if self.attempts >= self.MAX_ATTEMPTS:
             return False
         if timezone.now() > self.expires_at:
             return False
         return True
+    
+    @classmethod
+    def verify(cls, email, code):
+        """
+        Check code against the latest unused code sent to email and return
+        (result, otp). The attempt is counted, and on a match the code is
+        consumed, by a single conditional UPDATE, so parallel guesses can
+        never exceed MAX_ATTEMPTS or use a code twice. Once a code is spent
+        further guesses cost only the SELECT.
+        """
+        # The user subquery (matching the partial unique index on email) lets
+        # the (user, is_used, created_at) index serve the lookup
+        otp = cls.objects.select_related('user').filter(
+            user__in=User.objects.filter(email=email).exclude(email='').values('pk'), is_used=False
+        ).order_by('-created_at').first()
+        if otp is None or not otp.is_valid():
+            return (cls.EXHAUSTED if otp is not None and otp.attempts >= cls.MAX_ATTEMPTS else cls.EXPIRED), otp
+        
+        now = timezone.now()
+        matched = hmac.compare_digest(str(code).encode(), otp.code.encode())
+        changes = {'attempts': F('attempts') + 1}
+        if matched:
+            changes.update(is_used=True, used_at=now)
+        updated = cls.objects.filter(
+            pk=otp.pk, is_used=False, attempts__lt=cls.MAX_ATTEMPTS, expires_at__gte=now
+        ).update(**changes)
+        if not updated:
+            # A parallel request spent the last attempt or the code itself
+            return cls.EXHAUSTED, otp
+        otp.attempts += 1
+        if matched:
+            otp.is_used, otp.used_at = True, now
+            return cls.ACCEPTED, otp
+        if otp.attempts >= cls.MAX_ATTEMPTS:
+            return cls.EXHAUSTED, otp
+        return cls.REJECTED, otp
+
+
+class PhoneNumber(models.Model):
+    """Phone number one-time codes are sent to by SMS"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='phone_number')
+    number = models.CharField(max_length=20, help_text="E.164 format, e.g. +15551234567")
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'phone_numbers'
+    
+    def __str__(self):
+        return f"{self.number} for {self.user.username}"
 
+
+class OutboundMessage(models.Model):
+    """Email or SMS waiting to be delivered (see auth_passwordless.delivery)"""
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    DEAD = 'dead'
+    
+    channel = models.CharField(max_length=10, choices=[('email', 'Email'), ('sms', 'SMS')])
+    recipient = models.CharField(max_length=254)
+    subject = models.CharField(max_length=255, blank=True)
+    body = models.TextField(help_text="Cleared once sent; it usually holds a secret")
+    status = models.CharField(
+        max_length=10,
+        choices=[(PENDING, 'Pending'), (SENDING, 'Sending'), (SENT, 'Sent'), (DEAD, 'Dead')],
+        default=PENDING
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claim = models.CharField(max_length=16, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'outbound_messages'
+        indexes = [
+            models.Index(fields=['channel', 'status', 'next_attempt_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.channel} to {self.recipient} ({self.status})"
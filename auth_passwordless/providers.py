@@ -0,0 +1,106 @@
+"""
+Delivery providers for outbound email and SMS.
+
+A provider instance belongs to one delivery worker thread and keeps its
+connection open between messages and batches: the email provider holds one
+SMTP connection from Django's mail backend, the SMS provider a
+requests.Session with keep-alive to the gateway.
+"""
+import smtplib
+
+import requests
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+
+class DeliveryError(Exception):
+    """
+    A message could not be handed to the provider. Permanent errors (e.g. a
+    rejected recipient) are dead-lettered at once; others are retried.
+    """
+
+    def __init__(self, message, permanent=False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+class EmailProvider:
+    """Sends email through EMAIL_BACKEND over a single reused connection."""
+
+    def __init__(self):
+        self.connection = None
+
+    def _send(self, email):
+        if self.connection is None:
+            self.connection = get_connection()
+            self.connection.open()
+        email.connection = self.connection
+        email.send()
+
+    def send(self, message):
+        email = EmailMessage(
+            subject=message.subject,
+            body=message.body,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[message.recipient],
+        )
+        try:
+            try:
+                self._send(email)
+            except smtplib.SMTPServerDisconnected:
+                # The server dropped the idle connection; reconnect once
+                self.close()
+                self._send(email)
+        except smtplib.SMTPRecipientsRefused as e:
+            codes = [code for code, _ in e.recipients.values()]
+            raise DeliveryError(f'Recipient refused: {codes}', permanent=all(500 <= c < 600 for c in codes))
+        except smtplib.SMTPResponseException as e:
+            self.close()
+            raise DeliveryError(f'SMTP {e.smtp_code}: {e.smtp_error!r}', permanent=500 <= e.smtp_code < 600)
+        except (smtplib.SMTPException, OSError) as e:
+            self.close()
+            raise DeliveryError(f'SMTP error: {e}')
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            finally:
+                self.connection = None
+
+
+class SMSGatewayProvider:
+    """
+    Sends SMS by POSTing {"to", "body", "sender"} as JSON to SMS_GATEWAY_URL,
+    authenticated with SMS_GATEWAY_TOKEN as a bearer token.
+    """
+
+    def __init__(self):
+        self.session = requests.Session()
+        token = getattr(settings, 'SMS_GATEWAY_TOKEN', '')
+        if token:
+            self.session.headers['Authorization'] = f'Bearer {token}'
+
+    def send(self, message):
+        url = getattr(settings, 'SMS_GATEWAY_URL', '')
+        if not url:
+            raise DeliveryError('SMS_GATEWAY_URL is not configured')
+        try:
+            response = self.session.post(
+                url,
+                json={
+                    'to': message.recipient,
+                    'body': message.body,
+                    'sender': getattr(settings, 'SMS_SENDER', ''),
+                },
+                timeout=getattr(settings, 'SMS_GATEWAY_TIMEOUT', 10),
+            )
+        except requests.RequestException as e:
+            raise DeliveryError(f'SMS gateway unreachable: {e}')
+        if response.status_code == 429 or response.status_code >= 500:
+            raise DeliveryError(f'SMS gateway returned {response.status_code}')
+        if response.status_code >= 400:
+            raise DeliveryError(f'SMS gateway rejected the message ({response.status_code})', permanent=True)
+
+    def close(self):
+        self.session.close()
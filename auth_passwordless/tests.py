@@ -1,3 +1,162 @@
-from django.test import TestCase
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from auth_core import throttling
+from auth_passwordless import delivery
+from auth_passwordless.models import OneTimeCode, OutboundMessage
+from auth_passwordless.providers import DeliveryError
+
+
+class StandInProvider:
+    """Records what it sends; recipients listed in failures raise their error instead."""
+
+    def __init__(self, **failures):
+        self.failures = failures
+        self.sent = []
+
+    def send(self, message):
+        error = self.failures.get(message.recipient.split('@')[0])
+        if error is not None:
+            raise error
+        self.sent.append((message.recipient, message.body))
+
+
+class TakeOverBucket:
+    """A rate limit slow enough that another worker claims a message meanwhile."""
+
+    def __init__(self, recipient):
+        self.recipient = recipient
+
+    def acquire(self, stop_event=None):
+        OutboundMessage.objects.filter(recipient=self.recipient).update(claim='other-worker')
+        time.sleep(0.01)
+        return True
+
+
+class StoppedBucket:
+
+    def acquire(self, stop_event=None):
+        return False
+
+
+class DeliverBatchTests(TestCase):
+
+    def enqueue(self, *recipients, **fields):
+        for recipient in recipients:
+            delivery.enqueue('email', recipient, f'code for {recipient}', **fields)
+
+    def statuses(self):
+        return dict(OutboundMessage.objects.values_list('recipient', 'status'))
+
+    def test_unexpected_error_dead_letters_only_that_message(self):
+        self.enqueue('a@example.com', 'b@example.com', 'c@example.com')
+        provider = StandInProvider(b=RuntimeError('provider bug'))
+        with self.assertLogs('auth_passwordless.delivery', 'WARNING'):
+            claimed = delivery.deliver_batch('email', provider, delivery.TokenBucket(0))
+        self.assertEqual(claimed, 3)
+        self.assertEqual(self.statuses(), {
+            'a@example.com': OutboundMessage.SENT,
+            'b@example.com': OutboundMessage.DEAD,
+            'c@example.com': OutboundMessage.SENT,
+        })
+        self.assertIn('RuntimeError', OutboundMessage.objects.get(recipient='b@example.com').last_error)
+
+    def test_outcomes_are_recorded(self):
+        self.enqueue('sent@example.com', 'transient@example.com', 'rejected@example.com')
+        self.enqueue('late@example.com', expires_at=timezone.now() - timedelta(seconds=1))
+        provider = StandInProvider(
+            transient=DeliveryError('try again'), rejected=DeliveryError('no such user', permanent=True),
+        )
+        with self.assertLogs('auth_passwordless.delivery', 'WARNING'):
+            delivery.deliver_batch('email', provider, delivery.TokenBucket(0))
+        self.assertEqual(provider.sent, [('sent@example.com', 'code for sent@example.com')])
+        self.assertEqual(self.statuses(), {
+            'sent@example.com': OutboundMessage.SENT,
+            'transient@example.com': OutboundMessage.PENDING,
+            'rejected@example.com': OutboundMessage.DEAD,
+            'late@example.com': OutboundMessage.DEAD,
+        })
+        self.assertEqual(OutboundMessage.objects.get(recipient='sent@example.com').body, '')
+        retry = OutboundMessage.objects.get(recipient='transient@example.com')
+        self.assertEqual(retry.attempts, 1)
+        self.assertGreater(retry.next_attempt_at, timezone.now())
+        # Nothing is due until the backoff has passed
+        self.assertEqual(delivery.deliver_batch('email', provider, delivery.TokenBucket(0)), 0)
+
+    @override_settings(DELIVERY_LEASE=0.001)
+    def test_message_taken_over_during_rate_limit_wait_is_not_sent(self):
+        self.enqueue('a@example.com', 'b@example.com', 'c@example.com')
+        provider = StandInProvider()
+        with self.assertLogs('auth_passwordless.delivery', 'WARNING'):
+            delivery.deliver_batch('email', provider, TakeOverBucket('b@example.com'))
+        self.assertEqual([recipient for recipient, _ in provider.sent], ['a@example.com', 'c@example.com'])
+        taken = OutboundMessage.objects.get(recipient='b@example.com')
+        self.assertEqual((taken.status, taken.claim, taken.attempts), (OutboundMessage.SENDING, 'other-worker', 0))
+
+    def test_stopped_worker_hands_messages_back(self):
+        self.enqueue('a@example.com')
+        delivery.deliver_batch('email', StandInProvider(), StoppedBucket())
+        message = OutboundMessage.objects.get()
+        self.assertEqual((message.status, message.claim, message.attempts), (OutboundMessage.PENDING, '', 0))
+
+
+class OneTimeCodeTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'unused-password')
+        self.otp = OneTimeCode.objects.create(user=self.user, code='123456')
+        patcher = mock.patch.object(throttling, 'store', throttling.SketchStore(width=256, depth=2))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def verify(self, code):
+        return self.client.post(
+            '/api/auth/passwordless/otp/verify/', {'email': 'alice@example.com', 'code': code},
+            content_type='application/json',
+        )
+
+    def test_attempts_are_counted_until_exhausted(self):
+        self.assertEqual(OneTimeCode.verify('alice@example.com', '000000')[0], OneTimeCode.REJECTED)
+        self.assertEqual(OneTimeCode.verify('alice@example.com', '000001')[0], OneTimeCode.REJECTED)
+        self.assertEqual(OneTimeCode.verify('alice@example.com', '000002')[0], OneTimeCode.EXHAUSTED)
+        # Even the right code is refused once the attempts are spent, without another UPDATE
+        with self.assertNumQueries(1):
+            self.assertEqual(OneTimeCode.verify('alice@example.com', '123456')[0], OneTimeCode.EXHAUSTED)
+        self.otp.refresh_from_db()
+        self.assertEqual((self.otp.attempts, self.otp.is_used), (3, False))
+
+    def test_code_is_consumed_once(self):
+        result, otp = OneTimeCode.verify('alice@example.com', '123456')
+        self.assertEqual((result, otp.pk), (OneTimeCode.ACCEPTED, self.otp.pk))
+        self.assertEqual(OneTimeCode.verify('alice@example.com', '123456')[0], OneTimeCode.EXPIRED)
+
+    def test_expired_code(self):
+        OneTimeCode.objects.filter(pk=self.otp.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(OneTimeCode.verify('alice@example.com', '123456')[0], OneTimeCode.EXPIRED)
+        self.assertEqual(OneTimeCode.verify('nobody@example.com', '123456')[0], OneTimeCode.EXPIRED)
+
+    def test_attempt_lost_to_a_parallel_request(self):
+        # Another request spends the last attempt between our SELECT and UPDATE
+        OneTimeCode.objects.filter(pk=self.otp.pk).update(attempts=OneTimeCode.MAX_ATTEMPTS)
+        with mock.patch.object(OneTimeCode, 'is_valid', return_value=True):
+            self.assertEqual(OneTimeCode.verify('alice@example.com', '123456')[0], OneTimeCode.EXHAUSTED)
+        self.otp.refresh_from_db()
+        self.assertFalse(self.otp.is_used)
+
+    def test_verify_endpoint_reports_remaining_attempts(self):
+        response = self.verify('000000')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Invalid code. 2 attempts remaining.')
+        self.verify('000001')
+        self.assertEqual(self.verify('000002').json()['error'], 'Too many failed attempts. Request a new code.')
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+    def test_verify_endpoint_logs_in(self):
+        response = self.verify('123456')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.session['_auth_user_id'], str(self.user.pk))
@@ -5,19 +5,17 @@ from rest_framework.response import Response
 from django.contrib.auth.models import User
 from django.contrib.auth import login
 from django.utils import timezone
-from auth_passwordless.models import MagicLink, OneTimeCode
-from auth_core.models import AuthenticationLog
-
-
-def get_client_ip(request):
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0]
-    else:
-        ip = request.META.get('REMOTE_ADDR')
-    return ip
+from datetime import timedelta
+from urllib.parse import urlencode
+from auth_passwordless import delivery, magic_links
+from auth_passwordless.models import OneTimeCode, PhoneNumber
+from auth_core import throttling
+from auth_core.audit import log_authentication
+from auth_core.context import get_context
+from auth_core.querybudget import query_budget
 
 
+@query_budget(4)
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def request_magic_link(request):
@@ -36,23 +34,24 @@ def request_magic_link(request):
     try:
         user = User.objects.get(email=email)
         
-        # Create magic link
-        magic_link = MagicLink.objects.create(
-            user=user,
-            email=email,
-            ip_address=get_client_ip(request)
-        )
-        
-        # In production, send email with magic link
+        # Create magic link (signed mode writes nothing)
+        token = magic_links.issue(user, email, ip_address=get_context(request).client_ip)
         magic_link_url = request.build_absolute_uri(
-            f'/api/auth/passwordless/magic-link/verify/?token={magic_link.token}'
+            f'/api/auth/passwordless/magic-link/verify/?{urlencode({"token": token})}'
+        )
+        minutes = magic_links.lifetime() // 60
+        
+        # Delivered in the background; the request only enqueues it
+        delivery.enqueue(
+            'email', email,
+            subject='Your sign-in link',
+            body=f'Sign in with this link, valid for {minutes} minutes:\n\n{magic_link_url}\n',
+            expires_at=timezone.now() + timedelta(seconds=magic_links.lifetime()),
         )
         
         return Response({
             'message': 'Magic link sent to your email',
-            'magic_link': magic_link_url,  # Remove in production
-            'expires_in': '15 minutes',
-            'note': 'In production, this would send an email. For testing, the link is included above.'
+            'expires_in': f'{minutes} minutes',
         })
         
     except User.DoesNotExist:
@@ -62,6 +61,7 @@ def request_magic_link(request):
         })
 
 
+@query_budget(12)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def verify_magic_link(request):
@@ -77,48 +77,30 @@ def verify_magic_link(request):
         )
     
     try:
-        magic_link = MagicLink.objects.get(token=token)
-        
-        if not magic_link.is_valid():
-            return Response(
-                {'error': 'Magic link has expired or been used'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Mark as used
-        magic_link.is_used = True
-        magic_link.used_at = timezone.now()
-        magic_link.save()
-        
-        # Log authentication
-        AuthenticationLog.objects.create(
-            user=magic_link.user,
-            auth_method='magic_link',
-            success=True,
-            ip_address=get_client_ip(request),
-            user_agent=request.META.get('HTTP_USER_AGENT', ''),
-            details={'email': magic_link.email}
-        )
-        
-        # Authenticate user
-        login(request, magic_link.user, backend='django.contrib.auth.backends.ModelBackend')
-        
-        return Response({
-            'message': 'Authentication successful',
-            'user': {
-                'id': magic_link.user.id,
-                'username': magic_link.user.username,
-                'email': magic_link.user.email,
-            }
-        })
-        
-    except MagicLink.DoesNotExist:
+        user, email = magic_links.redeem(token)
+    except magic_links.InvalidMagicLink as e:
         return Response(
-            {'error': 'Invalid magic link'},
+            {'error': str(e)},
             status=status.HTTP_400_BAD_REQUEST
         )
+    
+    # Log authentication
+    log_authentication(request, 'magic_link', True, user=user, details={'email': email})
+    
+    # Authenticate user
+    login(request, user, backend='auth_core.backends.CachedModelBackend')
+    
+    return Response({
+        'message': 'Authentication successful',
+        'user': {
+            'id': user.id,
+            'username': user.username,
+            'email': user.email,
+        }
+    })
 
 
+@query_budget(5)
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def request_otp(request):
@@ -144,18 +126,34 @@ def request_otp(request):
     try:
         user = User.objects.get(email=email)
         
+        if delivery_method == 'sms':
+            phone = PhoneNumber.objects.filter(user=user).values_list('number', flat=True).first()
+            if not phone:
+                return Response(
+                    {'error': 'No phone number registered for SMS delivery'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            recipient = phone
+        else:
+            recipient = email
+        
         # Create OTP
         otp = OneTimeCode.objects.create(
             user=user,
             delivery_method=delivery_method
         )
         
-        # In production, send email/SMS with OTP
+        # Delivered in the background; the request only enqueues it
+        delivery.enqueue(
+            delivery_method, recipient,
+            subject='Your sign-in code',
+            body=f'Your sign-in code is {otp.code}. It expires in 10 minutes.',
+            expires_at=otp.expires_at,
+        )
+        
         return Response({
             'message': f'One-time code sent via {delivery_method}',
-            'otp': otp.code,  # Remove in production
             'expires_in': '10 minutes',
-            'note': 'In production, the OTP would be sent and not returned in response.'
         })
         
     except User.DoesNotExist:
@@ -165,6 +163,7 @@ def request_otp(request):
         })
 
 
+@query_budget(12)
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def verify_otp(request):
@@ -180,66 +179,46 @@ def verify_otp(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    try:
-        user = User.objects.get(email=email)
-        
-        # Get the most recent valid OTP
-        otp = OneTimeCode.objects.filter(
-            user=user,
-            is_used=False
-        ).order_by('-created_at').first()
-        
-        if not otp or not otp.is_valid():
-            return Response(
-                {'error': 'Invalid or expired code'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Increment attempts
-        otp.attempts += 1
-        otp.save()
-        
-        if otp.code != code:
-            if otp.attempts >= 3:
-                return Response(
-                    {'error': 'Too many failed attempts. Request a new code.'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            return Response(
-                {'error': f'Invalid code. {3 - otp.attempts} attempts remaining.'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Mark as used
-        otp.is_used = True
-        otp.used_at = timezone.now()
-        otp.save()
-        
-        # Log authentication
-        AuthenticationLog.objects.create(
-            user=user,
-            auth_method='otp',
-            success=True,
-            ip_address=get_client_ip(request),
-            user_agent=request.META.get('HTTP_USER_AGENT', ''),
-            details={'email': email, 'delivery_method': otp.delivery_method}
+    throttling.check(request, username=email)
+    
+    # One conditional UPDATE counts the attempt and, on a match, consumes the code
+    result, otp = OneTimeCode.verify(email, code)
+    if result != OneTimeCode.ACCEPTED:
+        throttling.failure(request, username=email)
+    
+    if result == OneTimeCode.EXPIRED:
+        return Response(
+            {'error': 'Invalid or expired code'},
+            status=status.HTTP_400_BAD_REQUEST
         )
-        
-        # Authenticate user
-        login(request, user, backend='django.contrib.auth.backends.ModelBackend')
-        
-        return Response({
-            'message': 'Authentication successful',
-            'user': {
-                'id': user.id,
-                'username': user.username,
-                'email': user.email,
-            }
-        })
-        
-    except User.DoesNotExist:
+    if result == OneTimeCode.EXHAUSTED:
         return Response(
-            {'error': 'Invalid credentials'},
-            status=status.HTTP_401_UNAUTHORIZED
+            {'error': 'Too many failed attempts. Request a new code.'},
+            status=status.HTTP_400_BAD_REQUEST
         )
-
+    if result == OneTimeCode.REJECTED:
+        return Response(
+            {'error': f'Invalid code. {OneTimeCode.MAX_ATTEMPTS - otp.attempts} attempts remaining.'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    user = otp.user
+    
+    # Log authentication
+    log_authentication(
+        request, 'otp', True,
+        user=user,
+        details={'email': email, 'delivery_method': otp.delivery_method}
+    )
+    
+    # Authenticate user
+    login(request, user, backend='auth_core.backends.CachedModelBackend')
+    
+    return Response({
+        'message': 'Authentication successful',
+        'user': {
+            'id': user.id,
+            'username': user.username,
+            'email': user.email,
+        }
+    })
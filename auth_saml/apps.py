@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class AuthSamlConfig(AppConfig):
     name = 'auth_saml'
+
+    def ready(self):
+        from auth_saml import signals  # noqa: F401
@@ -0,0 +1,297 @@
+"""
+XML-DSig for SAML: enveloped-signature verification with exclusive C14N,
+and signing of messages that are already in canonical form.
+
+Verification keys come pre-parsed from the service-provider registry and
+the IdP signing key is loaded once per process, so no X.509 or PEM parsing
+happens per message. Outgoing messages are rendered from templates that
+are byte-for-byte Exclusive Canonical XML, which lets us digest and sign
+them without building or canonicalizing a DOM.
+"""
+import base64
+import datetime
+import hashlib
+import hmac
+import logging
+import threading
+
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, padding, rsa
+from cryptography.hazmat.primitives.asymmetric.utils import encode_dss_signature
+from cryptography.x509.oid import NameOID
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from lxml import etree
+
+from auth_saml.parsing import NS, SAMLError, text_of
+
+
+logger = logging.getLogger(__name__)
+
+EXC_C14N = 'http://www.w3.org/2001/10/xml-exc-c14n#'
+ENVELOPED = 'http://www.w3.org/2000/09/xmldsig#enveloped-signature'
+RSA_SHA256 = 'http://www.w3.org/2001/04/xmldsig-more#rsa-sha256'
+SHA256 = 'http://www.w3.org/2001/04/xmlenc#sha256'
+
+SIGNATURE_METHODS = {
+    RSA_SHA256: hashes.SHA256,
+    'http://www.w3.org/2001/04/xmldsig-more#rsa-sha512': hashes.SHA512,
+    'http://www.w3.org/2001/04/xmldsig-more#ecdsa-sha256': hashes.SHA256,
+    'http://www.w3.org/2001/04/xmldsig-more#ecdsa-sha512': hashes.SHA512,
+}
+DIGEST_METHODS = {
+    SHA256: 'sha256',
+    'http://www.w3.org/2001/04/xmlenc#sha512': 'sha512',
+}
+SHA1_SIGNATURE_METHODS = {
+    'http://www.w3.org/2000/09/xmldsig#rsa-sha1': hashes.SHA1,
+    'http://www.w3.org/2001/04/xmldsig-more#ecdsa-sha1': hashes.SHA1,
+}
+SHA1_DIGEST_METHODS = {'http://www.w3.org/2000/09/xmldsig#sha1': 'sha1'}
+
+
+def _signature_hash(algorithm):
+    hash_class = SIGNATURE_METHODS.get(algorithm)
+    if hash_class is None and getattr(settings, 'SAML_ALLOW_SHA1', False):
+        hash_class = SHA1_SIGNATURE_METHODS.get(algorithm)
+    if hash_class is None:
+        raise SAMLError(f'Unsupported signature algorithm {algorithm}')
+    return hash_class()
+
+
+def _digest_name(algorithm):
+    name = DIGEST_METHODS.get(algorithm)
+    if name is None and getattr(settings, 'SAML_ALLOW_SHA1', False):
+        name = SHA1_DIGEST_METHODS.get(algorithm)
+    if name is None:
+        raise SAMLError(f'Unsupported digest algorithm {algorithm}')
+    return name
+
+
+def verify_bytes(public_key, algorithm, signature, data):
+    """Check a raw signature over data; raise SAMLError if it does not verify."""
+    hash_algorithm = _signature_hash(algorithm)
+    try:
+        if isinstance(public_key, rsa.RSAPublicKey):
+            public_key.verify(signature, data, padding.PKCS1v15(), hash_algorithm)
+        elif isinstance(public_key, ec.EllipticCurvePublicKey):
+            # XML-DSig carries ECDSA signatures as raw r || s
+            size = len(signature) // 2
+            der = encode_dss_signature(
+                int.from_bytes(signature[:size], 'big'), int.from_bytes(signature[size:], 'big')
+            )
+            public_key.verify(der, data, ec.ECDSA(hash_algorithm))
+        else:
+            raise SAMLError('Unsupported key type')
+    except InvalidSignature:
+        raise SAMLError('Invalid signature')
+
+
+def canonicalize(element, prefixes=None):
+    return etree.tostring(
+        element, method='c14n', exclusive=True, with_comments=False,
+        inclusive_ns_prefixes=prefixes or None,
+    )
+
+
+def _prefix_list(element):
+    inclusive = element.find('ec:InclusiveNamespaces', NS) if element is not None else None
+    return inclusive.get('PrefixList', '').split() if inclusive is not None else None
+
+
+def _canonicalize_without(element, signature, prefixes):
+    # Apply the enveloped-signature transform in place, then restore the tree
+    index = element.index(signature)
+    previous = signature.getprevious()
+    tail = signature.tail
+    saved = previous.tail if previous is not None else element.text
+    if tail:
+        if previous is not None:
+            previous.tail = (saved or '') + tail
+        else:
+            element.text = (saved or '') + tail
+    element.remove(signature)
+    try:
+        return canonicalize(element, prefixes)
+    finally:
+        element.insert(index, signature)
+        signature.tail = tail
+        if previous is not None:
+            previous.tail = saved
+        else:
+            element.text = saved
+
+
+def is_signed(element):
+    return element.find('ds:Signature', NS) is not None
+
+
+def verify_enveloped(element, public_key):
+    """
+    Verify the enveloped signature directly under element against public_key.
+
+    Only a single same-document reference to element itself is accepted, and
+    its ID must be unique in the document, so callers can trust everything
+    they subsequently read from element.
+    """
+    signature = element.find('ds:Signature', NS)
+    if signature is None:
+        raise SAMLError('Message is not signed')
+    if public_key is None:
+        raise SAMLError('No verification key registered for issuer')
+
+    signed_info = signature.find('ds:SignedInfo', NS)
+    if signed_info is None:
+        raise SAMLError('Malformed signature')
+    c14n_method = signed_info.find('ds:CanonicalizationMethod', NS)
+    if c14n_method is None or c14n_method.get('Algorithm') != EXC_C14N:
+        raise SAMLError('Unsupported canonicalization method')
+    signature_method = signed_info.find('ds:SignatureMethod', NS)
+    references = signed_info.findall('ds:Reference', NS)
+    if signature_method is None or len(references) != 1:
+        raise SAMLError('Malformed signature')
+
+    reference = references[0]
+    element_id = element.get('ID')
+    if not element_id or reference.get('URI') != f'#{element_id}':
+        raise SAMLError('Signature does not reference the signed element')
+    if len(element.getroottree().xpath('//*[@ID=$id]', id=element_id)) != 1:
+        raise SAMLError('Duplicate element ID')
+
+    transforms = reference.findall('ds:Transforms/ds:Transform', NS)
+    algorithms = [transform.get('Algorithm') for transform in transforms]
+    if ENVELOPED not in algorithms or not set(algorithms) <= {ENVELOPED, EXC_C14N}:
+        raise SAMLError('Unsupported signature transforms')
+    exc_transform = next((t for t in transforms if t.get('Algorithm') == EXC_C14N), None)
+
+    digest_method = reference.find('ds:DigestMethod', NS)
+    digest_name = _digest_name(digest_method.get('Algorithm') if digest_method is not None else None)
+    try:
+        expected_digest = base64.b64decode(text_of(reference.find('ds:DigestValue', NS)))
+        signature_value = base64.b64decode(''.join(text_of(signature.find('ds:SignatureValue', NS)).split()))
+    except ValueError:
+        raise SAMLError('Malformed signature')
+
+    verify_bytes(
+        public_key, signature_method.get('Algorithm'), signature_value,
+        canonicalize(signed_info, _prefix_list(c14n_method)),
+    )
+    digest = hashlib.new(
+        digest_name, _canonicalize_without(element, signature, _prefix_list(exc_transform))
+    ).digest()
+    if not hmac.compare_digest(digest, expected_digest):
+        raise SAMLError('Digest mismatch')
+    return element
+
+
+# SignedInfo is signed in its standalone canonical form, which declares the
+# ds namespace, but embedded without it since Signature already declares it
+SIGNED_INFO_TEMPLATE = (
+    '<ds:SignedInfo>'
+    f'<ds:CanonicalizationMethod Algorithm="{EXC_C14N}"></ds:CanonicalizationMethod>'
+    f'<ds:SignatureMethod Algorithm="{RSA_SHA256}"></ds:SignatureMethod>'
+    '<ds:Reference URI="#{reference}"><ds:Transforms>'
+    f'<ds:Transform Algorithm="{ENVELOPED}"></ds:Transform>'
+    f'<ds:Transform Algorithm="{EXC_C14N}"></ds:Transform>'
+    f'</ds:Transforms><ds:DigestMethod Algorithm="{SHA256}"></ds:DigestMethod>'
+    '<ds:DigestValue>{digest}</ds:DigestValue></ds:Reference></ds:SignedInfo>'
+)
+
+SIGNATURE_TEMPLATE = (
+    '<ds:Signature xmlns:ds="http://www.w3.org/2000/09/xmldsig#">{signed_info}'
+    '<ds:SignatureValue>{value}</ds:SignatureValue>'
+    '<ds:KeyInfo><ds:X509Data><ds:X509Certificate>{certificate}</ds:X509Certificate>'
+    '</ds:X509Data></ds:KeyInfo></ds:Signature>'
+)
+
+
+class SigningKey:
+    """The IdP's RSA signing key and certificate, parsed once."""
+
+    __slots__ = ('private_key', 'certificate', 'certificate_body')
+
+    def __init__(self, private_key, certificate):
+        if not isinstance(private_key, rsa.RSAPrivateKey):
+            raise ImproperlyConfigured('The SAML signing key must be an RSA key')
+        self.private_key = private_key
+        self.certificate = certificate
+        self.certificate_body = base64.b64encode(
+            certificate.public_bytes(serialization.Encoding.DER)
+        ).decode('ascii')
+
+    @property
+    def public_key(self):
+        return self.private_key.public_key()
+
+    def sign(self, data):
+        return self.private_key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+
+    def sign_enveloped(self, head, body, reference):
+        """
+        Sign a canonical message split after its Issuer element and return the
+        message with the Signature inserted between head and body.
+        """
+        digest = base64.b64encode(hashlib.sha256(head + body).digest()).decode('ascii')
+        signed_info = SIGNED_INFO_TEMPLATE.format(reference=reference, digest=digest)
+        canonical = signed_info.replace('<ds:SignedInfo>', f'<ds:SignedInfo xmlns:ds="{NS["ds"]}">', 1)
+        value = base64.b64encode(self.sign(canonical.encode())).decode('ascii')
+        signature = SIGNATURE_TEMPLATE.format(
+            signed_info=signed_info, value=value, certificate=self.certificate_body
+        )
+        return head + signature.encode() + body
+
+    @classmethod
+    def generate(cls, common_name='auth-service SAML IdP'):
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+        now = datetime.datetime.now(datetime.timezone.utc)
+        certificate = (
+            x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(private_key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(minutes=5))
+            .not_valid_after(now + datetime.timedelta(days=365))
+            .sign(private_key, hashes.SHA256())
+        )
+        return cls(private_key, certificate)
+
+
+_signing_key = None
+_signing_key_lock = threading.Lock()
+
+
+def _load_signing_key():
+    key_file = getattr(settings, 'SAML_IDP_PRIVATE_KEY_FILE', '')
+    certificate_file = getattr(settings, 'SAML_IDP_CERTIFICATE_FILE', '')
+    if key_file and certificate_file:
+        with open(key_file, 'rb') as f:
+            private_key = serialization.load_pem_private_key(f.read(), password=None)
+        with open(certificate_file, 'rb') as f:
+            certificate = x509.load_pem_x509_certificate(f.read())
+        return SigningKey(private_key, certificate)
+    if settings.DEBUG:
+        logger.warning('SAML_IDP_PRIVATE_KEY_FILE is not set; using an ephemeral signing key')
+        return SigningKey.generate()
+    raise ImproperlyConfigured('SAML_IDP_PRIVATE_KEY_FILE and SAML_IDP_CERTIFICATE_FILE must be set')
+
+
+def get_signing_key():
+    global _signing_key
+    if _signing_key is None:
+        with _signing_key_lock:
+            if _signing_key is None:
+                _signing_key = _load_signing_key()
+    return _signing_key
+
+
+def signing_certificate_body():
+    """Base64 DER of the IdP certificate for metadata, or '' if none is configured."""
+    try:
+        return get_signing_key().certificate_body
+    except ImproperlyConfigured:
+        return ''
+
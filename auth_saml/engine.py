@@ -0,0 +1,376 @@
+"""
+SAML 2.0 protocol processing for the IdP (SSO, SLO) and SP (ACS) roles.
+
+Incoming messages are decoded from their binding, parsed with the hardened
+parser, attributed to a registered entity by Issuer and verified with that
+entity's pre-parsed key: a service provider for requests, a trusted
+identity provider (never a service provider) for Responses at our ACS. Outgoing Responses are rendered from templates in
+Exclusive Canonical XML form and signed without building a DOM. Assertion
+IDs are remembered in a TTL store for longer than any accepted assertion
+is valid, so each assertion is consumed at most once.
+"""
+import calendar
+import secrets
+import time
+
+from django.conf import settings
+
+from auth_core.cache import ttl_store
+from auth_saml.bindings import decode_post, decode_redirect, verify_redirect_signature
+from auth_saml.dsig import get_signing_key, is_signed, verify_enveloped
+from auth_saml.parsing import NS, SAMLError, escape_attr, escape_text, parse_xml, qname, text_of
+from auth_saml.registry import TrustedIdentityProvider, sp_registry
+
+
+SUCCESS = 'urn:oasis:names:tc:SAML:2.0:status:Success'
+BEARER = 'urn:oasis:names:tc:SAML:2.0:cm:bearer'
+NAMEID_EMAIL = 'urn:oasis:names:tc:SAML:1.1:nameid-format:emailAddress'
+NAMEID_UNSPECIFIED = 'urn:oasis:names:tc:SAML:1.1:nameid-format:unspecified'
+
+seen_assertions = ttl_store(
+    'auth_saml:assertion',
+    ttl=getattr(settings, 'SAML_REPLAY_TTL', 3600),
+    setting='SAML_REPLAY_STORE',
+)
+
+
+def _instant(timestamp):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+
+
+def _parse_instant(value):
+    value = (value or '').strip().rstrip('Z')
+    seconds, _, fraction = value.partition('.')
+    try:
+        timestamp = calendar.timegm(time.strptime(seconds, '%Y-%m-%dT%H:%M:%S'))
+    except ValueError:
+        raise SAMLError(f'Invalid timestamp {value!r}')
+    return timestamp + (float(f'0.{fraction}') if fraction.isdigit() else 0)
+
+
+def _new_id():
+    return f'_{secrets.token_hex(16)}'
+
+
+def idp_entity_id(base_url):
+    return getattr(settings, 'SAML_IDP_ENTITY_ID', '') or f'{base_url}/saml/metadata'
+
+
+class SAMLMessage:
+    """
+    A decoded message attributed to a registered entity; sp is the service
+    provider, or for a Response the trusted identity provider, that issued it.
+    """
+
+    __slots__ = ('root', 'issuer', 'sp', 'signed', 'relay_state')
+
+    def __init__(self, root, issuer, sp, signed, relay_state):
+        self.root = root
+        self.issuer = issuer
+        self.sp = sp
+        self.signed = signed
+        self.relay_state = relay_state
+
+
+def receive_message(param, value, binding_is_redirect, query_string='', relay_state=None, lookup=None):
+    """
+    Decode, parse and authenticate a message. A signature, when present, is
+    always verified against the issuer's registered key.
+    """
+    if not value:
+        raise SAMLError(f'{param} parameter is required')
+    xml = decode_redirect(value) if binding_is_redirect else decode_post(value)
+    root = parse_xml(xml)
+    issuer = text_of(root.find('saml:Issuer', NS))
+    sp = (lookup or sp_registry.get)(issuer)
+    if sp is None:
+        raise SAMLError('Unknown issuer')
+    if binding_is_redirect:
+        signed = verify_redirect_signature(query_string, param, sp.public_key)
+    else:
+        signed = is_signed(root)
+        if signed:
+            verify_enveloped(root, sp.public_key)
+    return SAMLMessage(root, issuer, sp, signed, relay_state)
+
+
+def receive(request, param, lookup=None):
+    """receive_message() for the binding used by request."""
+    if request.method == 'GET':
+        return receive_message(
+            param, request.GET.get(param), True,
+            request.META.get('QUERY_STRING', ''), request.GET.get('RelayState'), lookup,
+        )
+    return receive_message(
+        param, request.POST.get(param), False, relay_state=request.POST.get('RelayState'), lookup=lookup,
+    )
+
+
+def _require_signed_request(message):
+    if getattr(settings, 'SAML_WANT_REQUESTS_SIGNED', False) and not message.signed:
+        raise SAMLError('Request must be signed')
+
+
+class AuthnRequest:
+    __slots__ = ('id', 'sp', 'acs_url', 'name_id_format', 'relay_state')
+
+    def __init__(self, id, sp, acs_url, name_id_format, relay_state):
+        self.id = id
+        self.sp = sp
+        self.acs_url = acs_url
+        self.name_id_format = name_id_format
+        self.relay_state = relay_state
+
+
+def parse_authn_request(message):
+    root = message.root
+    if root.tag != qname('samlp', 'AuthnRequest'):
+        raise SAMLError('Expected an AuthnRequest')
+    _require_signed_request(message)
+    request_id = root.get('ID')
+    if not request_id:
+        raise SAMLError('AuthnRequest has no ID')
+    acs_url = root.get('AssertionConsumerServiceURL') or message.sp.acs_url
+    if acs_url != message.sp.acs_url:
+        raise SAMLError('AssertionConsumerServiceURL is not registered for this service provider')
+    policy = root.find('samlp:NameIDPolicy', NS)
+    name_id_format = policy.get('Format', '') if policy is not None else ''
+    return AuthnRequest(request_id, message.sp, acs_url, name_id_format, message.relay_state)
+
+
+# Templates are Exclusive Canonical XML: attributes in canonical order, no
+# self-closing tags, namespaces declared where first used. Their rendered
+# bytes are therefore exactly what a verifier canonicalizes.
+ASSERTION_HEAD = (
+    '<saml:Assertion xmlns:saml="urn:oasis:names:tc:SAML:2.0:assertion" ID="{id}" '
+    'IssueInstant="{now}" Version="2.0"><saml:Issuer>{issuer}</saml:Issuer>'
+)
+ASSERTION_BODY = (
+    '<saml:Subject><saml:NameID Format="{name_id_format}">{name_id}</saml:NameID>'
+    f'<saml:SubjectConfirmation Method="{BEARER}">'
+    '<saml:SubjectConfirmationData{in_response_to} NotOnOrAfter="{expires}" Recipient="{acs_url}">'
+    '</saml:SubjectConfirmationData></saml:SubjectConfirmation></saml:Subject>'
+    '<saml:Conditions NotBefore="{not_before}" NotOnOrAfter="{expires}"><saml:AudienceRestriction>'
+    '<saml:Audience>{audience}</saml:Audience></saml:AudienceRestriction></saml:Conditions>'
+    '<saml:AuthnStatement AuthnInstant="{now}" SessionIndex="{session_index}"><saml:AuthnContext>'
+    '<saml:AuthnContextClassRef>urn:oasis:names:tc:SAML:2.0:ac:classes:PasswordProtectedTransport'
+    '</saml:AuthnContextClassRef></saml:AuthnContext></saml:AuthnStatement>'
+    '<saml:AttributeStatement>{attributes}</saml:AttributeStatement></saml:Assertion>'
+)
+ATTRIBUTE = (
+    '<saml:Attribute Name="{name}" NameFormat="urn:oasis:names:tc:SAML:2.0:attrname-format:basic">'
+    '<saml:AttributeValue>{value}</saml:AttributeValue></saml:Attribute>'
+)
+RESPONSE_HEAD = (
+    '<samlp:Response xmlns:samlp="urn:oasis:names:tc:SAML:2.0:protocol" Destination="{destination}" '
+    'ID="{id}"{in_response_to} IssueInstant="{now}" Version="2.0">'
+    '<saml:Issuer xmlns:saml="urn:oasis:names:tc:SAML:2.0:assertion">{issuer}</saml:Issuer>'
+)
+RESPONSE_STATUS = (
+    f'<samlp:Status><samlp:StatusCode Value="{SUCCESS}"></samlp:StatusCode></samlp:Status>'
+)
+LOGOUT_RESPONSE_HEAD = (
+    '<samlp:LogoutResponse xmlns:samlp="urn:oasis:names:tc:SAML:2.0:protocol"{destination} '
+    'ID="{id}" InResponseTo="{in_response_to}" IssueInstant="{now}" Version="2.0">'
+    '<saml:Issuer xmlns:saml="urn:oasis:names:tc:SAML:2.0:assertion">{issuer}</saml:Issuer>'
+)
+
+
+def user_attributes(user):
+    return (
+        ('uid', user.username),
+        ('email', user.email),
+        ('givenName', user.first_name),
+        ('sn', user.last_name),
+    )
+
+
+def build_response(sp, user, issuer, in_response_to='', session_index='', name_id_format='', key=None):
+    """Render and sign a successful Response carrying a signed assertion for user."""
+    key = key or get_signing_key()
+    now = time.time()
+    lifetime = getattr(settings, 'SAML_ASSERTION_LIFETIME', 300)
+    skew = getattr(settings, 'SAML_CLOCK_SKEW', 120)
+    if name_id_format == NAMEID_EMAIL and user.email:
+        name_id, name_id_format = user.email, NAMEID_EMAIL
+    else:
+        name_id, name_id_format = user.username, NAMEID_UNSPECIFIED
+
+    issuer = escape_text(issuer)
+    now_text = _instant(now)
+    in_response_attr = f' InResponseTo="{escape_attr(in_response_to)}"' if in_response_to else ''
+    assertion_id = _new_id()
+    attributes = ''.join(
+        ATTRIBUTE.format(name=name, value=escape_text(value))
+        for name, value in user_attributes(user) if value
+    )
+    assertion = key.sign_enveloped(
+        ASSERTION_HEAD.format(id=assertion_id, now=now_text, issuer=issuer).encode(),
+        ASSERTION_BODY.format(
+            name_id_format=name_id_format,
+            name_id=escape_text(name_id),
+            in_response_to=in_response_attr,
+            expires=_instant(now + lifetime),
+            not_before=_instant(now - skew),
+            acs_url=escape_attr(sp.acs_url),
+            audience=escape_text(sp.entity_id),
+            now=now_text,
+            session_index=escape_attr(session_index or assertion_id),
+            attributes=attributes,
+        ).encode(),
+        assertion_id,
+    )
+    response_id = _new_id()
+    head = RESPONSE_HEAD.format(
+        destination=escape_attr(sp.acs_url), id=response_id,
+        in_response_to=in_response_attr, now=now_text, issuer=issuer,
+    ).encode()
+    # The signed assertion is already canonical, so it is spliced in as bytes
+    body = RESPONSE_STATUS.encode() + assertion + b'</samlp:Response>'
+    if getattr(settings, 'SAML_SIGN_RESPONSE', True):
+        return key.sign_enveloped(head, body, response_id)
+    return head + body
+
+
+class LogoutRequest:
+    __slots__ = ('id', 'sp', 'name_id', 'session_index', 'relay_state')
+
+    def __init__(self, id, sp, name_id, session_index, relay_state):
+        self.id = id
+        self.sp = sp
+        self.name_id = name_id
+        self.session_index = session_index
+        self.relay_state = relay_state
+
+
+def parse_logout_request(message):
+    root = message.root
+    if root.tag != qname('samlp', 'LogoutRequest'):
+        raise SAMLError('Expected a LogoutRequest')
+    # Unlike an AuthnRequest, a forged LogoutRequest acts on the session
+    if not message.signed:
+        raise SAMLError('LogoutRequest must be signed')
+    if not root.get('ID'):
+        raise SAMLError('LogoutRequest has no ID')
+    return LogoutRequest(
+        root.get('ID'), message.sp,
+        text_of(root.find('saml:NameID', NS)),
+        text_of(root.find('samlp:SessionIndex', NS)),
+        message.relay_state,
+    )
+
+
+def build_logout_response(logout_request, issuer, key=None):
+    key = key or get_signing_key()
+    sp = logout_request.sp
+    response_id = _new_id()
+    destination = f' Destination="{escape_attr(sp.slo_url)}"' if sp.slo_url else ''
+    head = LOGOUT_RESPONSE_HEAD.format(
+        destination=destination, id=response_id, in_response_to=escape_attr(logout_request.id),
+        now=_instant(time.time()), issuer=escape_text(issuer),
+    ).encode()
+    return key.sign_enveloped(head, RESPONSE_STATUS.encode() + b'</samlp:LogoutResponse>', response_id)
+
+
+class Assertion:
+    __slots__ = ('id', 'issuer', 'name_id', 'name_id_format', 'session_index', 'attributes')
+
+    def __init__(self, id, issuer, name_id, name_id_format, session_index, attributes):
+        self.id = id
+        self.issuer = issuer
+        self.name_id = name_id
+        self.name_id_format = name_id_format
+        self.session_index = session_index
+        self.attributes = attributes
+
+
+def _check_window(element, now, skew):
+    """Check NotBefore/NotOnOrAfter on element; return NotOnOrAfter or None."""
+    not_before = element.get('NotBefore')
+    if not_before and now + skew < _parse_instant(not_before):
+        raise SAMLError('Assertion is not yet valid')
+    not_on_or_after = element.get('NotOnOrAfter')
+    if not_on_or_after:
+        expires = _parse_instant(not_on_or_after)
+        if now - skew >= expires:
+            raise SAMLError('Assertion has expired')
+        return expires
+    return None
+
+
+def consume_response(message, audience, acs_url):
+    """
+    Validate a Response received at our ACS and return its Assertion. The
+    message must come from a trusted identity provider (see receive(...,
+    lookup=idp_registry.get)), and the assertion must be covered by a
+    verified signature, addressed to audience and acs_url, inside its
+    validity window and not seen before.
+    """
+    if not isinstance(message.sp, TrustedIdentityProvider):
+        raise SAMLError('Unknown identity provider')
+    root = message.root
+    if root.tag != qname('samlp', 'Response'):
+        raise SAMLError('Expected a Response')
+    status_code = root.find('samlp:Status/samlp:StatusCode', NS)
+    if status_code is None or status_code.get('Value') != SUCCESS:
+        raise SAMLError('Authentication failed at the identity provider')
+    if root.get('Destination') and root.get('Destination') != acs_url:
+        raise SAMLError('Response destination mismatch')
+    if root.find('saml:EncryptedAssertion', NS) is not None:
+        raise SAMLError('Encrypted assertions are not supported')
+    assertions = root.findall('saml:Assertion', NS)
+    if len(assertions) != 1:
+        raise SAMLError('Response must contain exactly one assertion')
+
+    assertion = assertions[0]
+    if is_signed(assertion):
+        verify_enveloped(assertion, message.sp.public_key)
+    elif not message.signed:
+        raise SAMLError('Assertion is not signed')
+    assertion_id = assertion.get('ID')
+    if not assertion_id:
+        raise SAMLError('Assertion has no ID')
+    if text_of(assertion.find('saml:Issuer', NS)) != message.issuer:
+        raise SAMLError('Assertion issuer mismatch')
+
+    now = time.time()
+    skew = getattr(settings, 'SAML_CLOCK_SKEW', 120)
+    conditions = assertion.find('saml:Conditions', NS)
+    if conditions is None:
+        raise SAMLError('Assertion has no conditions')
+    expiries = [_check_window(conditions, now, skew)]
+    audiences = [text_of(a) for a in conditions.findall('saml:AudienceRestriction/saml:Audience', NS)]
+    if audience not in audiences:
+        raise SAMLError('Assertion audience mismatch')
+
+    subject = assertion.find('saml:Subject', NS)
+    confirmation = subject.find(
+        f'saml:SubjectConfirmation[@Method="{BEARER}"]/saml:SubjectConfirmationData', NS
+    ) if subject is not None else None
+    if confirmation is None:
+        raise SAMLError('Assertion has no bearer subject confirmation')
+    if confirmation.get('Recipient') != acs_url:
+        raise SAMLError('Assertion recipient mismatch')
+    expiries.append(_check_window(confirmation, now, skew))
+    expiries = [expires for expires in expiries if expires is not None]
+    if not expiries:
+        raise SAMLError('Assertion has no expiry')
+    # A remembered ID must outlive the assertion, or replay protection has a gap
+    if min(expiries) + skew > now + getattr(settings, 'SAML_REPLAY_TTL', 3600):
+        raise SAMLError('Assertion validity exceeds the replay window')
+    if not seen_assertions.add(f'{message.issuer}|{assertion_id}', True):
+        raise SAMLError('Assertion has already been used')
+
+    name_id = subject.find('saml:NameID', NS)
+    statement = assertion.find('saml:AuthnStatement', NS)
+    attributes = {}
+    for attribute in assertion.findall('saml:AttributeStatement/saml:Attribute', NS):
+        attributes[attribute.get('Name')] = [
+            text_of(value) for value in attribute.findall('saml:AttributeValue', NS)
+        ]
+    return Assertion(
+        assertion_id, message.issuer, text_of(name_id),
+        name_id.get('Format', '') if name_id is not None else '',
+        statement.get('SessionIndex', '') if statement is not None else '',
+        attributes,
+    )
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from auth_saml.metadata import refresh_all
+
+
+class Command(BaseCommand):
+    help = 'Refresh SAML service providers from their metadata URLs (conditional GET, streaming parse)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', action='append', dest='urls',
+            help='Only refresh providers using this metadata URL (may be repeated)',
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Ignore stored ETag/Last-Modified and download every document',
+        )
+
+    def handle(self, *args, **options):
+        results = refresh_all(urls=options['urls'], force=options['force'])
+        changed = 0
+        for url, result in results.items():
+            if result['status'] == 'error':
+                self.stderr.write(f"{url}: {result['error']}")
+                continue
+            changed += result['changed']
+            self.stdout.write(
+                f"{url}: {result['status']}, {result['changed']} changed, {result['missing']} missing"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Refreshed {len(results)} metadata documents, {changed} service providers changed'
+        ))
@@ -0,0 +1,102 @@
+import secrets
+import time
+from urllib.parse import quote_plus
+
+from cryptography.hazmat.primitives import serialization
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from auth_core.models import SAMLServiceProvider
+from auth_saml.bindings import encode_post, encode_redirect
+from auth_saml.dsig import RSA_SHA256, SigningKey
+from auth_saml.engine import build_response, consume_response, parse_authn_request, receive_message
+from auth_saml.registry import RegisteredServiceProvider, TrustedIdentityProvider
+
+
+AUTHN_REQUEST = (
+    '<samlp:AuthnRequest xmlns:samlp="urn:oasis:names:tc:SAML:2.0:protocol" '
+    'xmlns:saml="urn:oasis:names:tc:SAML:2.0:assertion" ID="{id}" Version="2.0" '
+    'IssueInstant="{now}" AssertionConsumerServiceURL="{acs_url}">'
+    '<saml:Issuer>{issuer}</saml:Issuer>'
+    '<samlp:NameIDPolicy Format="urn:oasis:names:tc:SAML:1.1:nameid-format:emailAddress"/>'
+    '</samlp:AuthnRequest>'
+)
+
+
+def _entity(entity_id, acs_url, key):
+    certificate = key.certificate.public_bytes(serialization.Encoding.PEM).decode()
+    return RegisteredServiceProvider(
+        SAMLServiceProvider(entity_id=entity_id, acs_url=acs_url, certificate=certificate)
+    )
+
+
+class Command(BaseCommand):
+    help = 'Measure SAML SSO and ACS throughput on a single core with in-memory keys and entities'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=1000, help='Messages per stage')
+
+    def _run(self, name, iterations, operation):
+        timings = []
+        for i in range(iterations):
+            start = time.perf_counter()
+            operation(i)
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        total = sum(timings)
+        self.stdout.write(
+            f'{name:<16} {iterations / total:>9.0f} ops/s  '
+            f'mean {total / iterations * 1e6:>8.0f} us  '
+            f'p99 {timings[int(iterations * 0.99) - 1] * 1e6:>8.0f} us'
+        )
+        return total / iterations
+
+    def handle(self, *args, **options):
+        iterations = max(options['iterations'], 1)
+        idp_key = SigningKey.generate('benchmark IdP')
+        sp_key = SigningKey.generate('benchmark SP')
+        sp = _entity('https://sp.bench/metadata', 'https://sp.bench/acs', sp_key)
+        idp = TrustedIdentityProvider('https://idp.bench/metadata', idp_key.certificate)
+        entities = {sp.entity_id: sp, idp.entity_id: idp}
+        user = User(username='bench', email='bench@example.com', first_name='Bench', last_name='User')
+
+        # SP-initiated AuthnRequests over HTTP-Redirect with a detached signature
+        queries = []
+        for _ in range(iterations):
+            xml = AUTHN_REQUEST.format(
+                id=f'_{secrets.token_hex(16)}', now=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), acs_url=sp.acs_url, issuer=sp.entity_id
+            ).encode()
+            encoded = encode_redirect(xml)
+            signed = f'SAMLRequest={quote_plus(encoded)}&RelayState=bench&SigAlg={quote_plus(RSA_SHA256)}'
+            signature = encode_post(sp_key.sign(signed.encode()))
+            queries.append((encoded, f'{signed}&Signature={quote_plus(signature)}'))
+
+        requests = []
+
+        def parse_request(i):
+            encoded, query = queries[i]
+            message = receive_message('SAMLRequest', encoded, True, query, 'bench', entities.get)
+            requests.append(parse_authn_request(message))
+
+        responses = []
+
+        def sign_response(i):
+            responses.append(build_response(
+                requests[i].sp, user, idp.entity_id, in_response_to=requests[i].id,
+                name_id_format=requests[i].name_id_format, key=idp_key,
+            ))
+
+        encoded_responses = [None] * iterations
+
+        def consume(i):
+            message = receive_message('SAMLResponse', encoded_responses[i], False, lookup=entities.get)
+            consume_response(message, sp.entity_id, sp.acs_url)
+
+        self.stdout.write(f'{iterations} messages per stage, single thread (one core)')
+        request_time = self._run('authn_request', iterations, parse_request)
+        response_time = self._run('signed_response', iterations, sign_response)
+        encoded_responses[:] = [encode_post(response) for response in responses]
+        self._run('acs_consume', iterations, consume)
+        self.stdout.write(self.style.SUCCESS(
+            f'IdP logins per second per core: {1 / (request_time + response_time):.0f}'
+        ))
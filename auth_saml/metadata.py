@@ -0,0 +1,265 @@
+"""
+Background refresh of service-provider settings from SAML metadata.
+
+Every active SAMLServiceProvider with a metadata_url is refreshed from that
+URL; providers sharing a URL (a federation aggregate) share one download.
+Downloads use conditional GET, and the body is streamed through an
+incremental parser that discards each EntityDescriptor once it has been
+read, so aggregates of any size are processed in bounded memory. Rows are
+only written when the hash of the settings we take from the metadata
+changes. Refreshes run from a management command or a background thread,
+never on the request path.
+"""
+import hashlib
+import logging
+import textwrap
+import threading
+from collections import defaultdict
+
+import requests
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from lxml import etree
+
+from auth_saml.bindings import POST, REDIRECT
+from auth_saml.parsing import NS, SAMLError
+from auth_saml.registry import load_certificate
+
+
+logger = logging.getLogger(__name__)
+
+MD = 'urn:oasis:names:tc:SAML:2.0:metadata'
+HTTP_TIMEOUT = 30
+CHUNK_SIZE = 64 * 1024
+
+
+class EntityMetadata:
+    """The settings we take from one SP EntityDescriptor."""
+
+    __slots__ = ('entity_id', 'acs_url', 'slo_url', 'certificate')
+
+    def __init__(self, entity_id, acs_url, slo_url, certificate):
+        self.entity_id = entity_id
+        self.acs_url = acs_url
+        self.slo_url = slo_url
+        self.certificate = certificate
+
+    @property
+    def content_hash(self):
+        content = '\n'.join((self.acs_url, self.slo_url, self.certificate))
+        return hashlib.sha256(content.encode()).hexdigest()
+
+
+def _pem(body):
+    body = ''.join(body.split())
+    return '-----BEGIN CERTIFICATE-----\n' + '\n'.join(textwrap.wrap(body, 64)) + '\n-----END CERTIFICATE-----\n'
+
+
+def _acs_url(descriptor):
+    services = [
+        service for service in descriptor.iterfind(f'{{{MD}}}AssertionConsumerService')
+        if service.get('Binding') == POST and service.get('Location')
+    ]
+    if not services:
+        return ''
+    default = next((s for s in services if s.get('isDefault') == 'true'), None)
+    if default is None:
+        default = min(services, key=lambda s: int(s.get('index', '0')) if s.get('index', '0').isdigit() else 0)
+    return default.get('Location')
+
+
+def _slo_url(descriptor):
+    # Our LogoutResponses are delivered by HTTP-POST, so prefer that binding
+    for binding in (POST, REDIRECT):
+        for service in descriptor.iterfind(f'{{{MD}}}SingleLogoutService'):
+            if service.get('Binding') == binding and service.get('Location'):
+                return service.get('ResponseLocation') or service.get('Location')
+    return ''
+
+
+def _signing_certificate(descriptor):
+    for key_descriptor in descriptor.iterfind(f'{{{MD}}}KeyDescriptor'):
+        if key_descriptor.get('use', 'signing') != 'signing':
+            continue
+        body = key_descriptor.findtext('ds:KeyInfo/ds:X509Data/ds:X509Certificate', namespaces=NS)
+        if body and body.strip():
+            return _pem(body)
+    return ''
+
+
+def extract_entity(entity):
+    """EntityMetadata for an EntityDescriptor element, or None if it has no usable SP role."""
+    descriptor = entity.find(f'{{{MD}}}SPSSODescriptor')
+    if descriptor is None:
+        return None
+    acs_url = _acs_url(descriptor)
+    if not acs_url:
+        return None
+    certificate = _signing_certificate(descriptor)
+    if certificate:
+        try:
+            load_certificate(certificate)
+        except ValueError:
+            logger.warning('Ignoring unparseable certificate in metadata for %s', entity.get('entityID'))
+            certificate = ''
+    return EntityMetadata(entity.get('entityID', ''), acs_url, _slo_url(descriptor), certificate)
+
+
+def iter_entities(chunks, wanted=None, max_size=None):
+    """
+    Incrementally parse a metadata document fed as byte chunks and yield
+    EntityMetadata for SP entities (only those in wanted, if given).
+    """
+    max_size = max_size or getattr(settings, 'SAML_METADATA_MAX_SIZE', 100 * 1024 * 1024)
+    parser = etree.XMLPullParser(
+        events=('end',),
+        tag=f'{{{MD}}}EntityDescriptor',
+        resolve_entities=False,
+        no_network=True,
+        load_dtd=False,
+        remove_comments=True,
+        remove_pis=True,
+    )
+    size = 0
+    previous_tail = b''
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+            if size > max_size:
+                raise SAMLError('Metadata document too large')
+            if b'<!DOCTYPE' in previous_tail + chunk:
+                raise SAMLError('DTDs are not allowed')
+            previous_tail = chunk[-8:]
+            parser.feed(chunk)
+            for _, entity in parser.read_events():
+                entity_id = entity.get('entityID')
+                if wanted is None or entity_id in wanted:
+                    metadata = extract_entity(entity)
+                    if metadata is not None:
+                        yield metadata
+                # Free the entity and every sibling before it
+                entity.clear(keep_tail=False)
+                parent = entity.getparent()
+                if parent is not None:
+                    while entity.getprevious() is not None:
+                        del parent[0]
+        parser.close()
+    except etree.XMLSyntaxError as e:
+        raise SAMLError(f'Malformed metadata: {e}')
+
+
+def refresh_url(url, providers, session, force=False):
+    """Refresh the providers whose metadata lives at url; return a result dict."""
+    if not url.startswith('https://') and not getattr(settings, 'SAML_METADATA_ALLOW_HTTP', False):
+        raise SAMLError('Metadata URLs must use https')
+    from auth_core.models import SAMLServiceProvider
+
+    headers = {'Accept': 'application/samlmetadata+xml, application/xml'}
+    # A 304 only holds for providers already filled from the copy these validators describe
+    validators = {(sp.metadata_etag, sp.metadata_last_modified) for sp in providers}
+    filled = all(sp.metadata_refreshed_at is not None for sp in providers)
+    if not force and filled and len(validators) == 1:
+        known_etag, known_last_modified = validators.pop()
+        if known_etag:
+            headers['If-None-Match'] = known_etag
+        if known_last_modified:
+            headers['If-Modified-Since'] = known_last_modified
+
+    wanted = {sp.entity_id: sp for sp in providers}
+    with session.get(url, headers=headers, stream=True, timeout=HTTP_TIMEOUT) as response:
+        if response.status_code == 304:
+            return {'status': 'not_modified', 'changed': 0, 'missing': 0}
+        response.raise_for_status()
+        found = {
+            entity.entity_id: entity
+            for entity in iter_entities(response.iter_content(CHUNK_SIZE), wanted)
+        }
+        etag = response.headers.get('ETag', '')[:255]
+        last_modified = response.headers.get('Last-Modified', '')[:64]
+
+    now = timezone.now()
+    changed = 0
+    for entity_id, entity in found.items():
+        sp = wanted[entity_id]
+        content_hash = entity.content_hash
+        if content_hash == sp.metadata_hash:
+            continue
+        sp.acs_url = entity.acs_url
+        sp.slo_url = entity.slo_url
+        sp.certificate = entity.certificate
+        sp.metadata_hash = content_hash
+        sp.metadata_etag = etag
+        sp.metadata_last_modified = last_modified
+        sp.metadata_refreshed_at = now
+        # save() rather than update() so the SP registry and metadata are refreshed
+        sp.save(update_fields=[
+            'acs_url', 'slo_url', 'certificate', 'metadata_hash',
+            'metadata_etag', 'metadata_last_modified', 'metadata_refreshed_at',
+        ])
+        changed += 1
+
+    # One statement records the new validators for the whole group
+    SAMLServiceProvider.objects.filter(pk__in=[sp.pk for sp in providers]).update(
+        metadata_etag=etag, metadata_last_modified=last_modified, metadata_refreshed_at=now
+    )
+    missing = set(wanted) - set(found)
+    if missing:
+        logger.warning('%d service providers not found in metadata at %s', len(missing), url)
+    return {'status': 'updated', 'changed': changed, 'missing': len(missing)}
+
+
+def refresh_all(urls=None, force=False):
+    """Refresh every active provider with a metadata URL; return results by URL."""
+    from auth_core.models import SAMLServiceProvider
+
+    groups = defaultdict(list)
+    for sp in SAMLServiceProvider.objects.filter(is_active=True).exclude(metadata_url='').order_by('pk'):
+        if urls is None or sp.metadata_url in urls:
+            groups[sp.metadata_url].append(sp)
+
+    results = {}
+    with requests.Session() as session:
+        for url, providers in groups.items():
+            try:
+                results[url] = refresh_url(url, providers, session, force=force)
+            except (requests.RequestException, SAMLError) as e:
+                logger.warning('Refreshing SAML metadata from %s failed: %s', url, e)
+                results[url] = {'status': 'error', 'error': str(e)}
+    return results
+
+
+_worker = None
+_worker_stop = threading.Event()
+
+
+def _periodic_loop(interval):
+    while not _worker_stop.is_set():
+        try:
+            refresh_all()
+        except Exception:
+            logger.exception('Periodic SAML metadata refresh failed')
+        finally:
+            close_old_connections()
+        _worker_stop.wait(interval)
+
+
+def start_metadata_refresher(interval=None):
+    """
+    Start the in-process refresher thread if SAML_METADATA_REFRESH_INTERVAL
+    is set. Safe to call more than once.
+    """
+    global _worker
+    interval = interval or getattr(settings, 'SAML_METADATA_REFRESH_INTERVAL', 0)
+    if not interval or (_worker and _worker.is_alive()):
+        return _worker
+    _worker_stop.clear()
+    _worker = threading.Thread(
+        target=_periodic_loop, args=(interval,), name='saml-metadata', daemon=True
+    )
+    _worker.start()
+    return _worker
+
+
+def stop_metadata_refresher():
+    _worker_stop.set()
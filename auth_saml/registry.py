@@ -0,0 +1,188 @@
+"""
+In-memory registries of active SAML service providers and of the identity
+providers our ACS trusts.
+
+Each SAMLServiceProvider row is turned into a RegisteredServiceProvider once,
+with its X.509 certificate and public key already parsed, and indexed by
+entity ID and primary key. The registry is updated incrementally by model
+signals; other processes notice changes through a version token in the
+shared Django cache and reload with a single query.
+
+Trusted identity providers come from SAML_TRUSTED_IDPS instead, so that
+registering a service provider never lets it sign assertions that log
+users in here.
+"""
+import base64
+import logging
+import threading
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.serialization import Encoding
+
+from auth_core.cache import bump_version, get_version
+
+
+logger = logging.getLogger(__name__)
+
+VERSION_NAMESPACE = 'saml_service_providers'
+
+
+def load_certificate(value):
+    """Parse a PEM certificate, or a bare base64 DER body as found in metadata."""
+    value = (value or '').strip()
+    if not value:
+        return None
+    if value.startswith('-----'):
+        return x509.load_pem_x509_certificate(value.encode('ascii'))
+    return x509.load_der_x509_certificate(base64.b64decode(''.join(value.split())))
+
+
+class RegisteredServiceProvider:
+    """Immutable, pre-parsed view of an active SAMLServiceProvider."""
+
+    __slots__ = (
+        'id', 'entity_id', 'acs_url', 'slo_url', 'metadata_url', 'created_at',
+        'certificate', 'public_key', 'certificate_body', 'fingerprint',
+    )
+
+    def __init__(self, sp):
+        self.id = sp.pk
+        self.entity_id = sp.entity_id
+        self.acs_url = sp.acs_url
+        self.slo_url = sp.slo_url
+        self.metadata_url = sp.metadata_url
+        self.created_at = sp.created_at
+        self.certificate = None
+        self.public_key = None
+        self.certificate_body = ''
+        self.fingerprint = ''
+        try:
+            certificate = load_certificate(sp.certificate)
+        except ValueError:
+            logger.warning('Ignoring unparseable certificate for SAML SP %s', sp.entity_id)
+            certificate = None
+        if certificate is not None:
+            der = certificate.public_bytes(Encoding.DER)
+            self.certificate = certificate
+            self.public_key = certificate.public_key()
+            self.certificate_body = base64.b64encode(der).decode('ascii')
+            self.fingerprint = certificate.fingerprint(hashes.SHA256()).hex()
+
+
+class ServiceProviderRegistry:
+
+    def __init__(self):
+        self._by_id = None
+        self._by_entity_id = None
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _publish(self, by_id, version):
+        # Readers only ever see complete dicts, swapped in together
+        self._by_entity_id = {sp.entity_id: sp for sp in by_id.values()}
+        self._by_id = by_id
+        self._version = version
+
+    def _ensure_loaded(self):
+        version = get_version(VERSION_NAMESPACE)
+        if self._by_id is None or version != self._version:
+            with self._lock:
+                if self._by_id is None or version != self._version:
+                    from auth_core.models import SAMLServiceProvider
+
+                    by_id = {
+                        sp.pk: RegisteredServiceProvider(sp)
+                        for sp in SAMLServiceProvider.objects.filter(is_active=True)
+                    }
+                    self._publish(by_id, version)
+
+    def get(self, entity_id):
+        """Return the RegisteredServiceProvider for entity_id, or None."""
+        self._ensure_loaded()
+        return self._by_entity_id.get(entity_id)
+
+    def get_by_id(self, sp_id):
+        self._ensure_loaded()
+        return self._by_id.get(sp_id)
+
+    def all(self):
+        """Active service providers in creation order."""
+        self._ensure_loaded()
+        return sorted(self._by_id.values(), key=lambda sp: sp.id)
+
+    def update(self, sp):
+        """Apply a saved SAMLServiceProvider locally and invalidate other processes."""
+        with self._lock:
+            version = bump_version(VERSION_NAMESPACE)
+            if self._by_id is None:
+                self._version = version
+                return
+            by_id = dict(self._by_id)
+            if sp.is_active:
+                by_id[sp.pk] = RegisteredServiceProvider(sp)
+            else:
+                by_id.pop(sp.pk, None)
+            self._publish(by_id, version)
+
+    def remove(self, sp_id):
+        with self._lock:
+            version = bump_version(VERSION_NAMESPACE)
+            if self._by_id is None:
+                self._version = version
+                return
+            by_id = dict(self._by_id)
+            by_id.pop(sp_id, None)
+            self._publish(by_id, version)
+
+    def clear(self):
+        with self._lock:
+            self._by_id = None
+            self._by_entity_id = None
+            self._version = None
+
+
+sp_registry = ServiceProviderRegistry()
+
+
+class TrustedIdentityProvider:
+    """An identity provider from SAML_TRUSTED_IDPS, with its certificate parsed."""
+
+    __slots__ = ('entity_id', 'certificate', 'public_key')
+
+    def __init__(self, entity_id, certificate):
+        self.entity_id = entity_id
+        self.certificate = certificate
+        self.public_key = certificate.public_key()
+
+
+class IdentityProviderRegistry:
+    """Trusted identity providers by issuer, loaded from settings on first use."""
+
+    def __init__(self):
+        self._by_entity_id = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        from django.conf import settings
+
+        by_entity_id = {}
+        for entity_id, certificate_file in getattr(settings, 'SAML_TRUSTED_IDPS', {}).items():
+            with open(certificate_file) as f:
+                by_entity_id[entity_id] = TrustedIdentityProvider(entity_id, load_certificate(f.read()))
+        return by_entity_id
+
+    def get(self, entity_id):
+        """Return the TrustedIdentityProvider issuing as entity_id, or None."""
+        if self._by_entity_id is None:
+            with self._lock:
+                if self._by_entity_id is None:
+                    self._by_entity_id = self._load()
+        return self._by_entity_id.get(entity_id)
+
+    def clear(self):
+        with self._lock:
+            self._by_entity_id = None
+
+
+idp_registry = IdentityProviderRegistry()
@@ -0,0 +1,25 @@
+from django.core.signals import setting_changed
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from auth_core.models import SAMLServiceProvider
+from auth_core.publication import invalidate
+from auth_saml.registry import idp_registry, sp_registry
+
+
+@receiver(post_save, sender=SAMLServiceProvider)
+def update_sp_registry(sender, instance, **kwargs):
+    sp_registry.update(instance)
+    invalidate(f'saml_sp_metadata:{instance.pk}')
+
+
+@receiver(post_delete, sender=SAMLServiceProvider)
+def remove_from_sp_registry(sender, instance, **kwargs):
+    sp_registry.remove(instance.pk)
+    invalidate(f'saml_sp_metadata:{instance.pk}')
+
+
+@receiver(setting_changed)
+def reload_idp_registry(setting, **kwargs):
+    if setting == 'SAML_TRUSTED_IDPS':
+        idp_registry.clear()
@@ -1,3 +1,158 @@
-from django.test import TestCase
+import base64
+import tempfile
+from contextlib import nullcontext
+from types import SimpleNamespace
 
-# Create your tests here.
+from cryptography.hazmat.primitives.serialization import Encoding
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from auth_core.cache import CacheTTLStore
+from auth_core.models import SAMLServiceProvider
+from auth_saml.dsig import SigningKey
+from auth_saml.engine import build_response, seen_assertions
+from auth_saml.metadata import refresh_url
+
+
+ACS_URL = 'http://testserver/api/auth/saml/acs/'
+AUDIENCE = 'http://testserver/saml/metadata'
+IDP_ENTITY_ID = 'https://idp.example.org/saml'
+
+
+def _post_logout_request(client, key, issuer, name_id):
+    head = (
+        '<samlp:LogoutRequest xmlns:samlp="urn:oasis:names:tc:SAML:2.0:protocol" ID="_logout" '
+        'IssueInstant="2026-01-01T00:00:00Z" Version="2.0">'
+        f'<saml:Issuer xmlns:saml="urn:oasis:names:tc:SAML:2.0:assertion">{issuer}</saml:Issuer>'
+    ).encode()
+    body = (
+        f'<saml:NameID xmlns:saml="urn:oasis:names:tc:SAML:2.0:assertion">{name_id}</saml:NameID>'
+        '</samlp:LogoutRequest>'
+    ).encode()
+    xml = key.sign_enveloped(head, body, '_logout') if key else head + body
+    return client.post('/api/auth/saml/slo/', {'SAMLRequest': base64.b64encode(xml).decode('ascii')})
+
+
+def _post_response(client, key, issuer, name_id_user, xml=None):
+    # build_response() only needs the recipient's ACS URL and entity ID
+    recipient = SimpleNamespace(acs_url=ACS_URL, entity_id=AUDIENCE)
+    xml = xml or build_response(recipient, name_id_user, issuer, key=key)
+    return client.post('/api/auth/saml/acs/', {'SAMLResponse': base64.b64encode(xml).decode('ascii')})
+
+
+class AssertionConsumerServiceTests(TestCase):
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'unused-password')
+        self.sp_key = SigningKey.generate('service provider')
+        self.sp = SAMLServiceProvider.objects.create(
+            entity_id='https://sp.example.org',
+            acs_url='https://sp.example.org/acs',
+            certificate=self.sp_key.certificate.public_bytes(Encoding.PEM).decode('ascii'),
+        )
+        self.idp_key = SigningKey.generate('identity provider')
+        certificate_file = tempfile.NamedTemporaryFile(suffix='.crt')
+        self.addCleanup(certificate_file.close)
+        certificate_file.write(self.idp_key.certificate.public_bytes(Encoding.PEM))
+        certificate_file.flush()
+        trusted = override_settings(SAML_TRUSTED_IDPS={IDP_ENTITY_ID: certificate_file.name})
+        trusted.enable()
+        self.addCleanup(trusted.disable)
+
+    def test_rejects_assertion_signed_by_service_provider(self):
+        response = _post_response(self.client, self.sp_key, self.sp.entity_id, self.admin)
+        self.assertEqual(response.status_code, 401)
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+    def test_rejects_service_provider_key_under_trusted_issuer(self):
+        response = _post_response(self.client, self.sp_key, IDP_ENTITY_ID, self.admin)
+        self.assertEqual(response.status_code, 401)
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+    def test_accepts_trusted_identity_provider(self):
+        response = _post_response(self.client, self.idp_key, IDP_ENTITY_ID, self.admin)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.session['_auth_user_id'], str(self.admin.pk))
+
+    def test_rejects_replayed_assertion(self):
+        recipient = SimpleNamespace(acs_url=ACS_URL, entity_id=AUDIENCE)
+        xml = build_response(recipient, self.admin, IDP_ENTITY_ID, key=self.idp_key)
+        self.assertEqual(_post_response(self.client, None, None, None, xml=xml).status_code, 200)
+        self.assertIsInstance(seen_assertions, CacheTTLStore)
+        self.client.logout()
+        self.assertEqual(_post_response(self.client, None, None, None, xml=xml).status_code, 401)
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+
+class SingleLogoutTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'unused-password')
+        self.sp_key = SigningKey.generate('service provider')
+        self.sp = SAMLServiceProvider.objects.create(
+            entity_id='https://sp.example.org',
+            acs_url='https://sp.example.org/acs',
+            certificate=self.sp_key.certificate.public_bytes(Encoding.PEM).decode('ascii'),
+        )
+        self.client.force_login(self.user)
+
+    def test_rejects_unsigned_logout_request(self):
+        response = _post_logout_request(self.client, None, self.sp.entity_id, 'alice')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('_auth_user_id', self.client.session)
+
+    def test_keeps_session_of_another_user(self):
+        response = _post_logout_request(self.client, self.sp_key, self.sp.entity_id, 'bob')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('_auth_user_id', self.client.session)
+
+    def test_logs_out_named_user(self):
+        response = _post_logout_request(self.client, self.sp_key, self.sp.entity_id, 'alice')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('_auth_user_id', self.client.session)
+
+
+class RecordingSession:
+    """Stands in for requests.Session; answers every GET with 304 and keeps the headers."""
+
+    def __init__(self):
+        self.headers = []
+
+    def get(self, url, headers, **kwargs):
+        self.headers.append(headers)
+        return nullcontext(SimpleNamespace(status_code=304))
+
+
+class MetadataRefreshTests(TestCase):
+
+    URL = 'https://federation.example.org/metadata.xml'
+
+    def provider(self, name, **validators):
+        return SAMLServiceProvider.objects.create(
+            entity_id=f'https://{name}.example.org', acs_url=f'https://{name}.example.org/acs',
+            metadata_url=self.URL, **validators,
+        )
+
+    def refresh(self, *providers):
+        session = RecordingSession()
+        refresh_url(self.URL, list(providers), session)
+        return session.headers[0]
+
+    def test_conditional_get_when_the_group_shares_validators(self):
+        filled = {'metadata_etag': '"v1"', 'metadata_refreshed_at': timezone.now()}
+        headers = self.refresh(self.provider('one', **filled), self.provider('two', **filled))
+        self.assertEqual(headers['If-None-Match'], '"v1"')
+
+    def test_full_get_when_a_provider_was_never_filled(self):
+        filled = self.provider('one', metadata_etag='"v1"', metadata_refreshed_at=timezone.now())
+        headers = self.refresh(filled, self.provider('new'))
+        self.assertNotIn('If-None-Match', headers)
+
+    def test_full_get_when_validators_differ(self):
+        now = timezone.now()
+        headers = self.refresh(
+            self.provider('one', metadata_etag='"v1"', metadata_refreshed_at=now),
+            self.provider('two', metadata_etag='"v2"', metadata_refreshed_at=now),
+        )
+        self.assertNotIn('If-None-Match', headers)
@@ -7,4 +7,5 @@ urlpatterns = [
     path('acs/', views.saml_acs, name='saml_acs'),
     path('slo/', views.saml_slo, name='saml_slo'),
     path('sp/list/', views.saml_sp_list, name='saml_sp_list'),
+    path('sp/<int:sp_id>/metadata/', views.saml_sp_metadata, name='saml_sp_metadata'),
 ]
@@ -2,111 +2,232 @@ from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
-from auth_core.models import SAMLServiceProvider
+from django.conf import settings
+from django.contrib.auth import login, logout
+from django.contrib.auth.models import User
+from django.http import Http404, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_http_methods
+from xml.sax.saxutils import escape, quoteattr
+from auth_core.audit import log_authentication
+from auth_core.publication import publish
+from auth_core.querybudget import query_budget
+from auth_saml.bindings import post_form
+from auth_saml.dsig import signing_certificate_body
+from auth_saml.engine import (
+    NAMEID_EMAIL, build_logout_response, build_response, consume_response, idp_entity_id,
+    parse_authn_request, parse_logout_request, receive,
+)
+from auth_saml.parsing import SAMLError
+from auth_saml.registry import idp_registry, sp_registry
+import hashlib
 
 
-@api_view(['GET'])
-@permission_classes([AllowAny])
-def saml_metadata(request):
-    """
-    SAML Identity Provider metadata endpoint.
-    Returns the SAML IdP metadata XML.
-    """
-    base_url = request.build_absolute_uri('/')[:-1]
-    
-    metadata_xml = f"""<?xml version="1.0"?>
+def _key_descriptor(certificate_body):
+    if not certificate_body:
+        return ''
+    return f"""
+        <KeyDescriptor use="signing">
+            <ds:KeyInfo xmlns:ds="http://www.w3.org/2000/09/xmldsig#">
+                <ds:X509Data><ds:X509Certificate>{escape(certificate_body)}</ds:X509Certificate></ds:X509Data>
+            </ds:KeyInfo>
+        </KeyDescriptor>"""
+
+
+def _render_idp_metadata(base_url):
+    want_signed = 'true' if getattr(settings, 'SAML_WANT_REQUESTS_SIGNED', False) else 'false'
+    return f"""<?xml version="1.0"?>
 <EntityDescriptor xmlns="urn:oasis:names:tc:SAML:2.0:metadata"
-                  entityID="{base_url}/saml/metadata">
-    <IDPSSODescriptor protocolSupportEnumeration="urn:oasis:names:tc:SAML:2.0:protocol">
+                  entityID={quoteattr(idp_entity_id(base_url))}>
+    <IDPSSODescriptor protocolSupportEnumeration="urn:oasis:names:tc:SAML:2.0:protocol"
+                      WantAuthnRequestsSigned="{want_signed}">{_key_descriptor(signing_certificate_body())}
+        <SingleLogoutService Binding="urn:oasis:names:tc:SAML:2.0:bindings:HTTP-POST"
+                           Location="{base_url}/api/auth/saml/slo/"/>
+        <SingleLogoutService Binding="urn:oasis:names:tc:SAML:2.0:bindings:HTTP-Redirect"
+                           Location="{base_url}/api/auth/saml/slo/"/>
         <SingleSignOnService Binding="urn:oasis:names:tc:SAML:2.0:bindings:HTTP-POST"
                            Location="{base_url}/api/auth/saml/sso/"/>
         <SingleSignOnService Binding="urn:oasis:names:tc:SAML:2.0:bindings:HTTP-Redirect"
                            Location="{base_url}/api/auth/saml/sso/"/>
-        <SingleLogoutService Binding="urn:oasis:names:tc:SAML:2.0:bindings:HTTP-Redirect"
-                           Location="{base_url}/api/auth/saml/slo/"/>
     </IDPSSODescriptor>
-</EntityDescriptor>"""
-    
-    return Response(metadata_xml, content_type='application/xml')
+</EntityDescriptor>""".encode()
 
 
-@api_view(['POST', 'GET'])
-@permission_classes([AllowAny])
+def _render_sp_metadata(sp):
+    key_descriptor = _key_descriptor(sp.certificate_body)
+    slo_service = ''
+    if sp.slo_url:
+        slo_service = f"""
+        <SingleLogoutService Binding="urn:oasis:names:tc:SAML:2.0:bindings:HTTP-Redirect"
+                             Location={quoteattr(sp.slo_url)}/>"""
+    return f"""<?xml version="1.0"?>
+<EntityDescriptor xmlns="urn:oasis:names:tc:SAML:2.0:metadata"
+                  entityID={quoteattr(sp.entity_id)}>
+    <SPSSODescriptor protocolSupportEnumeration="urn:oasis:names:tc:SAML:2.0:protocol">{key_descriptor}{slo_service}
+        <AssertionConsumerService Binding="urn:oasis:names:tc:SAML:2.0:bindings:HTTP-POST"
+                                  Location={quoteattr(sp.acs_url)} index="0"/>
+    </SPSSODescriptor>
+</EntityDescriptor>""".encode()
+
+
+@require_GET
+def saml_metadata(request):
+    """
+    SAML Identity Provider metadata endpoint.
+    Returns the SAML IdP metadata XML (pre-rendered per host, ETag-cached).
+    """
+    return publish(request, 'saml_idp_metadata', _render_idp_metadata, 'application/xml')
+
+
+@require_GET
+def saml_sp_metadata(request, sp_id):
+    """
+    Metadata of a registered SAML Service Provider, as known to this IdP.
+    """
+    def render(base_url):
+        sp = sp_registry.get_by_id(sp_id)
+        if sp is None:
+            raise Http404('Unknown service provider')
+        return _render_sp_metadata(sp)
+
+    return publish(request, f'saml_sp_metadata:{sp_id}', render, 'application/xml')
+
+
+def _log(request, user, success, details):
+    log_authentication(request, 'saml', success, user=user, details=details)
+
+
+def _session_index(request):
+    if not request.session.session_key:
+        request.session.save()
+    return '_' + hashlib.sha256(request.session.session_key.encode()).hexdigest()[:32]
+
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
 def saml_sso(request):
     """
-    SAML Single Sign-On endpoint.
-    Handles SAML authentication requests from Service Providers.
+    SAML Single Sign-On endpoint (IdP role).
+    Accepts an AuthnRequest via HTTP-Redirect or HTTP-POST from a registered
+    Service Provider and posts a signed Response to its ACS for the logged-in user.
     """
-    # In production, parse and validate SAMLRequest
-    saml_request = request.POST.get('SAMLRequest') or request.GET.get('SAMLRequest')
-    relay_state = request.POST.get('RelayState') or request.GET.get('RelayState')
+    try:
+        authn_request = parse_authn_request(receive(request, 'SAMLRequest'))
+    except SAMLError as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
-    if not saml_request:
-        return Response(
-            {'error': 'SAMLRequest parameter is required'},
-            status=status.HTTP_400_BAD_REQUEST
+    if not request.user.is_authenticated:
+        return JsonResponse(
+            {'error': 'Authentication required', 'service_provider': authn_request.sp.entity_id},
+            status=status.HTTP_401_UNAUTHORIZED
         )
     
-    return Response({
-        'message': 'SAML SSO request received',
-        'note': 'In production, this would authenticate the user and return a SAML response',
-        'relay_state': relay_state,
-        'implementation': 'Use python3-saml library for full SAML support'
-    })
+    base_url = request.build_absolute_uri('/')[:-1]
+    saml_response = build_response(
+        authn_request.sp, request.user, idp_entity_id(base_url),
+        in_response_to=authn_request.id,
+        session_index=_session_index(request),
+        name_id_format=authn_request.name_id_format,
+    )
+    _log(request, request.user, True, {'service_provider': authn_request.sp.entity_id})
+    return post_form(authn_request.acs_url, 'SAMLResponse', saml_response, authn_request.relay_state)
 
 
-@api_view(['POST', 'GET'])
-@permission_classes([AllowAny])
+def _user_for_assertion(assertion):
+    if assertion.name_id_format == NAMEID_EMAIL or '@' in assertion.name_id:
+        return User.objects.filter(email__iexact=assertion.name_id).first()
+    return User.objects.filter(username=assertion.name_id).first()
+
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
 def saml_acs(request):
     """
     SAML Assertion Consumer Service endpoint.
     Receives SAML responses from Identity Providers (when acting as SP).
+    The issuer must be in SAML_TRUSTED_IDPS and its certificate must have
+    signed the assertion; registered service providers are not trusted here.
     """
-    saml_response = request.POST.get('SAMLResponse') or request.GET.get('SAMLResponse')
-    relay_state = request.POST.get('RelayState') or request.GET.get('RelayState')
+    base_url = request.build_absolute_uri('/')[:-1]
+    audience = settings.SAML_CONFIG.get('entityId') or idp_entity_id(base_url)
+    acs_url = settings.SAML_CONFIG['assertionConsumerService'].get('url') or request.build_absolute_uri(request.path)
+    try:
+        message = receive(request, 'SAMLResponse', lookup=idp_registry.get)
+        assertion = consume_response(message, audience, acs_url)
+    except SAMLError as e:
+        _log(request, None, False, {'error': str(e)})
+        return JsonResponse({'error': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
     
-    if not saml_response:
-        return Response(
-            {'error': 'SAMLResponse parameter is required'},
-            status=status.HTTP_400_BAD_REQUEST
+    user = _user_for_assertion(assertion)
+    if user is None or not user.is_active:
+        _log(request, user, False, {'identity_provider': assertion.issuer, 'error': 'No active user'})
+        return JsonResponse(
+            {'error': 'No active account for this identity'},
+            status=status.HTTP_403_FORBIDDEN
         )
     
-    return Response({
-        'message': 'SAML response received',
-        'note': 'In production, this would validate the SAML response and authenticate the user',
-        'relay_state': relay_state
+    _log(request, user, True, {'identity_provider': assertion.issuer})
+    login(request, user, backend='auth_core.backends.CachedModelBackend')
+    
+    return JsonResponse({
+        'message': 'SAML login successful',
+        'relay_state': message.relay_state,
+        'user': {
+            'id': user.id,
+            'username': user.username,
+            'email': user.email,
+        }
     })
 
 
-@api_view(['POST', 'GET'])
-@permission_classes([AllowAny])
+def _is_session_of(request, logout_request):
+    """Whether logout_request names the logged-in user and, if given, this session."""
+    user = request.user
+    if logout_request.name_id not in {user.username, user.email} - {''}:
+        return False
+    return not logout_request.session_index or logout_request.session_index == _session_index(request)
+
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
 def saml_slo(request):
     """
     SAML Single Logout endpoint.
-    Handles SAML logout requests.
+    Ends the local session named by a signed LogoutRequest and answers the
+    Service Provider with a signed LogoutResponse (HTTP-POST to its SLO URL
+    when one is registered).
     """
-    logout_request = request.POST.get('LogoutRequest') or request.GET.get('LogoutRequest')
+    param = 'SAMLRequest' if 'SAMLRequest' in request.GET or 'SAMLRequest' in request.POST else 'LogoutRequest'
+    try:
+        logout_request = parse_logout_request(receive(request, param))
+    except SAMLError as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
-    if not logout_request:
-        return Response(
-            {'error': 'LogoutRequest parameter is required'},
-            status=status.HTTP_400_BAD_REQUEST
-        )
+    if request.user.is_authenticated:
+        if not _is_session_of(request, logout_request):
+            return JsonResponse(
+                {'error': 'LogoutRequest does not match this session'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        logout(request)
     
-    return Response({
-        'message': 'SAML logout request received',
-        'note': 'In production, this would process the logout and return a logout response'
-    })
+    sp = logout_request.sp
+    if not sp.slo_url:
+        return JsonResponse({'message': 'Logged out'})
+    base_url = request.build_absolute_uri('/')[:-1]
+    logout_response = build_logout_response(logout_request, idp_entity_id(base_url))
+    return post_form(sp.slo_url, 'SAMLResponse', logout_response, logout_request.relay_state)
 
 
+@query_budget(2)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def saml_sp_list(request):
     """
     List registered SAML Service Providers.
     """
-    service_providers = SAMLServiceProvider.objects.filter(is_active=True)
-    
+    service_providers = sp_registry.all()
+
     return Response({
         'service_providers': [
             {
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -55,6 +56,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'auth_core.middleware.RequestContextMiddleware',
+    'auth_core.middleware.MetricsMiddleware',
+    'auth_core.middleware.QueryBudgetMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -62,6 +66,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'auth_core.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'auth_service.urls'
@@ -141,9 +146,9 @@ CORS_ALLOW_CREDENTIALS = True
 # REST Framework Settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'auth_core.authentication.FirstPartyJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication',
+        'auth_core.authentication.ThrottledBasicAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -174,24 +179,112 @@ SESSION_COOKIE_HTTPONLY = True
 SESSION_COOKIE_SAMESITE = 'Lax'
 SESSION_COOKIE_AGE = 86400  # 24 hours
 
+# Client addresses and network restrictions (see auth_core.networks)
+TRUSTED_PROXIES = ['127.0.0.1', '::1']  # CIDRs whose X-Forwarded-For is believed; add load balancer subnets
+IP_BLOCKLIST_FILES = []  # files of CIDRs (one per line, '#'/';' comments) refused with 403 before any view
+IP_BLOCKLIST_RELOAD_INTERVAL = 60  # seconds between checks of the blocklist files for changes
+NETWORK_POLICY_CACHE_SIZE = 4096  # compiled per-key/per-route allow/deny lists kept per process
+USER_AGENT_CACHE_SIZE = 10000  # user agent ids kept per process for audit log writes
+
+# Metrics (see auth_core.metrics), scraped from /metrics
+METRICS_ENABLED = True
+METRICS_ALLOWED_NETWORKS = ['127.0.0.1', '::1']  # CIDRs allowed to scrape /metrics
+METRICS_DIR = None  # directory shared by all worker processes, e.g. '/dev/shm/auth-metrics'; None: this process only
+METRICS_FLUSH_INTERVAL = 5  # seconds between snapshots of each process's metrics into METRICS_DIR
+
+# Per-view database query budgets (see auth_core.querybudget)
+QUERY_BUDGET_ENABLED = True
+QUERY_BUDGET_DEFAULT = None  # budget of views without @query_budget; None for no limit
+QUERY_BUDGET_MAX_REPEATS = 3  # runs of one statement per request above which it is reported as N+1
+QUERY_BUDGET_RAISE = False  # raise QueryBudgetExceeded instead of logging; the pytest plugin sets it
+
+# Request profiling (see auth_core.profiling); the middleware unloads itself while disabled
+PROFILING_ENABLED = False
+PROFILING_SAMPLE_RATE = 0.0  # fraction of all requests to profile
+PROFILING_TOKEN_MAX_AGE = 900  # seconds an X-Profile token from `manage.py profiling_token` stays valid
+PROFILING_TARGETS_TTL = 10  # seconds before other processes see ProfilingTarget changes made in the admin
+PROFILING_DIR = BASE_DIR / 'profiles'
+PROFILING_MAX_PROFILES = 100  # profiles kept in PROFILING_DIR; the oldest are deleted
+PROFILING_MAX_CONCURRENT = 2  # profiles captured at once per process (1 from Python 3.12); other selected requests run unprofiled
+PROFILING_INTERVAL = 0.005  # seconds between stack samples
+
+# Failed-attempt throttling (see auth_core.throttling)
+# Tiers of (failures, window seconds) per dimension; reaching any tier answers 429
+# until the sliding window drops below it.
+THROTTLE_ENABLED = True
+THROTTLE_RULES = {
+    'username': [(5, 60), (20, 900), (100, 86400)],
+    'ip': [(30, 60), (300, 3600)],
+    'subnet': [(100, 60), (1000, 3600)],  # /24 for IPv4, /64 for IPv6
+    'api_key': [(10, 60), (100, 3600)],
+}
+THROTTLE_STORE = 'memory'  # 'memory' (count-min sketches per process) or 'cache' (shared Django cache)
+THROTTLE_SKETCH_WIDTH = 32768  # counters per sketch row; memory is 4 bytes x width x depth x 2 per window length
+THROTTLE_SKETCH_DEPTH = 4
+
 # Authentication Backends
 AUTHENTICATION_BACKENDS = [
-    'django.contrib.auth.backends.ModelBackend',
+    'auth_core.backends.CachedModelBackend',
 ]
 
-# OAuth2 Settings (placeholder - configure per provider)
+# Serving processes. Gunicorn reads WEB_CONCURRENCY for its default --workers;
+# per-process stores that must be shared are refused when this exceeds 1.
+WORKER_PROCESSES = int(os.environ.get('WEB_CONCURRENCY', 1))
+
+# User Resolution Cache
+# Session users are cached per process, keyed by user id and a version that
+# is bumped on every save, so steady-state requests skip the User query.
+# Versions live in the default cache (CACHES), which must be shared (e.g.
+# Redis) for a save in one worker to invalidate the others.
+USER_CACHE_MAX_SIZE = 10000
+USER_CACHE_TTL = 300  # seconds
+LOCAL_CACHE_MAX_TTL = 5  # seconds; caps USER_CACHE_TTL and USERINFO_CACHE_TTL while CACHES is process-local
+
+# Expired Credential Cleanup
+# Run with `python manage.py purge_expired`, or set CLEANUP_INTERVAL to run
+# the collector periodically inside each serving process.
+CLEANUP_INTERVAL = 0  # seconds between in-process runs; 0 disables
+CLEANUP_CHUNK_SIZE = 1000  # initial rows per DELETE, adapted to DB latency
+CLEANUP_DUTY_CYCLE = 0.5  # fraction of wall time spent deleting
+
+# OAuth2 Settings (configure per provider)
+# Providers with 'discovery_url' or 'jwks_uri' accept ID tokens, verified
+# locally against keys refreshed in the background. Providers with only a
+# 'userinfo_url' accept access tokens. Point these URLs at a local stand-in
+# provider for testing.
 OAUTH2_PROVIDERS = {
     'google': {
         'client_id': '',
         'client_secret': '',
         'redirect_uri': '',
+        'discovery_url': 'https://accounts.google.com/.well-known/openid-configuration',
+        'issuer': ['https://accounts.google.com', 'accounts.google.com'],
     },
     'github': {
         'client_id': '',
         'client_secret': '',
         'redirect_uri': '',
+        'userinfo_url': 'https://api.github.com/user',
+        'subject_claim': 'id',
     },
 }
+SOCIAL_KEYS_REFRESH_INTERVAL = 3600  # seconds between JWKS/discovery refreshes
+
+# OAuth 2.0 Authorization Codes
+OAUTH_CODE_TTL = 60  # seconds
+OAUTH_CODE_STORE = 'cache'  # 'cache' (shared Django cache) or 'memory' (single process only)
+
+# OAuth 2.0 Client Credentials
+OAUTH_CLIENT_TOKEN_LIFETIME = 300  # seconds
+OAUTH_CLIENT_TOKEN_REUSE = 0.5  # fraction of the lifetime during which an issued token is handed out again
+
+# OIDC UserInfo claim cache
+USERINFO_CACHE_MAX_SIZE = 10000
+USERINFO_CACHE_TTL = 300  # seconds
+
+# Published Metadata (OIDC discovery, JWKS, SAML metadata)
+PUBLISHED_DOCUMENTS_MAX_AGE = 3600  # Cache-Control max-age, seconds
+PUBLISHED_DOCUMENTS_MAX = 512  # rendered (document, host) combinations kept in memory
 
 # SAML Settings (placeholder)
 SAML_CONFIG = {
@@ -206,6 +299,29 @@ SAML_CONFIG = {
     },
 }
 
+# SAML IdP signing key (PEM files). Without them an ephemeral key is generated when DEBUG is on.
+SAML_IDP_ENTITY_ID = ''  # defaults to <base URL>/saml/metadata
+SAML_IDP_PRIVATE_KEY_FILE = ''
+SAML_IDP_CERTIFICATE_FILE = ''
+SAML_SIGN_RESPONSE = True  # sign the Response as well as the assertion
+SAML_WANT_REQUESTS_SIGNED = False  # reject unsigned AuthnRequests (LogoutRequests must always be signed)
+SAML_ALLOW_SHA1 = False  # accept legacy rsa-sha1 signatures and sha1 digests
+SAML_ASSERTION_LIFETIME = 300  # seconds
+SAML_CLOCK_SKEW = 120  # seconds tolerated between us and partners
+SAML_MAX_MESSAGE_SIZE = 256 * 1024  # bytes, after inflating
+SAML_REPLAY_TTL = 3600  # seconds assertion IDs are remembered; longer-lived assertions are rejected
+SAML_REPLAY_STORE = 'cache'  # 'cache' (shared Django cache) or 'memory' (single process only)
+
+# Identity providers whose Responses our ACS accepts: issuer entity ID -> PEM certificate file.
+# Registered service providers are never trusted as identity providers.
+SAML_TRUSTED_IDPS = {}
+
+# SAML SP metadata refresh from SAMLServiceProvider.metadata_url
+# Run with `python manage.py refresh_saml_metadata`, or in a background thread of each worker
+SAML_METADATA_REFRESH_INTERVAL = 3600  # seconds between in-process refreshes; 0 disables
+SAML_METADATA_MAX_SIZE = 100 * 1024 * 1024  # bytes per metadata document (aggregates included)
+SAML_METADATA_ALLOW_HTTP = False  # only for local testing; metadata carries trusted certificates
+
 # LDAP Settings (placeholder)
 LDAP_CONFIG = {
     'server_uri': '',
@@ -218,6 +334,44 @@ LDAP_CONFIG = {
 MFA_ENABLED = True
 MFA_ISSUER_NAME = 'Auth Service'
 
+# TOTP enrollment QR codes
+QR_RENDER_WORKERS = 2  # threads rendering QR codes
+QR_RENDER_QUEUE = 32  # renders queued or running before new ones get 503
+QR_RENDER_TIMEOUT = 5  # seconds
+QR_CACHE_MAX_SIZE = 10000  # rendered codes kept until the device is confirmed
+QR_CACHE_TTL = 3600  # seconds, upper bound for abandoned enrollments
+
+# Passwordless Settings
+MAGIC_LINK_MODE = 'signed'  # 'signed' (stateless, nothing stored at issuance) or 'table' (a MagicLink row per link)
+MAGIC_LINK_TTL = 900  # seconds
+MAGIC_LINK_USED_STORE = 'cache'  # redeemed signed links: 'cache' (shared Django cache) or 'memory' (single process only)
+
+# Outbound email/SMS delivery for passwordless codes and links
+# Messages are queued in the database and sent by worker threads in each
+# serving process; set DELIVERY_WORKERS = {} and run
+# `python manage.py deliver_messages` to deliver from dedicated processes instead.
+# Outside DEBUG, mail goes out over SMTP (EMAIL_HOST, EMAIL_PORT, ...) rather than to the console
+EMAIL_BACKEND = (
+    'django.core.mail.backends.console.EmailBackend' if DEBUG else 'django.core.mail.backends.smtp.EmailBackend'
+)
+DEFAULT_FROM_EMAIL = 'Auth Service <no-reply@localhost>'
+SMS_GATEWAY_URL = ''  # receives POST {"to", "body", "sender"} as JSON
+SMS_GATEWAY_TOKEN = ''  # sent as a bearer token
+SMS_GATEWAY_TIMEOUT = 10  # seconds
+SMS_SENDER = 'AuthService'
+DELIVERY_PROVIDERS = {
+    'email': 'auth_passwordless.providers.EmailProvider',
+    'sms': 'auth_passwordless.providers.SMSGatewayProvider',
+}
+DELIVERY_WORKERS = {'email': 2, 'sms': 1}  # threads per channel in each serving process
+DELIVERY_BATCH_SIZE = 50  # messages claimed per batch
+DELIVERY_RATE_LIMITS = {'email': 20, 'sms': 5}  # messages per second per process, 0 for no limit
+DELIVERY_MAX_ATTEMPTS = 5  # before a message is dead-lettered
+DELIVERY_RETRY_BASE = 5  # seconds before the first retry, doubling up to DELIVERY_RETRY_MAX
+DELIVERY_RETRY_MAX = 300
+DELIVERY_LEASE = 60  # seconds a claimed batch is reserved before another worker may take it over; renewed while rate limited
+DELIVERY_POLL_INTERVAL = 2  # seconds between polls when the queue is empty
+
 # API Key Settings
 API_KEY_HEADER = 'X-API-Key'
 
@@ -230,5 +384,10 @@ ROUTING_TARGETS = {
 # WebAuthn Settings
 WEBAUTHN_RP_ID = 'localhost'
 WEBAUTHN_RP_NAME = 'Auth Service'
-WEBAUTHN_ORIGIN = 'http://localhost:8000'
+WEBAUTHN_ORIGIN = 'http://localhost:8000'  # or a list of accepted origins
+WEBAUTHN_USER_VERIFICATION = 'preferred'  # 'required', 'preferred' or 'discouraged'
+WEBAUTHN_CHALLENGE_TTL = 300  # seconds a registration or login ceremony may take
+WEBAUTHN_CHALLENGE_STORE = 'cache'  # 'cache' (shared Django cache) or 'memory' (single process only)
+WEBAUTHN_VERIFIER_CACHE_MAX_SIZE = 10000  # decoded credential public keys kept in memory
+WEBAUTHN_VERIFIER_CACHE_TTL = 3600  # seconds
 
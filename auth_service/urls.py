@@ -18,12 +18,15 @@ from django.contrib import admin
 from django.urls import path, include
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
+from auth_core.querybudget import query_budget
+from auth_core.views import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     
     # JWT Token endpoints
-    path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
-    path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('api/token/', query_budget(2)(TokenObtainPairView.as_view()), name='token_obtain_pair'),
+    path('api/token/refresh/', query_budget(2)(TokenRefreshView.as_view()), name='token_refresh'),
     
     # Authentication app endpoints
     path('api/auth/session/', include('auth_session.urls')),
@@ -38,5 +41,8 @@ urlpatterns = [
     
     # Documentation endpoints
     path('api/docs/', include('docs.urls')),
+    
+    # Prometheus scrape endpoint
+    path('metrics', metrics_view, name='metrics'),
 ]
 
@@ -14,3 +14,16 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'auth_service.settings')
 
 application = get_wsgi_application()
+
+# Start background jobs only in serving processes, never in management commands
+from auth_core.cleanup import start_periodic_cleanup  # noqa: E402
+from auth_core.metrics import start_metrics_flusher  # noqa: E402
+from auth_oauth.providers import provider_refresher  # noqa: E402
+from auth_passwordless.delivery import start_delivery_workers  # noqa: E402
+from auth_saml.metadata import start_metadata_refresher  # noqa: E402
+
+start_periodic_cleanup()
+start_metrics_flusher()
+provider_refresher.start()
+start_metadata_refresher()
+start_delivery_workers()
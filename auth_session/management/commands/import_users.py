@@ -0,0 +1,146 @@
+import csv
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+
+
+TEXT_FIELDS = ('email', 'first_name', 'last_name')
+
+
+def _init_worker():
+    # Needed when the pool uses the spawn start method (macOS, Windows)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'auth_service.settings')
+    import django
+    django.setup()
+
+
+def _hash_passwords(passwords):
+    return [make_password(password) for password in passwords]
+
+
+def _parse_bool(value, default):
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Bulk import users from a CSV or NDJSON file. Columns/keys: username, email, '
+        'password or password_hash, first_name, last_name, is_active, is_staff'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Input file, or '-' for stdin")
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Users per INSERT')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Password hashing processes')
+        parser.add_argument(
+            '--skip-existing', action='store_true',
+            help='Ignore rows whose username or email already exists instead of failing the batch',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        batch_size = options['batch_size']
+        self.skip_existing = options['skip_existing']
+        self.workers = options['workers'] or 1
+        self.imported = 0
+        self.failed = 0
+
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            rows = self._read_rows(stream, fmt)
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker) as pool:
+                # Hash batch N+1 in the pool while batch N is being inserted
+                pending = None
+                for number, batch in enumerate(_batched(rows, batch_size), start=1):
+                    prepared = self._prepare(batch, pool)
+                    if pending:
+                        self._insert(*pending)
+                    pending = (number, prepared)
+                if pending:
+                    self._insert(*pending)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        verb = 'Processed' if self.skip_existing else 'Imported'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {self.imported} users ({self.failed} rows failed)'))
+
+    def _read_rows(self, stream, fmt):
+        if fmt == 'csv':
+            yield from csv.DictReader(stream)
+            return
+        for line_number, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                raise CommandError(f'Invalid JSON on line {line_number}')
+
+    def _prepare(self, rows, pool):
+        users = []
+        plaintext = []
+        for row in rows:
+            username = (row.get('username') or '').strip()
+            if not username:
+                self.failed += 1
+                self.stderr.write(f'Skipping row without username: {row!r}')
+                continue
+            user = User(
+                username=username,
+                is_active=_parse_bool(row.get('is_active'), True),
+                is_staff=_parse_bool(row.get('is_staff'), False),
+                **{field: (row.get(field) or '').strip() for field in TEXT_FIELDS},
+            )
+            if row.get('password_hash'):
+                user.password = row['password_hash']
+            elif row.get('password'):
+                plaintext.append((user, row['password']))
+            else:
+                user.set_unusable_password()
+            users.append(user)
+
+        chunk = max(1, len(plaintext) // self.workers + 1)
+        futures = [
+            (plaintext[i:i + chunk], pool.submit(_hash_passwords, [p for _, p in plaintext[i:i + chunk]]))
+            for i in range(0, len(plaintext), chunk)
+        ]
+        return users, futures
+
+    def _insert(self, number, prepared):
+        users, futures = prepared
+        for pairs, future in futures:
+            for (user, _), hashed in zip(pairs, future.result()):
+                user.password = hashed
+        try:
+            with transaction.atomic():
+                User.objects.bulk_create(users, ignore_conflicts=self.skip_existing)
+        except IntegrityError as e:
+            self.failed += len(users)
+            self.stderr.write(f'Batch {number} rejected ({len(users)} rows): {e}')
+            return
+        self.imported += len(users)
+        self.stdout.write(f'Batch {number}: {len(users)} users')
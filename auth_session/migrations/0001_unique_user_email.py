@@ -0,0 +1,52 @@
+from django.db import migrations, models
+from django.db.models import Count
+
+
+EMAIL_CONSTRAINT = models.UniqueConstraint(
+    fields=['email'],
+    condition=~models.Q(email=''),
+    name='auth_user_email_unique',
+)
+
+
+def check_duplicate_emails(apps, schema_editor):
+    """Refuse to continue, naming them, while several users share an email."""
+    User = apps.get_model('auth', 'User')
+    duplicates = list(
+        User.objects.exclude(email='').values('email').annotate(users=Count('pk')).filter(users__gt=1)
+        .order_by('email').values_list('email', 'users')
+    )
+    if duplicates:
+        listing = '\n'.join(f'  {email}: {users} users' for email, users in duplicates[:50])
+        more = f'\n  ... and {len(duplicates) - 50} more' if len(duplicates) > 50 else ''
+        raise RuntimeError(
+            'auth_user_email_unique cannot be created while users share an email. Give them distinct '
+            f'emails (or clear them) and run migrate again. Shared emails ({len(duplicates)}):\n{listing}{more}'
+        )
+
+
+def add_email_constraint(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    schema_editor.add_constraint(User, EMAIL_CONSTRAINT)
+
+
+def remove_email_constraint(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    schema_editor.remove_constraint(User, EMAIL_CONSTRAINT)
+
+
+class Migration(migrations.Migration):
+    """
+    Enforce unique non-empty emails on auth_user, so concurrent registrations
+    cannot both take an email. Existing duplicates stop the migration with a
+    list of them.
+    """
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_emails, migrations.RunPython.noop),
+        migrations.RunPython(add_email_constraint, remove_email_constraint),
+    ]
@@ -1,3 +1,52 @@
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError
 from django.test import TestCase
 
-# Create your tests here.
+from auth_session.views import _taken_field
+
+
+class _DriverError(Exception):
+    """Stand-in for a psycopg error, which reports the violated constraint in .diag."""
+
+    def __init__(self, constraint_name):
+        super().__init__(constraint_name)
+        self.diag = SimpleNamespace(constraint_name=constraint_name)
+
+
+class RegisterTests(TestCase):
+
+    def setUp(self):
+        User.objects.create_user('alice', 'alice@example.com', 'correct-horse')
+
+    def register(self, username, email):
+        return self.client.post(
+            '/api/auth/session/register/',
+            {'username': username, 'email': email, 'password': 'battery-staple'},
+            content_type='application/json',
+        )
+
+    def test_taken_username(self):
+        response = self.register('alice', 'other@example.com')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Username already exists')
+
+    def test_taken_email(self):
+        response = self.register('bob', 'alice@example.com')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'Email already exists')
+
+    def test_taken_field_uses_constraint_name(self):
+        # PostgreSQL's message for a username collision can still mention "email"
+        error = IntegrityError('duplicate key value violates unique constraint "auth_user_username_key"\n'
+                               'DETAIL:  Key (username)=(email-admin) already exists.')
+        error.__cause__ = _DriverError('auth_user_username_key')
+        self.assertEqual(_taken_field(error), 'Username')
+        error.__cause__ = _DriverError('auth_user_email_unique')
+        self.assertEqual(_taken_field(error), 'Email')
+        self.assertIsNone(_taken_field(IntegrityError('NOT NULL constraint failed: auth_user.password')))
+
+    def test_new_user(self):
+        response = self.register('bob', 'bob@example.com')
+        self.assertEqual(response.status_code, 201)
@@ -4,18 +4,34 @@ from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
-from auth_core.models import AuthenticationLog
+from django.db import IntegrityError, transaction
+from auth_core import throttling
+from auth_core.audit import log_authentication
+from auth_core.querybudget import query_budget
 
 
-def get_client_ip(request):
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0]
-    else:
-        ip = request.META.get('REMOTE_ADDR')
-    return ip
+EMAIL_CONSTRAINT = 'auth_user_email_unique'  # added by auth_session migration 0001
+USERNAME_CONSTRAINT = 'auth_user_username_key'  # PostgreSQL's name for the username unique index
+
+
+def _taken_field(error):
+    """
+    Name the field whose unique constraint an IntegrityError from creating a
+    user violated, or None for any other integrity error.
+    """
+    # psycopg reports the constraint name directly
+    diag = getattr(error.__cause__, 'diag', None)
+    violated = getattr(diag, 'constraint_name', None) or str(error)
+    # SQLite names the columns instead: "UNIQUE constraint failed: auth_user.email"
+    table = User._meta.db_table
+    if EMAIL_CONSTRAINT in violated or violated.endswith(f'{table}.email'):
+        return 'Email'
+    if USERNAME_CONSTRAINT in violated or violated.endswith(f'{table}.username'):
+        return 'Username'
+    return None
 
 
+@query_budget(11)
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def session_login(request):
@@ -32,15 +48,17 @@ def session_login(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
+    # Refuse locked-out usernames and clients before hashing the password
+    throttling.check(request, username=username)
+    
     user = authenticate(request, username=username, password=password)
+    if user is None:
+        throttling.failure(request, username=username)
     
     # Log authentication attempt
-    AuthenticationLog.objects.create(
+    log_authentication(
+        request, 'session', user is not None,
         user=user,
-        auth_method='session',
-        success=user is not None,
-        ip_address=get_client_ip(request),
-        user_agent=request.META.get('HTTP_USER_AGENT', ''),
         details={'username': username}
     )
     
@@ -72,6 +90,7 @@ def session_logout(request):
     return Response({'message': 'Logout successful'})
 
 
+@query_budget(2)
 @api_view(['GET'])
 def session_status(request):
     """
@@ -108,24 +127,23 @@ def register(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    if User.objects.filter(username=username).exists():
+    # A single INSERT; the unique constraints decide between concurrent signups
+    try:
+        with transaction.atomic():
+            user = User.objects.create_user(
+                username=username,
+                email=email,
+                password=password
+            )
+    except IntegrityError as e:
+        field = _taken_field(e)
+        if field is None:
+            raise
         return Response(
-            {'error': 'Username already exists'},
+            {'error': f'{field} already exists'},
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    if User.objects.filter(email=email).exists():
-        return Response(
-            {'error': 'Email already exists'},
-            status=status.HTTP_400_BAD_REQUEST
-        )
-    
-    user = User.objects.create_user(
-        username=username,
-        email=email,
-        password=password
-    )
-    
     return Response({
         'message': 'User registered successfully',
         'user': {
@@ -1,3 +1,27 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
 
-# Create your tests here.
+from auth_core.models import APIKey
+
+
+class APIKeyNetworkTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user('alice', 'alice@example.com', 'unused-password')
+        APIKey.objects.create(
+            user=user, key='k' * 64, name='office', allowed_networks='192.0.2.0/24', denied_networks='192.0.2.128/25',
+        )
+
+    def verify(self, remote_addr):
+        return self.client.get('/api/auth/token/api-key/verify/', HTTP_X_API_KEY='k' * 64, REMOTE_ADDR=remote_addr)
+
+    def test_allowed_network(self):
+        self.assertEqual(self.verify('192.0.2.10').status_code, 200)
+
+    def test_outside_allowed_networks(self):
+        response = self.verify('198.51.100.1')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['error'], 'API key is not allowed from this address')
+
+    def test_more_specific_denied_network(self):
+        self.assertEqual(self.verify('192.0.2.200').status_code, 403)
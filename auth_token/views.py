@@ -3,22 +3,18 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from django.contrib.auth import authenticate
+from django.core.exceptions import ValidationError
 from django.utils import timezone
-from auth_core.models import APIKey, AuthenticationLog
+from auth_core import networks, throttling
+from auth_core.audit import log_authentication
+from auth_core.context import get_context
+from auth_core.models import APIKey
+from auth_core.querybudget import query_budget
 import base64
 import hmac
 import hashlib
 
 
-def get_client_ip(request):
-    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-    if x_forwarded_for:
-        ip = x_forwarded_for.split(',')[0]
-    else:
-        ip = request.META.get('REMOTE_ADDR')
-    return ip
-
-
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def create_api_key(request):
@@ -28,10 +24,18 @@ def create_api_key(request):
     name = request.data.get('name', 'Default API Key')
     expires_at = request.data.get('expires_at')
     
+    try:
+        allowed_networks = networks.clean_networks(request.data.get('allowed_networks'))
+        denied_networks = networks.clean_networks(request.data.get('denied_networks'))
+    except ValidationError as e:
+        return Response({'error': e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
+    
     api_key = APIKey.objects.create(
         user=request.user,
         name=name,
-        expires_at=expires_at
+        expires_at=expires_at,
+        allowed_networks=allowed_networks,
+        denied_networks=denied_networks
     )
     
     return Response({
@@ -42,17 +46,22 @@ def create_api_key(request):
             'key': api_key.key,
             'created_at': api_key.created_at,
             'expires_at': api_key.expires_at,
+            'allowed_networks': networks.split_networks(api_key.allowed_networks),
+            'denied_networks': networks.split_networks(api_key.denied_networks),
         }
     }, status=status.HTTP_201_CREATED)
 
 
+@query_budget(3)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def list_api_keys(request):
     """
     List all API keys for the authenticated user.
     """
-    api_keys = APIKey.objects.filter(user=request.user)
+    api_keys = APIKey.objects.filter(user=request.user).only(
+        'id', 'name', 'key', 'is_active', 'created_at', 'last_used', 'expires_at'
+    )
     
     return Response({
         'api_keys': [
@@ -87,6 +96,7 @@ def revoke_api_key(request, key_id):
         )
 
 
+@query_budget(6)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def verify_api_key(request):
@@ -102,26 +112,38 @@ def verify_api_key(request):
             status=status.HTTP_401_UNAUTHORIZED
         )
     
+    throttling.check(request, api_key=api_key_value)
+    
     try:
-        api_key = APIKey.objects.get(key=api_key_value)
+        api_key = APIKey.objects.select_related('user').get(key=api_key_value)
         
         if not api_key.is_valid():
+            throttling.failure(request, api_key=api_key_value)
             return Response(
                 {'error': 'API key is invalid or expired'},
                 status=status.HTTP_401_UNAUTHORIZED
             )
         
+        ip_address = get_context(request).client_ip
+        if not networks.policy_for(api_key).permits(ip_address):
+            log_authentication(
+                request, 'api_key', False,
+                user=api_key.user,
+                details={'api_key_id': api_key.id, 'error': 'Source network not allowed'}
+            )
+            return Response(
+                {'error': 'API key is not allowed from this address'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
         # Update last used timestamp
         api_key.last_used = timezone.now()
         api_key.save(update_fields=['last_used'])
         
         # Log authentication
-        AuthenticationLog.objects.create(
+        log_authentication(
+            request, 'api_key', True,
             user=api_key.user,
-            auth_method='api_key',
-            success=True,
-            ip_address=get_client_ip(request),
-            user_agent=request.META.get('HTTP_USER_AGENT', ''),
             details={'api_key_id': api_key.id}
         )
         
@@ -135,14 +157,8 @@ def verify_api_key(request):
         })
         
     except APIKey.DoesNotExist:
-        AuthenticationLog.objects.create(
-            user=None,
-            auth_method='api_key',
-            success=False,
-            ip_address=get_client_ip(request),
-            user_agent=request.META.get('HTTP_USER_AGENT', ''),
-            details={'error': 'Invalid API key'}
-        )
+        throttling.failure(request, api_key=api_key_value)
+        log_authentication(request, 'api_key', False, details={'error': 'Invalid API key'})
         
         return Response(
             {'error': 'Invalid API key'},
@@ -150,6 +166,7 @@ def verify_api_key(request):
         )
 
 
+@query_budget(2)
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def verify_hmac(request):
@@ -178,6 +195,12 @@ def verify_hmac(request):
                 status=status.HTTP_401_UNAUTHORIZED
             )
         
+        if not networks.policy_for(api_key).permits(get_context(request).client_ip):
+            return Response(
+                {'error': 'API key is not allowed from this address'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
         # Verify HMAC signature
         body = request.body.decode('utf-8')
         message = f"{timestamp}{body}"
@@ -205,6 +228,7 @@ def verify_hmac(request):
         )
 
 
+@query_budget(6)
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def basic_auth(request):
@@ -225,15 +249,17 @@ def basic_auth(request):
         decoded_credentials = base64.b64decode(encoded_credentials).decode('utf-8')
         username, password = decoded_credentials.split(':', 1)
         
+        # Refuse locked-out usernames and clients before hashing the password
+        throttling.check(request, username=username)
+        
         user = authenticate(username=username, password=password)
+        if user is None:
+            throttling.failure(request, username=username)
         
         # Log authentication attempt
-        AuthenticationLog.objects.create(
+        log_authentication(
+            request, 'basic', user is not None,
             user=user,
-            auth_method='basic',
-            success=user is not None,
-            ip_address=get_client_ip(request),
-            user_agent=request.META.get('HTTP_USER_AGENT', ''),
             details={'username': username}
         )
         
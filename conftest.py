@@ -0,0 +1 @@
+pytest_plugins = ['auth_core.pytest_plugin', 'pytester']
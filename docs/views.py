@@ -574,7 +574,7 @@ def architecture_docs(request):
             'django_apps': {
                 'auth_core': {
                     'purpose': 'Core models and shared utilities',
-                    'models': ['APIKey', 'OAuthClient', 'SAMLServiceProvider', 'RoutingRule', 'AuthenticationLog'],
+                    'models': ['APIKey', 'OAuthClient', 'SAMLServiceProvider', 'RoutingRule', 'AuthenticationLog', 'UserAgent'],
                     'responsibilities': ['Shared data models', 'Admin interfaces', 'Common utilities']
                 },
                 'auth_session': {